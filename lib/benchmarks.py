@@ -0,0 +1,906 @@
+from models.car_rental_system_cli import CarRentalSystem, Car, Customer, Rental
+from seed import populate, HISTORY_START, MAKES, FIRST_NAMES, LAST_NAMES
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, select
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlalchemy
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def _percentile(timings, percent):
+    if len(timings) < 2:
+        return timings[0]
+    return statistics.quantiles(timings, n=100, method='inclusive')[percent - 1]
+
+
+def _summarize(timings):
+    return {
+        'calls': len(timings),
+        'p50_ms': round(_percentile(timings, 50), 4),
+        'p99_ms': round(_percentile(timings, 99), 4),
+        'ops_per_sec': round(len(timings) / (sum(timings) / 1000), 1) if sum(timings) else None,
+    }
+
+
+def _time_calls(method, calls):
+    timings = []
+    for args in calls:
+        started = time.perf_counter()
+        method(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+@contextmanager
+def _bench_database(cars, customers, rentals, seed=0):
+    with tempfile.TemporaryDirectory() as tmp:
+        car_rental_system = CarRentalSystem(os.path.join(tmp, "bench.db"))
+        populate(car_rental_system, cars, customers, rentals, seed)
+        try:
+            yield car_rental_system
+        finally:
+            car_rental_system.session.close()
+            car_rental_system.engine.dispose()
+
+
+def bench_availability(sizes, cars=1000, queries=50, seed=0):
+    rng = random.Random(seed)
+    print(f"find_available_cars over {cars} cars")
+    for size in sizes:
+        with _bench_database(cars, size, size, seed) as car_rental_system:
+            last_end = car_rental_system.session.scalar(select(func.max(Rental.end_date)))
+            history_days = (last_end - HISTORY_START).days
+
+            windows = []
+            for _ in range(queries):
+                start = HISTORY_START + timedelta(days=rng.randrange(history_days + 30))
+                windows.append((start, start + timedelta(days=rng.randrange(1, 14))))
+            timings = _time_calls(car_rental_system.find_available_cars, windows)
+
+        print(f"{size:>10} rentals: median {statistics.median(timings):.2f} ms, max {max(timings):.2f} ms")
+
+
+def bench_search(sizes, queries=50, seed=0):
+    rng = random.Random(seed)
+    print("search_cars / search_customers, top 10")
+    for size in sizes:
+        with _bench_database(size, size, 0, seed) as car_rental_system:
+            car_terms = [rng.choice(sorted(MAKES))[:3] for _ in range(queries)]
+            car_terms += [f"{rng.choice(MAKES[make])} {rng.randint(1, size)}" for make in rng.choices(sorted(MAKES), k=queries)]
+            customer_terms = [f"{rng.choice(FIRST_NAMES)[:2]} {rng.choice(LAST_NAMES)}" for _ in range(queries)]
+            customer_terms += [str(700000000 + rng.randrange(size))[:6] for _ in range(queries)]
+            cars = _time_calls(car_rental_system.search_cars, [(term,) for term in car_terms])
+            customers = _time_calls(car_rental_system.search_customers, [(term,) for term in customer_terms])
+
+        print(f"{size:>10} rows: cars p50 {_percentile(cars, 50):.2f} ms p99 {_percentile(cars, 99):.2f} ms, "
+              f"customers p50 {_percentile(customers, 50):.2f} ms p99 {_percentile(customers, 99):.2f} ms")
+
+
+def _operation_calls(car_rental_system, samples, rng):
+    # Builds the argument lists for every public operation up front, so only the calls are timed
+    session = car_rental_system.session
+    car_count = session.scalar(select(func.count(Car.id)))
+    customer_count = session.scalar(select(func.count(Customer.id)))
+    car_ids = [rng.randint(1, car_count) for _ in range(samples)]
+    customer_ids = [rng.randint(1, customer_count) for _ in range(samples)]
+    cars = {car.id: car for car in session.scalars(select(Car).where(Car.id.in_(set(car_ids))))}
+    customers = {c.id: c for c in session.scalars(select(Customer).where(Customer.id.in_(set(customer_ids))))}
+    booked_cars = rng.sample(range(1, car_count + 1), min(samples, car_count))
+    future = datetime(2100, 1, 1)
+
+    return [
+        ("add_car", car_rental_system.add_car,
+            [("Bench", f"Bench model {n}", 2024) for n in range(samples)]),
+        ("add_customer", car_rental_system.add_customer,
+            [("Bench", f"Customer {n}", 600000000 + n) for n in range(2 * samples)]),
+        ("find_car_by_id", car_rental_system.find_car_by_id, [(i,) for i in car_ids]),
+        ("find_car_by_name", car_rental_system.find_car_by_name,
+            [(cars[i].make, cars[i].model) for i in car_ids]),
+        ("find_customer_by_id", car_rental_system.find_customer_by_id, [(i,) for i in customer_ids]),
+        ("find_customer_by_name", car_rental_system.find_customer_by_name,
+            [(customers[i].first_name, customers[i].last_name) for i in customer_ids]),
+        ("get_cars_page", car_rental_system.get_cars_page, [(20, i) for i in car_ids]),
+        ("find_available_cars", car_rental_system.find_available_cars,
+            [(HISTORY_START + timedelta(days=rng.randrange(3650)),) * 2 for _ in range(samples)]),
+        ("update_car", car_rental_system.update_car, [(i, None, None, 2000 + n % 25) for n, i in enumerate(car_ids)]),
+        ("update_customer", car_rental_system.update_customer, [(i, "Updated") for i in customer_ids]),
+        # The customers created above have no rentals yet: the first half is booked, the second half deleted
+        ("register_customer_to_car", car_rental_system.register_customer_to_car,
+            [(customer_count + n + 1, car_id, future, future + timedelta(days=2))
+             for n, car_id in enumerate(booked_cars)]),
+        ("delete_car", car_rental_system.delete_car, [(car_count + n + 1,) for n in range(samples)]),
+        ("delete_customer", car_rental_system.delete_customer,
+            [(customer_count + samples + n + 1,) for n in range(samples)]),
+    ]
+
+
+def bench_operations(scales, samples=200, seed=0, output=None):
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'seed': seed,
+        'samples': samples,
+        'results': {},
+    }
+    for scale in scales:
+        rng = random.Random(seed)
+        results = report['results'][str(scale)] = {}
+        with _bench_database(scale, scale, scale, seed) as car_rental_system:
+            for name, method, calls in _operation_calls(car_rental_system, samples, rng):
+                # The methods report to the terminal; keep that out of the measurements
+                with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                    results[name] = _summarize(_time_calls(method, calls))
+
+        print(f"{scale} cars / customers / rentals")
+        for name, summary in results.items():
+            print(f"  {name:<26} p50 {summary['p50_ms']:>8.3f} ms  p99 {summary['p99_ms']:>8.3f} ms  "
+                  f"{summary['ops_per_sec']:>10} ops/sec")
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {output}")
+    return report
+
+
+def bench_export(sizes, formats=("csv", "jsonl"), seed=0):
+    # Exports the denormalized rentals view at each size and reports throughput and the
+    # peak Python memory of the export. Peak memory should stay flat as the table grows.
+    print(f"{'format':<8}{'rows':>10}{'seconds':>10}{'rows/sec':>12}{'peak MB':>10}")
+    peaks = {}
+    for size in sizes:
+        with _bench_database(1000, 1000, size, seed) as car_rental_system, tempfile.TemporaryDirectory() as tmp:
+            for format in formats:
+                tracemalloc.start()
+                result = car_rental_system.export("rental_details", os.path.join(tmp, f"out.{format}.gz"), format, True)
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+                peaks.setdefault(format, []).append(peak)
+                print(f"{format:<8}{result['rows']:>10}{result['elapsed']:>10.2f}"
+                      f"{result['rows'] / result['elapsed']:>12.0f}{peak:>10.2f}")
+    return peaks
+
+
+def bench_records(sizes, seed=0):
+    # Lists every car and customer once as ORM objects and once as plain row tuples, and
+    # reports the time and peak Python memory of each. Each run gets a fresh session so
+    # neither read path benefits from objects the other left in the identity map.
+    print(f"{'rows':>10}  {'read':<24}{'seconds':>10}{'rows/sec':>12}{'peak MB':>10}")
+    results = {}
+    for size in sizes:
+        with _bench_database(size, size, 0, seed) as car_rental_system:
+            for name in ("get_all_cars", "get_all_car_records", "get_all_customers", "get_all_customer_records"):
+                car_rental_system.session.close()
+                tracemalloc.start()
+                started = time.perf_counter()
+                rows = len(getattr(car_rental_system, name)())
+                elapsed = time.perf_counter() - started
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+                results.setdefault(name, []).append({'rows': rows, 'seconds': elapsed, 'peak_mb': peak})
+                print(f"{rows:>10}  {name:<24}{elapsed:>10.3f}{rows / elapsed:>12.0f}{peak:>10.2f}")
+    return results
+
+
+ALLOCATION_FILTERS = [None, "make = Toyota", "year >= 2020", "make = BMW and year >= 2015", "model ~ Camry"]
+
+
+def _allocation_requests(first_customer, count, rng, filters=ALLOCATION_FILTERS):
+    requests = []
+    for n in range(count):
+        start_date = HISTORY_START + timedelta(days=rng.randint(0, 60))
+        requests.append({
+            'customer_id': first_customer + n,
+            'start_date': start_date,
+            'end_date': start_date + timedelta(days=rng.randint(1, 10)),
+            'filter': rng.choice(filters),
+        })
+    return requests
+
+
+def _overlapping_bookings(car_rental_system):
+    return car_rental_system.session.execute(sqlalchemy.text(
+        "SELECT COUNT(*) FROM rentals a JOIN rentals b ON a.car_id = b.car_id AND a.id < b.id "
+        "AND a.start_date <= b.end_date AND a.end_date >= b.start_date"
+    )).scalar()
+
+
+def bench_allocation(request_counts=(1000, 10000), cars=50000, baseline=200, seed=0):
+    # Books batches of requests for "any car matching this filter" against a fleet that
+    # already has a booking per car, with allocate_cars and, for a small sample limited to
+    # filters on make, with find_available_cars + register_customer_to_car per request.
+    # Exits non-zero if any car ends up double booked.
+    rng = random.Random(seed)
+    print(f"{cars} cars, {cars} existing rentals, filters: {', '.join(map(str, ALLOCATION_FILTERS))}")
+    print(f"{'method':<24}{'requests':>10}{'assigned':>10}{'seconds':>10}{'requests/sec':>14}")
+    overlaps = 0
+    for count in request_counts:
+        with _bench_database(cars, cars, cars, seed) as car_rental_system:
+            car_rental_system.upsert_customers([
+                {'first_name': "Batch", 'last_name': "Customer", 'phone_no': 800000000 + n} for n in range(count + baseline)
+            ])
+            first_customer = cars + 1
+            report = car_rental_system.allocate_cars(_allocation_requests(first_customer, count, rng))
+            print(f"{'allocate_cars':<24}{count:>10}{report['assigned']:>10}{report['elapsed']:>10.2f}"
+                  f"{count / report['elapsed']:>14.0f}")
+            if count == request_counts[0] and baseline:
+                assigned = 0
+                started = time.perf_counter()
+                with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                    for request in _allocation_requests(first_customer + count, baseline, rng, [None, {'make': "Toyota"}]):
+                        available = car_rental_system.find_available_cars(
+                            request['start_date'], request['end_date'], (request['filter'] or {}).get('make'))
+                        assigned += bool(available) and car_rental_system.register_customer_to_car(
+                            request['customer_id'], available[0].id, request['start_date'], request['end_date'])
+                elapsed = time.perf_counter() - started
+                print(f"{'one request at a time':<24}{baseline:>10}{assigned:>10}{elapsed:>10.2f}"
+                      f"{baseline / elapsed:>14.0f}")
+            overlaps += _overlapping_bookings(car_rental_system)
+    print(f"{overlaps} double bookings")
+    return overlaps == 0
+
+
+def bench_render(sizes, seed=0):
+    # Writes every car to /dev/null the way the listings used to (one print() per row, line
+    # buffered as on a terminal and block buffered as into a pipe) and with models.render in
+    # each format, against the time to read the rows. Rows are read once up front so the
+    # timings cover output only.
+    from helpers import CAR_COLUMNS, _all_records
+    from models.render import FORMATS, render
+    from operator import attrgetter
+    print(f"{'rows':>10}  {'output':<16}{'seconds':>10}{'rows/sec':>12}")
+    results = {}
+    for size in sizes:
+        with _bench_database(size, 0, 0, seed) as car_rental_system:
+            started = time.perf_counter()
+            cars = list(_all_records(car_rental_system.get_car_records))
+            timings = {'query': time.perf_counter() - started}
+            # A terminal's stdout is line buffered, so there each print() is a write of its own
+            for name, buffering in (('print, terminal', 1), ('print, pipe', -1)):
+                with open(os.devnull, 'w', buffering=buffering) as devnull, redirect_stdout(devnull):
+                    started = time.perf_counter()
+                    for car in cars:
+                        print(f"Make: {car.make}, Model: {car.model}, Year: {car.year}")
+                    timings[name] = time.perf_counter() - started
+            with open(os.devnull, 'w') as devnull:
+                for format in FORMATS:
+                    started = time.perf_counter()
+                    render(map(attrgetter(*CAR_COLUMNS), cars), CAR_COLUMNS, devnull, format)
+                    timings[format] = time.perf_counter() - started
+            for name, elapsed in timings.items():
+                results.setdefault(name, []).append({'rows': size, 'seconds': elapsed})
+                print(f"{size:>10}  {name:<16}{elapsed:>10.3f}{size / elapsed:>12.0f}")
+    return results
+
+
+def check_render_widths(rows=3000):
+    # Rows past the sample, and past the first chunk, whose values are longer than any the
+    # sample held must come out whole in the table, except text past MAX_WIDTH, which must
+    # end in the ellipsis. Exits non-zero on any value cut or left unmarked.
+    from helpers import CAR_COLUMNS
+    from models.render import ELLIPSIS, MAX_WIDTH, render
+    import io
+    long_text = "Model with a name longer than any column may be shown at"
+    cars = [(n, "Make", f"Model {n}", 2000) for n in range(1, rows + 1)]
+    cars += [(10000, "Make", "Model 12000", 2000), (123456789, "X" * 60, long_text, None), (7, "Make", None, 19999)]
+    out = io.StringIO()
+    render(iter(cars), CAR_COLUMNS, out, 'table', sample_size=100)
+    lines = out.getvalue().splitlines()[1:]
+    ok = len(lines) == len(cars)
+    for car, line in zip(cars, lines):
+        expected = [str(value) if value is not None else '' for value in car]
+        expected = [text if len(text) <= MAX_WIDTH else text[:MAX_WIDTH - 1] + ELLIPSIS for text in expected]
+        if line.split()[0] != expected[0] or not all(text in line for text in expected) or 'None' in line:
+            print(f"cut   {car!r} -> {line!r}")
+            ok = False
+    print(f"{'ok' if ok else 'FAIL'}  {len(cars)} rows rendered with values wider than the sample intact")
+    return ok
+
+
+def _bill_in_python(car_rental_system, rates):
+    # The loop billing replaces: every Rental and its Car loaded as ORM objects and priced a day at a time
+    totals = {}
+    for rental in car_rental_system.session.query(Rental).options(sqlalchemy.orm.joinedload(Rental.car)):
+        start, end = rental.start_date.date(), rental.end_date.date()
+        days = (end - start).days + 1
+        weekend_days = sum((start + timedelta(days=n)).weekday() >= 5 for n in range(days))
+        rate = rates['makes'].get(rental.car.make, rates['daily'])
+        discount = rates['older_discount'] if start.year - rental.car.year > rates['older_than_years'] else 0
+        totals[rental.customer_id] = totals.get(rental.customer_id, 0) + round(
+            rate * (days + weekend_days * rates['weekend_surcharge']) * (1 - discount), 2)
+    return totals
+
+
+def bench_billing(sizes, python_limit=100000, seed=0):
+    # Prices every rental and totals it per customer with each pricing method available
+    # (NumPy only when installed), and with the per-rental Python loop up to python_limit
+    # rentals. Exits non-zero if the methods disagree on any customer's total.
+    from models.billing import METHODS, invoice_totals, load_rates, numpy
+    rates = load_rates()
+    methods = [method for method in METHODS if method != 'numpy' or numpy is not None]
+    print(f"NumPy {'available' if numpy is not None else 'not installed'}")
+    print(f"{'rentals':>10}  {'method':<8}{'customers':>10}{'seconds':>10}{'rentals/sec':>14}{'peak MB':>10}")
+    agree = True
+    for size in sizes:
+        with _bench_database(max(size // 20, 1), max(size // 10, 1), size, seed) as car_rental_system:
+            results = {}
+            for method in methods + (['python'] if size <= python_limit else []):
+                def bill():
+                    car_rental_system.session.close()
+                    if method == 'python':
+                        return _bill_in_python(car_rental_system, rates)
+                    with car_rental_system.engine.connect() as conn:
+                        return {customer: sums[3] for customer, sums in
+                                invoice_totals(conn, rates, None, None, method).items()}
+
+                # Timed and measured in separate runs, since tracing allocations slows NumPy down most
+                started = time.perf_counter()
+                totals = bill()
+                elapsed = time.perf_counter() - started
+                tracemalloc.start()
+                bill()
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+                results[method] = {customer: round(amount, 2) for customer, amount in totals.items()}
+                print(f"{size:>10}  {method:<8}{len(totals):>10}{elapsed:>10.2f}{size / elapsed:>14.0f}{peak:>10.2f}")
+            agree = agree and all(totals == results[methods[0]] for totals in results.values())
+    print("all methods agree" if agree else "FAIL: methods disagree")
+    return agree
+
+
+def _replay(car_rental_system):
+    # Rebuilds every journaled table from the change journal alone
+    tables = {}
+    for entry in car_rental_system.changes_since(0):
+        rows = tables.setdefault(entry['table'], {})
+        if entry['operation'] == 'delete':
+            rows.pop(entry['row_id'], None)
+        else:
+            rows[entry['row_id']] = entry['after']
+    return tables
+
+
+def _journal_matches(car_rental_system):
+    from models.journal import JOURNALED_COLUMNS
+    replayed = _replay(car_rental_system)
+    with car_rental_system.engine.connect() as conn:
+        for table, columns in JOURNALED_COLUMNS.items():
+            rows = {row[0]: dict(zip(columns, row)) for row in
+                    conn.exec_driver_sql(f"SELECT {', '.join(columns)} FROM {table}")}
+            if rows != replayed.get(table, {}):
+                print(f"FAIL: replaying the journal does not rebuild {table}")
+                return False
+    return True
+
+
+def check_change_journal(cars=2000, upserts=20000, seed=0):
+    # Changes every table through each write path (single-row methods, upserts, bulk
+    # filters, allocation and file imports), then checks that replaying changes_since(0)
+    # rebuilds all three tables exactly, before and after compacting the journal. Also
+    # times a bulk upsert with and without the journal's triggers.
+    from models.journal import JOURNALED_COLUMNS
+    rng = random.Random(seed)
+    ok = True
+    with _bench_database(cars, cars, cars // 2, seed) as car_rental_system:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            car_rental_system.add_car("Toyota", "Journal", 2020)
+            car_rental_system.update_car(1, new_model="Renamed")
+            car_rental_system.update_car(2, new_year=2001)
+            car_rental_system.delete_car(3)
+            car_rental_system.add_customer("Jo", "Urnal", 700000001)
+            car_rental_system.update_customer(1, new_last_name="Changed")
+            car_rental_system.delete_customer(cars)
+            car_rental_system.upsert_cars([{'make': "Ford", 'model': f"Upsert {n}", 'year': 2010} for n in range(100)])
+            car_rental_system.bulk_update_cars("make = Honda", {'year': 2019})
+            car_rental_system.bulk_delete_customers("last_name = Smith")
+            car_rental_system.upsert_customers([
+                {'first_name': "Batch", 'last_name': "Customer", 'phone_no': 800000000 + n} for n in range(200)])
+            first_customer = car_rental_system.session.execute(select(func.max(Customer.id))).scalar() - 199
+            car_rental_system.allocate_cars(_allocation_requests(first_customer, 200, rng))
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "cars.jsonl")
+                with open(path, 'w') as file:
+                    for n in range(500):
+                        file.write(json.dumps({'make': "Audi", 'model': f"Imported {n}", 'year': 2015}) + "\n")
+                car_rental_system.bulk_import_cars(path)
+        entries = car_rental_system.journal_seq()
+        print(f"{entries} journal entries after {cars} cars, customers and rentals and a mix of every write path")
+        ok = _journal_matches(car_rental_system) and ok
+        result = car_rental_system.compact_journal()
+        print(f"compacted: {result['removed']} removed, {result['kept']} kept")
+        ok = _journal_matches(car_rental_system) and ok
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            car_rental_system.add_car("Toyota", "After compaction", 2021)
+        if car_rental_system.journal_seq() != entries + 1:
+            print("FAIL: sequence numbers did not carry on after compaction")
+            ok = False
+
+    print(f"{'journal':<10}{'upserts':>10}{'seconds':>10}{'rows/sec':>12}")
+    for journal in (False, True):
+        with _bench_database(0, 0, 0, seed) as car_rental_system:
+            if not journal:
+                with car_rental_system.engine.begin() as conn:
+                    for table in JOURNALED_COLUMNS:
+                        for operation in ("insert", "update", "delete"):
+                            conn.exec_driver_sql(f"DROP TRIGGER {table}_journal_{operation}")
+            records = [{'make': "Ford", 'model': f"Model {n}", 'year': 2000 + n % 20} for n in range(upserts)]
+            started = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                car_rental_system.upsert_cars(records)
+            elapsed = time.perf_counter() - started
+            print(f"{'on' if journal else 'off':<10}{upserts:>10}{elapsed:>10.2f}{upserts / elapsed:>12.0f}")
+    print("journal replays match the tables" if ok else "FAIL: journal check failed")
+    return ok
+
+
+def _run_cli(cwd, keystrokes, *flags):
+    cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, *flags, cli], input=keystrokes, cwd=cwd, capture_output=True, text=True)
+    return (time.perf_counter() - started) * 1000, result.stderr
+
+
+def bench_startup(runs=5, top=10):
+    # Time from launch to exit for "show the menu and quit" and for "list the first page of cars",
+    # plus a -X importtime breakdown of what the launch spends its time importing.
+    with tempfile.TemporaryDirectory() as tmp:
+        first_launch, _ = _run_cli(tmp, "2\nq\n0\n")
+        menu = [_run_cli(tmp, "0\n")[0] for _ in range(runs)]
+        first_query = [_run_cli(tmp, "2\nq\n0\n")[0] for _ in range(runs)]
+        _, menu_imports = _run_cli(tmp, "0\n", "-X", "importtime")
+        _, query_imports = _run_cli(tmp, "2\nq\n0\n", "-X", "importtime")
+
+    print(f"new database, first listing: {first_launch:.0f} ms")
+    print(f"menu only (median of {runs}):   {statistics.median(menu):.0f} ms")
+    print(f"first listing (median of {runs}): {statistics.median(first_query):.0f} ms")
+    for label, report in (("menu only", menu_imports), ("first listing", query_imports)):
+        # Lines look like "import time:  self | cumulative | package"; top-level packages have no indent
+        imports = []
+        for line in report.splitlines():
+            parts = line.split("|")
+            if line.startswith("import time:") and len(parts) == 3 and parts[1].strip().isdigit():
+                if not parts[2].startswith("  "):
+                    imports.append((int(parts[1]), parts[2].strip()))
+        imports.sort(reverse=True)
+        print(f"slowest imports, {label}:")
+        for cumulative, package in imports[:top]:
+            print(f"  {cumulative / 1000:>8.1f} ms  {package}")
+
+
+def _upsert_worker(db_name, worker, rows, overlap, batch_size):
+    # Each worker's models overlap with its neighbour's, so processes race for the same keys
+    car_rental_system = CarRentalSystem(db_name)
+    first = worker * (rows - overlap)
+    records = [{'make': "Race", 'model': f"Race {n}", 'year': 2000 + worker} for n in range(first, first + rows)]
+    counts = {'created': 0, 'updated': 0, 'unchanged': 0, 'rejected': 0, 'failed': 0}
+    for offset in range(0, rows, batch_size):
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            result = car_rental_system.upsert_cars(records[offset:offset + batch_size], update=worker % 2 == 1)
+        if result is None:
+            counts['failed'] += 1
+            continue
+        for status in counts:
+            counts[status] += result.get(status, 0)
+    return counts
+
+
+def check_concurrent_upserts(processes=8, rows=2000, overlap=1000, batch_size=100):
+    # Runs many processes upserting overlapping cars into one database file. Passes when no
+    # batch failed and every distinct model was created exactly once.
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "upserts.db")
+        CarRentalSystem(db_name).engine.dispose()
+        started = time.perf_counter()
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(_upsert_worker, [(db_name, n, rows, overlap, batch_size) for n in range(processes)])
+        elapsed = time.perf_counter() - started
+        car_rental_system = CarRentalSystem(db_name)
+        stored = car_rental_system.session.scalar(select(func.count(Car.id)))
+        car_rental_system.session.close()
+
+    totals = {status: sum(result[status] for result in results) for status in results[0]}
+    expected = processes * (rows - overlap) + overlap
+    print(f"{processes} processes, {processes * rows} upserts in {elapsed:.2f}s "
+          f"({processes * rows / elapsed:.0f} rows/sec): {totals}")
+    print(f"{stored} cars stored, {expected} distinct models expected")
+    return totals['failed'] == 0 and totals['created'] == stored == expected
+
+
+def _increment_worker(db_name, worker, increments, cars, checked):
+    # A terminal that reads a car and writes back its year + 1, over and over. With checked,
+    # each write names the version it read, and one refused because the car changed in the
+    # meantime is read and tried again.
+    car_rental_system = CarRentalSystem(db_name)
+    rng = random.Random(worker)
+    done = refused = 0
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        while done < increments:
+            car = car_rental_system.find_car_record_by_id(rng.randint(1, cars))
+            if car_rental_system.update_car(car.id, new_year=car.year + 1,
+                                            expected_version=car.version if checked else None):
+                done += 1
+            else:
+                refused += 1
+    car_rental_system.session.close()
+    return done, refused, car_rental_system.lock_retries
+
+
+def check_lost_updates(writer_counts=(1, 8, 16), increments=200, cars=4):
+    # Many processes increment a handful of cars' years at once, each a read-modify-write
+    # through update_car. Every increment that reported success must show up in the
+    # database: passes when none were lost with expected_version. The same run without it
+    # shows how many a plain last-writer-wins update loses.
+    print(f"{cars} cars, {increments} increments per writer, {os.cpu_count()} CPUs")
+    print(f"{'writers':>8}  {'versions':<10}{'seconds':>9}{'updates/sec':>13}{'refused':>9}{'lock retries':>14}{'lost':>7}")
+    ok = True
+    for writers in writer_counts:
+        for checked in (True, False) if writers == max(writer_counts) else (True,):
+            with tempfile.TemporaryDirectory() as tmp:
+                db_name = os.path.join(tmp, "stress.db")
+                setup = CarRentalSystem(db_name)
+                setup.upsert_cars([{'make': "Stress", 'model': f"Stress {n}", 'year': 2000} for n in range(cars)])
+                setup.session.close()
+                started = time.perf_counter()
+                with multiprocessing.Pool(writers) as pool:
+                    results = pool.starmap(_increment_worker,
+                                           [(db_name, n, increments, cars, checked) for n in range(writers)])
+                elapsed = time.perf_counter() - started
+                stored = setup.session.scalar(select(func.sum(Car.year))) - 2000 * cars
+                setup.session.close()
+                setup.engine.dispose()
+            done, refused, retries = (sum(column) for column in zip(*results))
+            lost = done - stored
+            ok = ok and (lost == 0 or not checked)
+            print(f"{writers:>8}  {'checked' if checked else 'ignored':<10}{elapsed:>9.2f}{done / elapsed:>13.0f}"
+                  f"{refused:>9}{retries:>14}{lost:>7}")
+    print("no lost updates with expected_version" if ok else "FAIL: updates were lost")
+    return ok
+
+
+def _shard_writer(db_names, worker, writes):
+    # One terminal adding cars one at a time, each in its own transaction
+    from models.sharding import ShardedCarRentalSystem
+    car_rental_system = ShardedCarRentalSystem(db_names)
+    failed = 0
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for n in range(writes):
+            failed += not car_rental_system.add_car("Shard", f"Shard {worker}-{n}", 2020)
+    car_rental_system.close()
+    return failed
+
+
+def bench_shard_writes(shard_counts=(1, 2, 4, 8), writers=8, writes=500):
+    # Several processes add cars at once. With one file every commit waits for the single
+    # database lock; with more shards the writes spread over independent files.
+    from models.sharding import ShardedCarRentalSystem
+    print(f"{writers} writers, {writes} single-row commits each, {os.cpu_count()} CPUs")
+    print(f"{'shards':>6}{'seconds':>10}{'writes/sec':>12}{'failed':>8}")
+    results = {}
+    for shard_count in shard_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_names = [os.path.join(tmp, f"branch{n}.db") for n in range(shard_count)]
+            ShardedCarRentalSystem(db_names).get_all_cars()
+            started = time.perf_counter()
+            with multiprocessing.Pool(writers) as pool:
+                failed = sum(pool.starmap(_shard_writer, [(db_names, n, writes) for n in range(writers)]))
+            elapsed = time.perf_counter() - started
+        results[shard_count] = writers * writes / elapsed
+        print(f"{shard_count:>6}{elapsed:>10.2f}{results[shard_count]:>12.0f}{failed:>8}")
+    return results
+
+
+def _replica_writer(db_name, worker, stop):
+    # Keeps updating cars until told to stop, committing each change on its own
+    car_rental_system = CarRentalSystem(db_name)
+    rng = random.Random(worker)
+    writes = 0
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        while not stop.is_set():
+            car_rental_system.update_car(rng.randint(1, 1000), new_year=rng.randint(2005, 2024))
+            writes += 1
+    return writes
+
+
+def bench_replica_reads(writers=2, reads=2000, max_age=1.0, seed=0):
+    # Times find_car_by_id and a page of the fleet while other processes keep writing,
+    # reading first from the database file and then from an in-memory replica
+    rng = random.Random(seed)
+    calls = [(rng.randint(1, 1000),) for _ in range(reads)]
+    print(f"{reads} reads with {writers} concurrent writers")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "replica.db")
+        populate(CarRentalSystem(db_name), 1000, 1000, 1000, seed)
+        for label, options in [("file", {}), (f"replica (max age {max_age}s)", {'replica_max_age': max_age})]:
+            car_rental_system = CarRentalSystem(db_name, **options)
+            car_rental_system.find_car_by_id(1)
+            with multiprocessing.Manager() as manager, multiprocessing.Pool(writers) as pool:
+                stop = manager.Event()
+                pending = pool.starmap_async(_replica_writer, [(db_name, n, stop) for n in range(writers)])
+                time.sleep(0.5)
+                lookups = _time_calls(car_rental_system.find_car_by_id, calls)
+                pages = _time_calls(car_rental_system.get_cars_page, [(20, after_id) for (after_id,) in calls[:reads // 10]])
+                stop.set()
+                writes = sum(pending.get())
+            results[label] = {'find_car_by_id': _summarize(lookups), 'get_cars_page': _summarize(pages)}
+            print(f"{label}: {writes} writes meanwhile, staleness {car_rental_system.replica_stats()}")
+            for name, summary in results[label].items():
+                print(f"  {name:<16} p50 {summary['p50_ms']:.3f} ms, p99 {summary['p99_ms']:.3f} ms")
+    return results
+
+
+def bench_group_commit(bookings=2000, submitters=8, max_delay=0.005, max_group=100):
+    # Books one rental per customer, first committing each booking on its own and then
+    # through a group-commit queue fed by several threads. Every tenth booking reuses a
+    # customer, so some operations in each group fail without affecting the others.
+    from concurrent.futures import ThreadPoolExecutor
+    cars = 100
+    requests = []
+    for n in range(1, bookings + 1):
+        customer = n - 1 if n % 10 == 0 else n
+        start = HISTORY_START + timedelta(days=3 * (n // cars))
+        requests.append((customer, n % cars + 1, start, start + timedelta(days=1)))
+    print(f"{bookings} bookings, {bookings // 10} of them for an already booked customer")
+    results = {}
+    for label in ("commit per booking", f"group commit ({submitters} threads)"):
+        with _bench_database(cars, bookings, 0) as car_rental_system, \
+                open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            started = time.perf_counter()
+            if label == "commit per booking":
+                outcomes = [car_rental_system.register_customer_to_car(*request) for request in requests]
+                stats = None
+            else:
+                with car_rental_system.group_commit(max_delay, max_group) as write_queue, \
+                        ThreadPoolExecutor(submitters) as pool:
+                    futures = list(pool.map(
+                        lambda request: write_queue.submit('register_customer_to_car', *request), requests
+                    ))
+                    outcomes = [future.result() for future in futures]
+                    stats = write_queue.stats()
+            elapsed = time.perf_counter() - started
+            stored = car_rental_system.session.scalar(select(func.count(Rental.id)))
+        results[label] = {'bookings_per_sec': round(bookings / elapsed), 'booked': outcomes.count(True),
+                          'stored': stored, 'groups': stats}
+        print(f"{label}: {bookings / elapsed:.0f} bookings/sec, {outcomes.count(True)} booked, "
+              f"{stored} stored" + (f", {stats['operations_per_group']} per group" if stats else ""))
+    return results
+
+
+def _service_client(url, deadline, worker, cars, phone_numbers):
+    # Mostly lookups, with some listing and one write in ten
+    import urllib.error
+    import urllib.request
+    rng = random.Random(worker)
+    timings, errors = [], 0
+    while time.perf_counter() < deadline:
+        roll = rng.random()
+        if roll < 0.8:
+            request = urllib.request.Request(f"{url}/cars/{rng.randint(1, cars)}")
+        elif roll < 0.9:
+            request = urllib.request.Request(f"{url}/cars?after_id={rng.randint(0, cars)}&limit=20")
+        else:
+            body = {'first_name': "Load", 'last_name': f"Test {worker}", 'phone_no': next(phone_numbers)}
+            request = urllib.request.Request(f"{url}/customers", json.dumps(body).encode(), method="POST")
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+        except (urllib.error.URLError, OSError):
+            errors += 1
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, errors
+
+
+def bench_service(concurrency=(1, 4, 16, 32), seconds=5, url=None, workers=8, cars=1000):
+    # Load-tests the JSON API at several concurrency levels. Without a url a local server
+    # is started on a temporary database.
+    from concurrent.futures import ThreadPoolExecutor
+    from itertools import count
+    phone_numbers = count(800000000)
+    server = None
+    with tempfile.TemporaryDirectory() as tmp:
+        if url is None:
+            db_name = os.path.join(tmp, "service.db")
+            populate(CarRentalSystem(db_name), cars, cars, cars)
+            server = subprocess.Popen(
+                [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+                 "--db", db_name, "--port", "0", "--workers", str(workers), "--quiet"],
+                stdout=subprocess.PIPE, text=True,
+            )
+            url = next(word for word in server.stdout.readline().split() if word.startswith("http://"))
+        print(f"{url}: {seconds}s per level")
+        print(f"{'clients':>8}{'requests':>10}{'req/sec':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        results = {}
+        try:
+            for clients in concurrency:
+                deadline = time.perf_counter() + seconds
+                with ThreadPoolExecutor(clients) as pool:
+                    outcomes = list(pool.map(lambda n: _service_client(url, deadline, n, cars, phone_numbers),
+                                             range(clients)))
+                timings = [timing for worker_timings, _ in outcomes for timing in worker_timings]
+                errors = sum(worker_errors for _, worker_errors in outcomes)
+                results[clients] = {**_summarize(timings), 'requests_per_sec': round(len(timings) / seconds, 1),
+                                    'errors': errors}
+                print(f"{clients:>8}{len(timings):>10}{len(timings) / seconds:>10.0f}"
+                      f"{results[clients]['p50_ms']:>10.2f}{results[clients]['p99_ms']:>10.2f}{errors:>8}")
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _count_statements(engine, call):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            call()
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return len(statements)
+
+
+def check_relationship_queries(sizes=(50, 1000)):
+    # Loads the relationship views for a car and a customer with short and long rental
+    # histories and touches every related row. Passes when the number of statements
+    # issued does not grow with the history, i.e. there is no N+1 loading.
+    def views(car_rental_system):
+        def touch(rows):
+            # Reading the related objects would lazy load them if they were not eager loaded
+            return [(rental.car.make, rental.customer.first_name) for rental in rows]
+
+        return {
+            "get_rental_history_for_car": lambda: touch(car_rental_system.get_rental_history_for_car(1)),
+            "get_rental_history_for_customer": lambda: touch(car_rental_system.get_rental_history_for_customer(1)),
+            "get_customers_in_a_car": lambda: [c.last_name for c in car_rental_system.get_customers_in_a_car(1)],
+            "get_cars_with_current_renter":
+                lambda: [(car.make, customer and customer.last_name)
+                         for car, customer in car_rental_system.get_cars_with_current_renter(HISTORY_START)],
+        }
+
+    counts = {}
+    for size in sizes:
+        # One car and one customer carry `size` rentals each, the rest of the rows are spread out
+        with tempfile.TemporaryDirectory() as tmp:
+            car_rental_system = CarRentalSystem(os.path.join(tmp, "relations.db"))
+            populate(car_rental_system, size, size, 0)
+            rentals = [{'customer_id': 1, 'car_id': n, 'start_date': HISTORY_START + timedelta(days=2 * n),
+                        'end_date': HISTORY_START + timedelta(days=2 * n + 1)} for n in range(1, size + 1)]
+            rentals += [{'customer_id': n, 'car_id': 1, 'start_date': HISTORY_START + timedelta(days=2 * n),
+                         'end_date': HISTORY_START + timedelta(days=2 * n + 1)} for n in range(2, size + 1)]
+            car_rental_system.session.execute(sqlalchemy.insert(Rental), rentals)
+            car_rental_system.session.commit()
+            for name, call in views(car_rental_system).items():
+                car_rental_system.session.expire_all()
+                counts.setdefault(name, []).append(_count_statements(car_rental_system.engine, call))
+            car_rental_system.session.close()
+            car_rental_system.engine.dispose()
+
+    failures = 0
+    for name, per_size in counts.items():
+        ok = len(set(per_size)) == 1
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: " + ", ".join(
+            f"{count} statements with {size} rentals" for size, count in zip(sizes, per_size)))
+    return failures == 0
+
+
+def check_query_plans():
+    # Runs every finder against a small database, captures the SQL it issues and asks
+    # SQLite how it would execute it. A finder fails if it scans a table it looks up.
+    failures = 0
+    with _bench_database(100, 1000, 1000) as car_rental_system:
+        car = car_rental_system.session.get(Car, 1)
+        customer = car_rental_system.session.get(Customer, 1)
+        finders = [
+            ("find_car_by_id", lambda: car_rental_system.find_car_by_id(1), "cars"),
+            ("find_car_by_name", lambda: car_rental_system.find_car_by_name(car.make, car.model), "cars"),
+            ("find_customer_by_id", lambda: car_rental_system.find_customer_by_id(1), "customers"),
+            ("find_customer_by_name",
+                lambda: car_rental_system.find_customer_by_name(customer.first_name, customer.last_name), "customers"),
+            ("find_available_cars",
+                lambda: car_rental_system.find_available_cars(HISTORY_START, HISTORY_START), "rentals"),
+        ]
+
+        for name, call, table in finders:
+            statements = []
+
+            def capture(conn, cursor, statement, parameters, context, executemany):
+                if statement.lstrip().upper().startswith("SELECT"):
+                    statements.append((statement, parameters))
+
+            event.listen(car_rental_system.engine, "before_cursor_execute", capture)
+            try:
+                with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                    call()
+            finally:
+                event.remove(car_rental_system.engine, "before_cursor_execute", capture)
+
+            with car_rental_system.engine.connect() as conn:
+                plan = [
+                    row[3]
+                    for statement, parameters in statements
+                    for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+                ]
+            lookups = [step for step in plan if f" {table} " in f"{step} "]
+            ok = bool(lookups) and all(step.startswith("SEARCH") for step in lookups)
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {name}: {'; '.join(plan)}")
+
+    return failures == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Car Rental System benchmarks")
+    parser.add_argument("benchmark", choices=["operations", "allocation", "availability", "billing", "search", "export", "group-commit", "journal", "lost-updates", "plans", "records", "relations", "render", "replica", "service", "shards", "startup", "upserts"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--samples", type=int, default=200, help="calls timed per operation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", metavar="PATH", help="write results as JSON")
+    parser.add_argument("--url", help="service benchmark: load-test this running server instead of starting one")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32], help="service benchmark: clients")
+    args = parser.parse_args()
+
+    if args.benchmark == "operations":
+        bench_operations(args.sizes, args.samples, args.seed, args.output)
+    elif args.benchmark == "allocation":
+        sys.exit(0 if bench_allocation() else 1)
+    elif args.benchmark == "availability":
+        bench_availability(args.sizes, seed=args.seed)
+    elif args.benchmark == "billing":
+        sys.exit(0 if bench_billing(args.sizes, seed=args.seed) else 1)
+    elif args.benchmark == "search":
+        bench_search(args.sizes, seed=args.seed)
+    elif args.benchmark == "export":
+        bench_export(args.sizes, seed=args.seed)
+    elif args.benchmark == "render":
+        bench_render(args.sizes, seed=args.seed)
+        sys.exit(0 if check_render_widths() else 1)
+    elif args.benchmark == "records":
+        bench_records(args.sizes, seed=args.seed)
+    elif args.benchmark == "replica":
+        bench_replica_reads()
+    elif args.benchmark == "service":
+        bench_service(args.concurrency, url=args.url)
+    elif args.benchmark == "shards":
+        bench_shard_writes()
+    elif args.benchmark == "lost-updates":
+        sys.exit(0 if check_lost_updates() else 1)
+    elif args.benchmark == "journal":
+        sys.exit(0 if check_change_journal() else 1)
+    elif args.benchmark == "group-commit":
+        bench_group_commit()
+    elif args.benchmark == "startup":
+        bench_startup()
+    elif args.benchmark == "upserts":
+        sys.exit(0 if check_concurrent_upserts() else 1)
+    elif args.benchmark == "relations":
+        sys.exit(0 if check_relationship_queries() else 1)
+    elif args.benchmark == "plans":
+        sys.exit(0 if check_query_plans() else 1)
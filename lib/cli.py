@@ -1,12 +1,6 @@
-from models.car_rental_system_cli import CarRentalSystem
-from datetime import datetime
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-engine = create_engine('sqlite:///car_rental_database.db')
-Session = sessionmaker(bind=engine)
-session = Session()
-
+import argparse
+import os
+import sys
 
 from helpers import (
     exit_program,
@@ -22,16 +16,166 @@ from helpers import (
     find_customer_by_name,
     update_customer,
     delete_customer,
-    register_customer_to_car
+    register_customer_to_car,
+    find_available_cars,
+    delete_rental,
+    get_rental_history_for_car,
+    get_rental_history_for_customer,
+    get_cars_with_current_renter,
+    bulk_update,
+    bulk_delete,
+    utilization_report,
+    search_cars,
+    search_customers,
+    bulk_import,
+    run_batch,
+    allocate_cars,
+    export_tables,
+    list_records,
+    print_changes,
+    compact_journal,
+    price_customer,
+    bill_month,
+    print_profile
 )
 
-def main():
-    car_rental_system = CarRentalSystem("car_rental_database.db")  
+class LazyCarRentalSystem:
+    # Stands in for CarRentalSystem so the menu shows before SQLAlchemy is imported;
+    # the real system is built the first time an option needs the database.
+    def __init__(self, *args, shards=None, branch=None):
+        self._args = args
+        self._shards = shards
+        self._branch = branch
+        self._system = None
+
+    def __getattr__(self, name):
+        if self._system is None:
+            if self._shards:
+                from models.sharding import ShardedCarRentalSystem
+                self._system = ShardedCarRentalSystem(self._shards, self._branch, *self._args[1:])
+            else:
+                from models.car_rental_system_cli import CarRentalSystem
+                self._system = CarRentalSystem(*self._args)
+        return getattr(self._system, name)
+
+def _positive_int(value):
+    # Sizes of batches, groups and chunks: 0 would read nothing and report success
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must be a whole number, not '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {number}")
+    return number
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Car Rental System")
+    parser.add_argument("--import-cars", metavar="PATH", help="bulk import cars from a CSV or JSON Lines file")
+    parser.add_argument("--import-customers", metavar="PATH", help="bulk import customers from a CSV or JSON Lines file")
+    parser.add_argument("--batch-size", type=_positive_int, default=500, help="rows per insert batch and transaction")
+    parser.add_argument("--batch", metavar="PATH", help="run operations from a JSON Lines file ('-' for stdin)")
+    parser.add_argument("--group-size", type=_positive_int, default=500, help="operations committed per transaction in batch mode")
+    parser.add_argument("--allocate", metavar="PATH",
+                        help="book cars for the rental requests in a CSV or JSON Lines file in one transaction")
+    parser.add_argument("--cache-size", type=int, default=0, help="cache up to N cars/customers looked up by ID")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="seconds a cached lookup stays valid")
+    parser.add_argument("--replica-max-age", type=float, metavar="SECONDS",
+                        help="serve listings and lookups from an in-memory copy refreshed after this many seconds")
+    parser.add_argument("--replica-max-writes", type=int, metavar="N",
+                        help="serve listings and lookups from an in-memory copy refreshed after N commits")
+    parser.add_argument("--profile", action="store_true", help="time every operation and its SQL, print a summary on exit")
+    parser.add_argument("--profile-output", metavar="PATH", help="also write the profile as JSON")
+    parser.add_argument("--slow-query-ms", type=float, default=50, help="log SQL statements slower than this")
+    parser.add_argument("--slow-query-log", metavar="PATH", help="append slow SQL statements to this file")
+    parser.add_argument("--export", nargs="+", metavar="NAME",
+                        help="stream cars, customers, rentals, rental_details and/or invoices to files")
+    parser.add_argument("--export-dir", default=".", help="directory the export files and manifest are written to")
+    parser.add_argument("--export-format", choices=["csv", "jsonl", "parquet"], default="csv",
+                        help="export file format (parquet needs pyarrow)")
+    parser.add_argument("--gzip", action="store_true", help="gzip the exported files")
+    parser.add_argument("--since", metavar="DIR", help="export only rows added since the export in DIR")
+    parser.add_argument("--chunk-size", type=_positive_int, default=5000, help="rows fetched and written at a time when exporting")
+    parser.add_argument("--bill-month", metavar="YYYY-MM", help="price the month's rentals and write its invoices")
+    parser.add_argument("--rates", metavar="PATH", help="JSON file of billing rates overriding the defaults")
+    parser.add_argument("--list", choices=["cars", "customers"],
+                        help="write every car or customer: a paged table on a terminal, TSV to a pipe or file")
+    parser.add_argument("--format", choices=["table", "tsv", "json"], help="output format for --list")
+    parser.add_argument("--changes-since", type=int, metavar="SEQ",
+                        help="write the change journal entries after SEQ to stdout as JSON Lines")
+    parser.add_argument("--tables", nargs="+", metavar="TABLE", help="only changes to these tables (cars, customers, rentals)")
+    parser.add_argument("--compact-journal", action="store_true",
+                        help="keep only the newest change journal entry for each row")
+    parser.add_argument("--through", type=int, metavar="SEQ", help="compact only the entries up to SEQ")
+    parser.add_argument("--shards", nargs="+", metavar="PATH",
+                        help="spread the data over one database file per branch instead of car_rental_database.db")
+    parser.add_argument("--branch", help="branch (shard file name without .db) new cars and customers are added to")
+    args = parser.parse_args(argv)
+    if args.shards and (args.import_cars or args.import_customers or args.batch or args.export
+                        or args.changes_since is not None or args.compact_journal):
+        parser.error("--import-*, --batch, --export and the change journal work on a single database, not with --shards")
+    if args.branch and not args.shards:
+        parser.error("--branch needs --shards")
+    if args.branch and args.branch not in [os.path.splitext(os.path.basename(shard))[0] for shard in args.shards]:
+        parser.error(f"--branch must name one of the --shards files, e.g. {os.path.splitext(os.path.basename(args.shards[0]))[0]}")
+
+    profiler = None
+    if args.profile or args.profile_output:
+        from models.profiler import Profiler
+        profiler = Profiler(args.slow_query_ms, args.slow_query_log)
+
+    car_rental_system = LazyCarRentalSystem("car_rental_database.db", args.cache_size, args.cache_ttl, profiler,
+                                            args.replica_max_age, args.replica_max_writes,
+                                            shards=args.shards, branch=args.branch)
+
+    if args.import_cars or args.import_customers:
+        ok = True
+        if args.import_cars:
+            ok = bulk_import(car_rental_system, "cars", args.import_cars, args.batch_size)
+        if args.import_customers and ok:
+            ok = bulk_import(car_rental_system, "customers", args.import_customers, args.batch_size)
+        if profiler is not None:
+            print_profile(profiler, args.profile_output)
+        sys.exit(0 if ok else 1)
+
+    if args.export:
+        ok = export_tables(car_rental_system, args.export, args.export_dir, args.export_format,
+                           args.gzip, args.since, args.chunk_size)
+        if profiler is not None:
+            print_profile(profiler, args.profile_output)
+        sys.exit(0 if ok else 1)
+
+    if args.allocate:
+        ok = allocate_cars(car_rental_system, args.allocate)
+        if profiler is not None:
+            print_profile(profiler, args.profile_output)
+        sys.exit(0 if ok else 1)
+
+    if args.list:
+        sys.exit(0 if list_records(car_rental_system, args.list, args.format) is not None else 1)
+
+    if args.changes_since is not None:
+        sys.exit(0 if print_changes(car_rental_system, args.changes_since, args.tables) else 1)
+
+    if args.compact_journal:
+        sys.exit(0 if compact_journal(car_rental_system, args.through) else 1)
+
+    if args.bill_month:
+        ok = bill_month(car_rental_system, args.bill_month, args.rates)
+        if profiler is not None:
+            print_profile(profiler, args.profile_output)
+        sys.exit(0 if ok else 1)
+
+    if args.batch:
+        ok = run_batch(car_rental_system, args.batch, args.group_size)
+        if profiler is not None:
+            print_profile(profiler, args.profile_output)
+        sys.exit(0 if ok else 1)
+
     while True:
         menu()
         choice = input("> ")
         if choice == "0":
-            exit_program(car_rental_system)
+            exit_program(car_rental_system, profiler, args.profile_output)
             
         elif choice == "1":
             make = input("Enter the car's make: ")
@@ -53,10 +197,16 @@ def main():
         
         elif choice == "5":
             car_id = input("Enter the car's ID: ")
+            # The version shown here is checked when saving, so a change another terminal
+            # makes while the new values are typed in is not overwritten. It is read fresh, as
+            # a cached or replica copy could already be behind.
+            car = car_rental_system.find_car_record_by_id(car_id, fresh=True)
+            if car:
+                print(f"Current: {car.make} {car.model} ({car.year})")
             new_make = input("Enter the new make: ")
             new_model = input("Enter the new model: ")
             new_year = input("Enter the new year: ")
-            update_car(car_rental_system, car_id, new_make, new_model, new_year)
+            update_car(car_rental_system, car_id, new_make, new_model, new_year, car.version if car else None)
         
         elif choice == "6":
             car_id = input("Enter the car's ID: ")
@@ -80,10 +230,14 @@ def main():
         
         elif choice == "11":
             customer_id = input("Enter the customer's ID: ")
+            customer = car_rental_system.find_customer_record_by_id(customer_id, fresh=True)
+            if customer:
+                print(f"Current: {customer.first_name} {customer.last_name}, {customer.phone_no}")
             new_first_name = input("Enter the new first name: ")
             new_last_name = input("Enter the new last name: ")
             new_phone_no = input("Enter the new phone number: ")
-            update_customer(car_rental_system, customer_id, new_first_name, new_last_name, new_phone_no)
+            update_customer(car_rental_system, customer_id, new_first_name, new_last_name, new_phone_no,
+                            customer.version if customer else None)
 
             
         elif choice == "12":
@@ -93,11 +247,65 @@ def main():
         elif choice == "13":
             customer_id = input("Enter the customer's ID: ")
             car_id = input("Enter the car's ID: ")
-            start_date_str = input("Enter the start date (optional): ")
-            end_date_str = input("Enter the end date (optional): ")
+            start_date_str = input("Enter the start date (DD/MM/YYYY): ")
+            end_date_str = input("Enter the end date (DD/MM/YYYY): ")
 
             register_customer_to_car(car_rental_system, customer_id, car_id, start_date_str, end_date_str)
 
+        elif choice == "14":
+            start_date_str = input("Enter the start date (DD/MM/YYYY): ")
+            end_date_str = input("Enter the end date (DD/MM/YYYY): ")
+            make = input("Enter the car's make (optional): ")
+            find_available_cars(car_rental_system, start_date_str, end_date_str, make)
+
+        elif choice == "17":
+            rental_id = input("Enter the rental's ID: ")
+            delete_rental(car_rental_system, rental_id)
+
+        elif choice == "18":
+            group_by = input("Group by (car, make, year, month; comma separated): ")
+            start_month = input("From month (YYYY-MM, optional): ")
+            end_month = input("To month (YYYY-MM, optional): ")
+            utilization_report(car_rental_system, group_by, start_month, end_month)
+
+        elif choice in ("19", "21"):
+            kind = "cars" if choice == "19" else "customers"
+            filter_expression = input(f"Filter {kind} (e.g. {'year < 2015 and make = Toyota' if kind == 'cars' else 'last_name = Doe'}): ")
+            assignments = input(f"New values (e.g. {'year=2020, make=Subaru' if kind == 'cars' else 'phone_no=0700000000'}): ")
+            bulk_update(car_rental_system, kind, filter_expression, assignments)
+
+        elif choice in ("20", "22"):
+            kind = "cars" if choice == "20" else "customers"
+            filter_expression = input(f"Filter {kind} to delete (e.g. {'year < 2010' if kind == 'cars' else 'first_name ~ Jo'}): ")
+            bulk_delete(car_rental_system, kind, filter_expression)
+
+        elif choice == "23":
+            car_id = input("Enter the car's ID: ")
+            get_rental_history_for_car(car_rental_system, car_id)
+
+        elif choice == "24":
+            customer_id = input("Enter the customer's ID: ")
+            get_rental_history_for_customer(car_rental_system, customer_id)
+
+        elif choice == "25":
+            get_cars_with_current_renter(car_rental_system)
+
+        elif choice == "26":
+            customer_id = input("Enter the customer's ID: ")
+            price_customer(car_rental_system, customer_id, args.rates)
+
+        elif choice == "27":
+            month = input("Billing month (YYYY-MM): ")
+            bill_month(car_rental_system, month, args.rates)
+
+        elif choice == "15":
+            query = input("Search cars (make, model or year): ")
+            search_cars(car_rental_system, query)
+
+        elif choice == "16":
+            query = input("Search customers (name or phone number): ")
+            search_customers(car_rental_system, query)
+
         else:
             print("Invalid choice!")
 
@@ -111,6 +319,8 @@ def menu():
     print("4. Find car by make and model")
     print("5. Update a car")
     print("6. Delete a car")
+    print("19.Bulk update cars matching a filter")
+    print("20.Bulk delete cars matching a filter")
     print("**************************CUSTOMERS*************************")
     print("7. Add a customer")
     print("8. Get all customers")
@@ -118,8 +328,23 @@ def menu():
     print("10.Find customer by name")
     print("11.Update a customer")
     print("12.Delete a customer")
+    print("21.Bulk update customers matching a filter")
+    print("22.Bulk delete customers matching a filter")
     print("**************************RENTALS*************************")
     print("13.Register customer to a car")
+    print("14.Find available cars for a period")
+    print("17.Delete a rental")
+    print("23.Rental history for a car")
+    print("24.Rental history for a customer")
+    print("25.All cars with their current renter")
+    print("**************************REPORTS*************************")
+    print("18.Fleet utilization report")
+    print("**************************BILLING*************************")
+    print("26.Price a customer's rentals")
+    print("27.Bill a month and write its invoices")
+    print("**************************SEARCH*************************")
+    print("15.Search cars")
+    print("16.Search customers")
     
     
 
@@ -1,11 +1,25 @@
-from models.car_rental_system_cli import CarRentalSystem
-from models.car_rental_system_cli import Customer
-from datetime import datetime
+from contextlib import redirect_stdout
+from itertools import islice
+from operator import attrgetter
+from models.render import render
+import io
+import json
+import os
+import sys
+import time
 
 
-def exit_program(car_rental_system):
+def exit_program(car_rental_system, profiler=None, profile_output=None):
+    if profiler is not None:
+        print_profile(profiler, profile_output)
     print("Nice having you🤗")
     exit()
+
+def print_profile(profiler, profile_output=None):
+    print(profiler.summary())
+    if profile_output:
+        profiler.dump_json(profile_output)
+        print(f"Profile written to {profile_output}")
     
 def add_car(car_rental_system, make, model, year):
     if not make or not model or not year:
@@ -15,28 +29,77 @@ def add_car(car_rental_system, make, model, year):
     car_rental_system.add_car(make, model, year)
     print("Car added successfully!")
 
-def get_all_cars(car_rental_system):
-    cars = car_rental_system.get_all_cars()
-    for car in cars:
-        print(f"Make: {car.make}, Model: {car.model}, Year: {car.year}")
+# Columns shown for cars and customers, in the menus and in --list
+CAR_COLUMNS = ('id', 'make', 'model', 'year')
+CUSTOMER_COLUMNS = ('id', 'first_name', 'last_name', 'phone_no')
+
+def _table(records, columns, page=None):
+    # Menu listings are always tables, shown through a pager when they outgrow the terminal
+    return render(map(attrgetter(*columns), records), columns, format='table', page=page)
+
+def _browse(get_page, columns, page_size=20):
+    # Page through a listing with next/previous, fetching one keyset page at a time
+    page = get_page(page_size)
+    if not page:
+        print("No records found.")
+        return
+    while True:
+        _table(page, columns, page=False)
+        choice = input("[n]ext, [p]revious or [q]uit: ").strip().lower()
+        if choice == "n":
+            next_page = get_page(page_size, after_id=page[-1].id)
+            if next_page:
+                page = next_page
+            else:
+                print("End of list.")
+        elif choice == "p":
+            previous_page = get_page(page_size, before_id=page[0].id)
+            if previous_page:
+                page = previous_page
+            else:
+                print("Start of list.")
+        else:
+            return
+
+def get_all_cars(car_rental_system, page_size=20):
+    _browse(car_rental_system.get_car_records, CAR_COLUMNS, page_size)
+
+def _all_records(get_page, batch_size=1000):
+    # Every record in id order, fetched a keyset page at a time as the renderer asks for them
+    page = get_page(batch_size)
+    while page:
+        yield from page
+        page = get_page(batch_size, after_id=page[-1].id)
+
+def list_records(car_rental_system, kind, format=None, out=None):
+    # Writes every car or customer as a table on a terminal, and as TSV (or JSON Lines) to a pipe or file
+    if kind == "cars":
+        get_page, columns = car_rental_system.get_car_records, CAR_COLUMNS
+    else:
+        get_page, columns = car_rental_system.get_customer_records, CUSTOMER_COLUMNS
+    try:
+        return render(map(attrgetter(*columns), _all_records(get_page)), columns, out, format)
+    except ValueError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return None
 
 def find_car_by_id(car_rental_system, car_id):
-    car = car_rental_system.find_car_by_id(car_id)
+    car = car_rental_system.find_car_record_by_id(car_id)
     if car:
-        print(f"Make: {car.make}, Model: {car.model}, Year: {car.year}")
+        _table([car], CAR_COLUMNS, page=False)
     else:
         print(f"Car with ID {car_id} not found.")
 
 def find_car_by_make_and_model(car_rental_system, make, model):
-    car = car_rental_system.find_car_by_name(make, model)
+    car = car_rental_system.find_car_record_by_name(make, model)
     if car:
-        print(f"Make: {car.make}, Model: {car.model}, Year: {car.year}")
+        _table([car], CAR_COLUMNS, page=False)
     else:
         print(f"Car with make '{make}' and model '{model}' not found.")
 
-def update_car(car_rental_system, car_id, new_make=None, new_model=None, new_year=None):
-    car_rental_system.update_car(car_id, new_make, new_model, new_year)
-    print("Car updated successfully!")
+def update_car(car_rental_system, car_id, new_make=None, new_model=None, new_year=None, expected_version=None):
+    if car_rental_system.update_car(car_id, new_make, new_model, new_year, expected_version):
+        print("Car updated successfully!")
 
 def delete_car(car_rental_system, car_id):
     deleted_car_info = car_rental_system.delete_car(car_id)
@@ -57,34 +120,27 @@ def add_customer(car_rental_system):
     except Exception as exc:
         print("Error adding customer: ", exc)
 
-def get_all_customers(car_rental_system):
-    customers = car_rental_system.get_all_customers()
-    for customer in customers:
-        print(f"First Name: {customer.first_name}, Last Name: {customer.last_name}, Phone No: {customer.phone_no}")
+def get_all_customers(car_rental_system, page_size=20):
+    _browse(car_rental_system.get_customer_records, CUSTOMER_COLUMNS, page_size)
 
 def find_customer_by_id(car_rental_system, customer_id):
-    customer = car_rental_system.find_customer_by_id(customer_id)
+    customer = car_rental_system.find_customer_record_by_id(customer_id)
     if customer:
-        print(f"Customer ID: {customer.id}")
-        print(f"First Name: {customer.first_name}")
-        print(f"Last Name: {customer.last_name}")
-        print(f"Phone Number: {customer.phone_no}")
+        _table([customer], CUSTOMER_COLUMNS, page=False)
     else:
         print(f"Customer with ID {customer_id} not found.")
         
 def find_customer_by_name(car_rental_system, first_name, last_name):
-    customer = car_rental_system.find_customer_by_name(first_name, last_name)
+    customer = car_rental_system.find_customer_record_by_name(first_name, last_name)
     if customer:
-        print(f"Customer ID: {customer.id}")
-        print(f"First Name: {customer.first_name}")
-        print(f"Last Name: {customer.last_name}")
-        print(f"Phone Number: {customer.phone_no}")
+        _table([customer], CUSTOMER_COLUMNS, page=False)
     else:
         print(f"Customer with first name '{first_name}' and last name '{last_name}' not found.")
 
-def update_customer(car_rental_system, customer_id, new_first_name=None, new_last_name=None, new_phone_no=None):
-    car_rental_system.update_customer(customer_id, new_first_name, new_last_name, new_phone_no)
-    print("Customer updated successfully!")
+def update_customer(car_rental_system, customer_id, new_first_name=None, new_last_name=None, new_phone_no=None,
+                    expected_version=None):
+    if car_rental_system.update_customer(customer_id, new_first_name, new_last_name, new_phone_no, expected_version):
+        print("Customer updated successfully!")
 
 def delete_customer(car_rental_system, customer_id):
     deleted_customer_info = car_rental_system.delete_customer(customer_id)
@@ -99,3 +155,307 @@ def register_customer_to_car(car_rental_system, customer_id, car_id, start_date_
     start_date = start_date_str if start_date_str else None
     end_date = end_date_str if end_date_str else None
     car_rental_system.register_customer_to_car(customer_id, car_id, start_date, end_date)
+
+
+def find_available_cars(car_rental_system, start_date, end_date, make=None):
+    try:
+        cars = car_rental_system.find_available_cars(start_date, end_date, make or None)
+    except ValueError as exc:
+        print(f"Error: {exc}")
+        return
+    if not cars:
+        print(f"No cars available between {start_date} and {end_date}.")
+        return
+    _table(cars, CAR_COLUMNS)
+
+
+def delete_rental(car_rental_system, rental_id):
+    deleted_rental_info = car_rental_system.delete_rental(rental_id)
+    if deleted_rental_info:
+        rental_info, rental_id = deleted_rental_info
+        print(f"Rental '{rental_info}' with ID '{rental_id}' deleted successfully.")
+
+
+def utilization_report(car_rental_system, group_by="make", start_month=None, end_month=None):
+    keys = [key.strip() for key in group_by.split(",") if key.strip()] or ["make"]
+    try:
+        rows = car_rental_system.utilization_report(keys, start_month or None, end_month or None)
+    except ValueError as exc:
+        print(f"Error: {exc}. Months use the format YYYY-MM.")
+        return
+    if not rows:
+        print("No rentals to report on.")
+    for row in rows:
+        group = ", ".join(f"{key}: {value}" for key, value in row.items()
+                          if key not in ("cars", "bookings", "rental_days", "utilization"))
+        print(f"{group} | Cars: {row['cars']}, Bookings: {row['bookings']}, "
+              f"Rental days: {row['rental_days']}, Utilization: {row['utilization']:.1%}")
+
+
+def _rates(rates_path):
+    from models.billing import load_rates
+    return load_rates(rates_path)
+
+
+def price_customer(car_rental_system, customer_id, rates_path=None):
+    try:
+        bill = car_rental_system.price_customer(customer_id, _rates(rates_path))
+    except (OSError, ValueError) as exc:
+        print(f"Error: {exc}")
+        return
+    if bill is None:
+        return
+    if not bill['lines']:
+        print(f"No rentals found for customer with ID {customer_id}.")
+        return
+    for line in bill['lines']:
+        print(f"Rental ID: {line['rental_id']}, {line['make']} (Car ID: {line['car_id']}), "
+              f"{line['start_day']} - {line['end_day']}: {line['days']} days ({line['weekend_days']} weekend) "
+              f"at {line['rate']:,.2f}/day = {line['amount']:,.2f}")
+    print(f"Total for customer {customer_id}: {bill['amount']:,.2f} for {bill['rental_days']} days.")
+
+
+def bill_month(car_rental_system, month, rates_path=None):
+    try:
+        result = car_rental_system.bill_month(month, _rates(rates_path))
+    except (OSError, ValueError) as exc:
+        print(f"Error: {exc}")
+        return False
+    if result is None:
+        return False
+    print(f"Wrote {result['invoices']} invoices for {result['month']} covering {result['rentals']} rentals, "
+          f"{result['amount']:,.2f} in total ({result['elapsed']:.2f}s).")
+    return True
+
+
+def bulk_update(car_rental_system, kind, filter_expression, assignments):
+    method = car_rental_system.bulk_update_cars if kind == "cars" else car_rental_system.bulk_update_customers
+    try:
+        result = method(filter_expression, assignments)
+    except ValueError as exc:
+        print(f"Error: {exc}")
+        return
+    if result is not None:
+        print(f"Updated {result['updated']} {kind}.")
+
+
+def bulk_delete(car_rental_system, kind, filter_expression):
+    method = car_rental_system.bulk_delete_cars if kind == "cars" else car_rental_system.bulk_delete_customers
+    try:
+        result = method(filter_expression)
+    except ValueError as exc:
+        print(f"Error: {exc}")
+        return
+    if result is not None:
+        print(f"Deleted {result['deleted']} {kind} and {result['rentals_deleted']} of their rentals.")
+
+
+def get_rental_history_for_car(car_rental_system, car_id):
+    rentals = car_rental_system.get_rental_history_for_car(car_id)
+    if not rentals:
+        print(f"No rentals found for car with ID {car_id}.")
+        return
+    render(((rental.id, rental.start_date, rental.end_date, rental.customer_id,
+             f"{rental.customer.first_name} {rental.customer.last_name}") for rental in rentals),
+           ('rental_id', 'start_date', 'end_date', 'customer_id', 'customer'), format='table')
+
+
+def get_rental_history_for_customer(car_rental_system, customer_id):
+    rentals = car_rental_system.get_rental_history_for_customer(customer_id)
+    if not rentals:
+        print(f"No rentals found for customer with ID {customer_id}.")
+        return
+    render(((rental.id, rental.start_date, rental.end_date, rental.car_id, f"{rental.car.make} {rental.car.model}")
+            for rental in rentals), ('rental_id', 'start_date', 'end_date', 'car_id', 'car'), format='table')
+
+
+def get_cars_with_current_renter(car_rental_system):
+    render(((car.id, car.make, car.model, car.year,
+             f"{customer.first_name} {customer.last_name} (ID: {customer.id})" if customer else "available")
+            for car, customer in car_rental_system.get_cars_with_current_renter()),
+           CAR_COLUMNS + ('renter',), format='table')
+
+
+def search_cars(car_rental_system, query, limit=10):
+    cars = car_rental_system.search_cars(query, limit)
+    if not cars:
+        print(f"No cars match '{query}'.")
+        return
+    _table(cars, CAR_COLUMNS)
+
+
+def search_customers(car_rental_system, query, limit=10):
+    customers = car_rental_system.search_customers(query, limit)
+    if not customers:
+        print(f"No customers match '{query}'.")
+        return
+    _table(customers, CUSTOMER_COLUMNS)
+
+
+def bulk_import(car_rental_system, kind, path, batch_size=500):
+    try:
+        if kind == "cars":
+            report = car_rental_system.bulk_import_cars(path, batch_size)
+        else:
+            report = car_rental_system.bulk_import_customers(path, batch_size)
+    except OSError as exc:
+        print(f"Error: {exc}")
+        return False
+
+    for line_no, reason in report['rejected']:
+        print(f"Rejected line {line_no}: {reason}")
+    print(f"Imported {report['inserted']} {kind} in {report['elapsed']:.2f}s "
+          f"({report['rows_per_sec']:.0f} rows/sec), {len(report['rejected'])} rejected.")
+    return True
+
+
+def allocate_cars(car_rental_system, path):
+    # Requests come from a CSV or JSON Lines file with customer_id, start_date, end_date and
+    # an optional filter column, e.g. "make = Toyota and year >= 2020"
+    from models.car_rental_system_cli import _read_records
+    try:
+        records = list(_read_records(path))
+    except OSError as exc:
+        print(f"Error: {exc}")
+        return False
+    report = car_rental_system.allocate_cars([record for _, record in records])
+    if report is None:
+        return False
+    for index, reason in sorted(report['errors'].items()):
+        print(f"Rejected line {records[index][0]}: {reason}")
+    print(f"Assigned {report['assigned']} of {len(records)} requests in {report['elapsed']:.2f}s, "
+          f"{report['rejected']} rejected.")
+    return True
+
+
+def export_tables(car_rental_system, names, directory=".", format="csv", compress=False, since=None, chunk_size=5000):
+    from models.export import export_path, read_manifest, write_manifest
+    # With since, only rows added after the export recorded in that directory's manifest are written
+    previous = read_manifest(since) if since else {}
+    os.makedirs(directory, exist_ok=True)
+    journal_seq = car_rental_system.journal_seq()
+    results = []
+    for name in names:
+        path = export_path(directory, name, format, compress)
+        last_id = previous.get(name, {}).get('last_id')
+        try:
+            result = car_rental_system.export(name, path, format, compress, last_id, chunk_size)
+        except ValueError as exc:
+            print(f"Error: {exc}")
+            return False
+        results.append(result)
+        print(f"Exported {result['rows']} {name} rows to {path} in {result['elapsed']:.2f}s")
+    write_manifest(directory, results, journal_seq)
+    return True
+
+
+def print_changes(car_rental_system, seq=0, tables=None, out=sys.stdout):
+    # One JSON line per change journal entry after seq, oldest first
+    count, last = 0, seq
+    try:
+        for entry in car_rental_system.changes_since(seq, tables):
+            out.write(json.dumps(entry, default=str) + "\n")
+            count, last = count + 1, entry['seq']
+    except ValueError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return False
+    out.flush()
+    print(f"{count} changes after seq {seq}; continue from seq {last}.", file=sys.stderr)
+    return True
+
+
+def compact_journal(car_rental_system, through=None):
+    result = car_rental_system.compact_journal(through)
+    print(f"Compacted the change journal through seq {result['through']}: "
+          f"removed {result['removed']} superseded entries, {result['kept']} kept.")
+    return True
+
+
+# Operations accepted in batch mode, mapped to the CarRentalSystem method that runs them
+BATCH_OPERATIONS = {
+    "add_car": "add_car",
+    "update_car": "update_car",
+    "delete_car": "delete_car",
+    "add_customer": "add_customer",
+    "update_customer": "update_customer",
+    "delete_customer": "delete_customer",
+    "register_customer_to_car": "register_customer_to_car",
+    "register_rental": "register_customer_to_car",
+    "delete_rental": "delete_rental",
+    "allocate_cars": "allocate_cars",
+    "upsert_car": "upsert_car",
+    "upsert_customer": "upsert_customer",
+    "bulk_update_cars": "bulk_update_cars",
+    "bulk_update_customers": "bulk_update_customers",
+    "bulk_delete_cars": "bulk_delete_cars",
+    "bulk_delete_customers": "bulk_delete_customers",
+}
+
+def _read_operations(file):
+    for line_no, line in enumerate(file, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError:
+            yield line_no, None
+
+def _run_operation(car_rental_system, operation):
+    if not isinstance(operation, dict):
+        return None, False, None, "Malformed operation"
+    arguments = dict(operation)
+    name = arguments.pop("op", None)
+    method_name = BATCH_OPERATIONS.get(name)
+    if not method_name:
+        return name, False, None, f"Unknown operation '{name}'"
+
+    # The CRUD methods report by printing; capture that as the operation's message
+    messages = io.StringIO()
+    try:
+        with redirect_stdout(messages), car_rental_system.savepoint():
+            result = getattr(car_rental_system, method_name)(**arguments)
+    except Exception as exc:
+        return name, False, None, f"Error: {exc}"
+    return name, bool(result), result, messages.getvalue().strip()
+
+def run_batch(car_rental_system, path, group_size=500, out=sys.stdout):
+    try:
+        source = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    except OSError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return False
+    succeeded = failed = 0
+    started = time.perf_counter()
+    try:
+        operations = _read_operations(source)
+        while True:
+            group = list(islice(operations, group_size))
+            if not group:
+                break
+            results = []
+            try:
+                with car_rental_system.transaction():
+                    for line_no, operation in group:
+                        name, ok, result, message = _run_operation(car_rental_system, operation)
+                        results.append({"line": line_no, "op": name, "ok": ok, "result": result, "message": message})
+            except Exception as exc:
+                # The whole group was rolled back, so none of its operations took effect
+                for entry in results:
+                    entry.update(ok=False, message=f"Error: group rolled back: {exc}")
+
+            for entry in results:
+                out.write(json.dumps(entry, default=str) + "\n")
+                if entry["ok"]:
+                    succeeded += 1
+                else:
+                    failed += 1
+            out.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    elapsed = time.perf_counter() - started
+    rate = (succeeded + failed) / elapsed if elapsed else 0
+    print(f"Ran {succeeded + failed} operations in {elapsed:.2f}s ({rate:.0f} ops/sec), {failed} failed.", file=sys.stderr)
+    return failed == 0
@@ -0,0 +1,189 @@
+from models.car_rental_system_cli import Car, Customer, Rental, CAR_FIELDS, _parse_date
+from models.filters import parse_filter
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from sqlalchemy import and_, or_, select
+import heapq
+
+
+# Bounds of the gap before a car's first booking and after its last one
+OPEN_START, OPEN_END = datetime.min, datetime.max
+
+
+def _is_free(booked, start_date, end_date):
+    # booked is one car's (start_date, end_date) list sorted by start; bookings on a car never
+    # overlap, so only the one starting last before start_date can reach into the period
+    index = bisect_left(booked, (start_date,))
+    if index < len(booked) and booked[index][0] <= end_date:
+        return False
+    return index == 0 or booked[index - 1][1] < start_date
+
+
+def _gaps(booked, after=OPEN_START, before=OPEN_END):
+    # The free gaps between a car's bookings within (after, before). A gap (after, before)
+    # can take a request that starts after `after` and ends before `before`.
+    for start_date, end_date in booked:
+        if end_date <= after:
+            continue
+        if start_date >= before:
+            break
+        if start_date > after:
+            yield after, start_date
+        after = end_date
+    if after < before:
+        yield after, before
+
+
+class FreeGaps:
+    # Free time of the cars matching one filter, for placing requests in order of start date.
+    # Gaps that have opened by the current start date are kept sorted by the date they close,
+    # and a request takes the one closing soonest after it ends (best fit), so long runs of
+    # free time are left for longer requests. Gaps that open later wait in a heap, and
+    # gaps that close before the current start date can never be used again and are dropped.
+
+    def __init__(self, car_ids, booked):
+        self.booked = booked
+        self.open = []
+        self.waiting = [(after, before, car_id) for car_id in car_ids for after, before in _gaps(booked[car_id])]
+        heapq.heapify(self.waiting)
+
+    def place(self, start_date, end_date):
+        # Returns the car given the period, or None when no matching car is free for all of it
+        opened = []
+        while self.waiting and self.waiting[0][0] < start_date:
+            after, before, car_id = heapq.heappop(self.waiting)
+            opened.append((before, after, car_id))
+        if len(opened) > 32:
+            self.open.extend(opened)
+            self.open.sort()
+        else:
+            for gap in opened:
+                insort(self.open, gap)
+        del self.open[:bisect_right(self.open, (start_date, OPEN_END))]
+
+        while True:
+            index = bisect_right(self.open, (end_date, OPEN_END))
+            if index == len(self.open):
+                return None
+            before, after, car_id = self.open.pop(index)
+            booked = self.booked[car_id]
+            if _is_free(booked, start_date, end_date):
+                insort(booked, (start_date, end_date))
+                heapq.heappush(self.waiting, (end_date, before, car_id))
+                return car_id
+            # A request with another filter matching the same car took part of this gap first;
+            # what is left of the gap goes back to be placed again
+            for after, before in _gaps(booked, after, before):
+                if after < start_date:
+                    insort(self.open, (before, after, car_id))
+                else:
+                    heapq.heappush(self.waiting, (after, before, car_id))
+
+
+def _filter_key(filter):
+    if not filter:
+        return None
+    return tuple(sorted(filter.items())) if isinstance(filter, dict) else ' '.join(filter.split())
+
+
+def _clean_request(request):
+    if not isinstance(request, dict):
+        return None, "Malformed request"
+    try:
+        customer_id = int(request.get('customer_id'))
+    except (TypeError, ValueError):
+        return None, f"Invalid customer ID '{request.get('customer_id')}'"
+    try:
+        start_date = _parse_date(request.get('start_date') or None)
+        end_date = _parse_date(request.get('end_date') or None)
+    except ValueError:
+        return None, "Invalid date format. Please use the format DD/MM/YYYY."
+    if not start_date or not end_date:
+        return None, "Start date and end date are required"
+    if end_date < start_date:
+        return None, "End date cannot be before the start date"
+    return (customer_id, start_date, end_date, request.get('filter')), None
+
+
+def _in_chunks(session, column, values, statement, size=10000):
+    # Runs statement once per chunk of values, keeping the IN list under SQLite's variable limit
+    values = list(values)
+    found = set()
+    for offset in range(0, len(values), size):
+        found.update(session.scalars(statement.where(column.in_(values[offset:offset + size]))))
+    return found
+
+
+def allocate(session, requests):
+    # Assigns a car to each request ({customer_id, start_date, end_date, filter}), where
+    # filter is an optional bulk-filter expression or {field: value} dict choosing which cars
+    # will do. Candidate cars and their bookings in the batch's date range are loaded once,
+    # then requests are placed in order of start date. Returns a car id (or None) per
+    # request, the (customer_id, car_id, start_date, end_date) bookings to insert, and the
+    # reason each request without a car was refused.
+    car_ids = [None] * len(requests)
+    errors = {}
+    cleaned = {}
+    for index, request in enumerate(requests):
+        row, error = _clean_request(request)
+        if error:
+            errors[index] = error
+        else:
+            cleaned[index] = row
+
+    customer_ids = {row[0] for row in cleaned.values()}
+    known = _in_chunks(session, Customer.id, customer_ids, select(Customer.id))
+    registered = _in_chunks(session, Rental.customer_id, customer_ids, select(Rental.customer_id))
+    conditions, seen = {}, set()
+    for index, (customer_id, start_date, end_date, filter) in list(cleaned.items()):
+        error = None
+        if customer_id not in known:
+            error = f"Customer with ID '{customer_id}' not found"
+        elif customer_id in registered:
+            error = "Customer is already registered to a car"
+        elif customer_id in seen:
+            error = "Customer has another request in this batch"
+        else:
+            key = _filter_key(filter)
+            if key not in conditions:
+                try:
+                    conditions[key] = parse_filter(Car, filter, CAR_FIELDS) if key is not None else []
+                except ValueError as exc:
+                    conditions[key] = exc
+            if isinstance(conditions[key], ValueError):
+                error = str(conditions[key])
+        if error:
+            errors[index] = error
+            del cleaned[index]
+        else:
+            seen.add(customer_id)
+    conditions = {key: value for key, value in conditions.items() if not isinstance(value, ValueError)}
+    if not cleaned:
+        return car_ids, [], errors
+
+    # One query for the candidates of each filter, and one for all their bookings in the batch's range
+    candidates = {key: session.scalars(select(Car.id).where(*where).order_by(Car.id)).all()
+                  for key, where in conditions.items()}
+    window_start = min(row[1] for row in cleaned.values())
+    window_end = max(row[2] for row in cleaned.values())
+    bookings = select(Rental.car_id, Rental.start_date, Rental.end_date).where(
+        Rental.start_date <= window_end, Rental.end_date >= window_start)
+    if all(conditions.values()):
+        matching = or_(*(and_(*where) for where in conditions.values()))
+        bookings = bookings.where(Rental.car_id.in_(select(Car.id).where(matching)))
+    booked = {car_id: [] for ids in candidates.values() for car_id in ids}
+    for car_id, start_date, end_date in session.execute(bookings.order_by(Rental.car_id, Rental.start_date)):
+        if car_id in booked:
+            booked[car_id].append((start_date, end_date))
+
+    free = {key: FreeGaps(ids, booked) for key, ids in candidates.items()}
+    rentals = []
+    for index in sorted(cleaned, key=lambda index: cleaned[index][1:3]):
+        customer_id, start_date, end_date, filter = cleaned[index]
+        car_id = free[_filter_key(filter)].place(start_date, end_date)
+        if car_id is None:
+            errors[index] = f"No matching car is free between {start_date:%d/%m/%Y} and {end_date:%d/%m/%Y}"
+        else:
+            car_ids[index] = car_id
+            rentals.append((customer_id, car_id, start_date, end_date))
+    return car_ids, rentals, errors
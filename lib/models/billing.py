@@ -0,0 +1,205 @@
+from datetime import datetime, timedelta
+from sqlalchemy import text
+import json
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Daily rate per make (and for any other make), an extra share of the daily rate charged
+# for each Saturday and Sunday, and a discount for cars more than older_than_years old
+# when the rental starts. A rates JSON file may override any of these.
+DEFAULT_RATES = {
+    'daily': 3000,
+    'makes': {
+        'Toyota': 3500, 'Honda': 3500, 'Subaru': 4000, 'Ford': 4500, 'Chevrolet': 4500,
+        'Audi': 7500, 'BMW': 8000, 'Aston Martin': 20000,
+    },
+    'weekend_surcharge': 0.25,
+    'older_than_years': 10,
+    'older_discount': 0.2,
+}
+METHODS = ('numpy', 'sql')
+
+# Rentals to price with their car's make and year. Each row is later clipped to the
+# billing period, so a rental crossing a month end is billed for its days in each month.
+RENTALS_SQL = """SELECT rentals.id AS rental_id, rentals.customer_id, rentals.car_id, cars.make, cars.year,
+    date(rentals.start_date) AS start_day, date(rentals.end_date) AS end_day
+FROM rentals JOIN cars ON cars.id = rentals.car_id
+WHERE {where}
+ORDER BY rentals.id"""
+
+# The same pricing done by SQLite, for when NumPy is not installed. A span of n days
+# starting on weekday w (0 is Sunday) holds 2 * (n / 7) weekend days in its full weeks,
+# plus the Saturday and the Sunday that fall in the n % 7 days left over.
+PRICED_SQL = """WITH clipped AS (
+    SELECT rental_id, customer_id, car_id, make, year,
+        max(julianday(start_day), julianday(:first_day)) AS first_day,
+        min(julianday(end_day), julianday(:last_day)) AS last_day
+    FROM ({rentals})
+), counted AS (
+    SELECT *, CAST(last_day - first_day AS INTEGER) + 1 AS days,
+        CAST(strftime('%w', first_day) AS INTEGER) AS weekday,
+        CAST(strftime('%Y', first_day) AS INTEGER) - year AS age,
+        {rate} AS rate
+    FROM clipped
+), weekends AS (
+    SELECT *, 2 * (days / 7) + ((13 - weekday) % 7 < days % 7) + ((7 - weekday) % 7 < days % 7) AS weekend_days
+    FROM counted
+), lines AS (
+    SELECT rental_id, customer_id, car_id, make, date(first_day) AS start_day, date(last_day) AS end_day,
+        days, weekend_days, rate,
+        round(rate * (days + weekend_days * :weekend_surcharge)
+              * (1 - CASE WHEN age > :older_than_years THEN :older_discount ELSE 0 END), 2) AS amount
+    FROM weekends
+)"""
+LINE_COLUMNS = ('rental_id', 'customer_id', 'car_id', 'make', 'start_day', 'end_day', 'days', 'weekend_days',
+                'rate', 'amount')
+
+
+def load_rates(path=None):
+    rates = {**DEFAULT_RATES, 'makes': dict(DEFAULT_RATES['makes'])}
+    if path:
+        with open(path, encoding='utf-8') as file:
+            try:
+                overrides = json.load(file)
+            except ValueError:
+                raise ValueError(f"{path} is not valid JSON")
+        if not isinstance(overrides, dict):
+            raise ValueError(f"{path} must hold a JSON object of rates")
+        rates['makes'].update(overrides.pop('makes', {}))
+        rates.update(overrides)
+    return check_rates(rates)
+
+
+def check_rates(rates):
+    unknown = set(rates) - set(DEFAULT_RATES)
+    if unknown:
+        raise ValueError(f"Unknown rate setting {', '.join(sorted(unknown))}; choose from {', '.join(DEFAULT_RATES)}")
+    rates = {**DEFAULT_RATES, **rates}
+    for name, value in [(name, rates[name]) for name in DEFAULT_RATES if name != 'makes'] + list(rates['makes'].items()):
+        if not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"Rate '{name}' must be a number of at least 0, not {value!r}")
+    return rates
+
+
+def month_bounds(month):
+    try:
+        first_day = datetime.strptime(month, '%Y-%m')
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid billing month '{month}'; use the format YYYY-MM")
+    next_month = (first_day + timedelta(days=32)).replace(day=1)
+    return first_day.date(), (next_month - timedelta(days=1)).date()
+
+
+def _query(first_day, last_day, customer_id):
+    # Whole rentals when there is no billing period; the period bounds are then far enough
+    # out to leave every rental as it is
+    where, params = ["1 = 1"], {'first_day': '0001-01-01', 'last_day': '9999-12-31'}
+    if first_day is not None:
+        where += ["rentals.start_date < :after_last_day", "rentals.end_date >= :first_day"]
+        params.update(first_day=first_day.isoformat(), last_day=last_day.isoformat(),
+                      after_last_day=(last_day + timedelta(days=1)).isoformat())
+    if customer_id is not None:
+        where.append("rentals.customer_id = :customer_id")
+        params['customer_id'] = customer_id
+    return RENTALS_SQL.format(where=' AND '.join(where)), params
+
+
+def _rate_case(rates, params):
+    cases = []
+    for n, (make, rate) in enumerate(sorted(rates['makes'].items())):
+        cases.append(f"WHEN :make_{n} THEN :rate_{n}")
+        params.update({f'make_{n}': make, f'rate_{n}': rate})
+    params['daily'] = rates['daily']
+    return f"CASE make {' '.join(cases)} ELSE :daily END" if cases else ":daily"
+
+
+def _price_chunk(rows, rates, first_day, last_day):
+    # Prices one chunk of RENTALS_SQL rows as whole columns at a time
+    rental_ids, customer_ids, car_ids, makes, years, start_days, end_days = zip(*rows)
+    start = numpy.array(start_days, dtype='datetime64[D]')
+    end = numpy.array(end_days, dtype='datetime64[D]')
+    if first_day is not None:
+        start = numpy.maximum(start, numpy.datetime64(first_day, 'D'))
+        end = numpy.minimum(end, numpy.datetime64(last_day, 'D'))
+    days = (end - start).astype(numpy.int64) + 1
+    weekend_days = numpy.busday_count(start, end + 1, weekmask='0000011')
+
+    names, make_index = numpy.unique(numpy.array(makes), return_inverse=True)
+    rate = numpy.array([rates['makes'].get(name, rates['daily']) for name in names], dtype=float)[make_index]
+    age = start.astype('datetime64[Y]').astype(numpy.int64) + 1970 - numpy.array(years)
+    discount = numpy.where(age > rates['older_than_years'], rates['older_discount'], 0.0)
+    amount = numpy.round(rate * (days + weekend_days * rates['weekend_surcharge']) * (1 - discount), 2)
+    return {
+        'rental_id': rental_ids, 'customer_id': numpy.array(customer_ids), 'car_id': car_ids, 'make': makes,
+        'start_day': start, 'end_day': end, 'days': days, 'weekend_days': weekend_days,
+        'rate': rate, 'amount': amount,
+    }
+
+
+def _choose(method):
+    method = method or ('numpy' if numpy is not None else 'sql')
+    if method not in METHODS:
+        raise ValueError(f"Unknown pricing method '{method}'; choose from {', '.join(METHODS)}")
+    if method == 'numpy' and numpy is None:
+        raise ValueError("Pricing with NumPy needs numpy (pip install numpy)")
+    return method
+
+
+def _chunks(conn, rentals, params, chunk_size):
+    result = conn.execution_options(yield_per=chunk_size).execute(text(rentals), params)
+    try:
+        yield from result.partitions(chunk_size)
+    finally:
+        result.close()
+
+
+def price_rentals(conn, rates, first_day=None, last_day=None, customer_id=None, method=None, chunk_size=50000):
+    # One dict per rental (see LINE_COLUMNS), clipped to first_day..last_day when given
+    method = _choose(method)
+    rentals, params = _query(first_day, last_day, customer_id)
+    if method == 'sql':
+        statement = PRICED_SQL.format(rentals=rentals, rate=_rate_case(rates, params)) + \
+            f" SELECT {', '.join(LINE_COLUMNS)} FROM lines ORDER BY rental_id"
+        params.update({name: rates[name] for name in ('weekend_surcharge', 'older_than_years', 'older_discount')})
+        return [dict(row._mapping) for row in conn.execute(text(statement), params)]
+    lines = []
+    for rows in _chunks(conn, rentals, params, chunk_size):
+        priced = _price_chunk(rows, rates, first_day, last_day)
+        priced['start_day'], priced['end_day'] = priced['start_day'].astype(str), priced['end_day'].astype(str)
+        columns = [priced[name].tolist() if isinstance(priced[name], numpy.ndarray) else priced[name]
+                   for name in LINE_COLUMNS]
+        lines += [dict(zip(LINE_COLUMNS, values)) for values in zip(*columns)]
+    return lines
+
+
+def invoice_totals(conn, rates, first_day, last_day, method=None, chunk_size=50000):
+    # {customer_id: [rentals, rental_days, weekend_days, amount]} for every customer with
+    # rental days in the period. NumPy sums each chunk per customer with bincount, so only
+    # one chunk of rentals is ever held in memory.
+    method = _choose(method)
+    rentals, params = _query(first_day, last_day, None)
+    totals = {}
+    if method == 'sql':
+        statement = PRICED_SQL.format(rentals=rentals, rate=_rate_case(rates, params)) + \
+            " SELECT customer_id, COUNT(*), SUM(days), SUM(weekend_days), SUM(amount) FROM lines GROUP BY customer_id"
+        params.update({name: rates[name] for name in ('weekend_surcharge', 'older_than_years', 'older_discount')})
+        for customer_id, *sums in conn.execute(text(statement), params):
+            totals[customer_id] = sums
+        return totals
+    for rows in _chunks(conn, rentals, params, chunk_size):
+        priced = _price_chunk(rows, rates, first_day, last_day)
+        customers, index = numpy.unique(priced['customer_id'], return_inverse=True)
+        sums = zip(
+            numpy.bincount(index).tolist(),
+            numpy.bincount(index, weights=priced['days']).tolist(),
+            numpy.bincount(index, weights=priced['weekend_days']).tolist(),
+            numpy.bincount(index, weights=priced['amount']).tolist(),
+        )
+        for customer_id, chunk_sums in zip(customers.tolist(), sums):
+            total = totals.setdefault(customer_id, [0, 0, 0, 0.0])
+            for n, value in enumerate(chunk_sums):
+                total[n] += value
+    return totals
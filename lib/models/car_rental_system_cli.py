@@ -1,8 +1,21 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, UniqueConstraint
-from sqlalchemy.orm import sessionmaker, relationship, declarative_base
-from sqlalchemy import DateTime
-from datetime import datetime
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import create_engine, Column, Float, Integer, String, Text, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.orm import sessionmaker, relationship, declarative_base, joinedload
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy import DateTime, insert, select, exists, literal, or_, text, update, delete, event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models.id_cache import SnapshotCache, CarSnapshot, CustomerSnapshot
+from models.search import install_search_index, match_query
+from models.filters import parse_filter, parse_values
+from itertools import islice
+from contextlib import contextmanager
+import csv
+import functools
+import json
+import random
+import time
 
 
 Base = declarative_base()
@@ -16,8 +29,18 @@ class Car(Base):
     make = Column(String, nullable=False)
     model = Column(String, unique=True, nullable=False)
     year = Column(Integer, nullable=False)
+    # Bumped by every UPDATE. The ORM adds "AND version = <version read>" to its UPDATE and
+    # DELETE statements, so a row changed by another session since it was loaded fails with
+    # StaleDataError instead of being silently overwritten.
+    version = Column(Integer, nullable=False, server_default='1')
     
     rentals = relationship("Rental", back_populates="car")
+
+    __table_args__ = (
+        # AUTOINCREMENT keeps ids from being reused and lets shards start at their own offset
+        {'sqlite_autoincrement': True},
+    )
+    __mapper_args__ = {'version_id_col': version}
     
 class Customer(Base):
     __tablename__ = 'customers'
@@ -26,9 +49,16 @@ class Customer(Base):
     first_name = Column(String, nullable=False)
     last_name = Column(String, nullable=False)
     phone_no = Column(Integer, unique=True, nullable=False)
+    version = Column(Integer, nullable=False, server_default='1')
     
     rentals = relationship("Rental", back_populates="customer")
 
+    __table_args__ = (
+        Index('ix_customers_name', 'first_name', 'last_name'),
+        {'sqlite_autoincrement': True},
+    )
+    __mapper_args__ = {'version_id_col': version}
+
 class Rental(Base):
     __tablename__ = 'rentals'
     
@@ -37,36 +67,520 @@ class Rental(Base):
     end_date = Column(DateTime, nullable=False)
     customer_id = Column(Integer, ForeignKey('customers.id'), nullable=False)
     car_id = Column(Integer, ForeignKey('cars.id'), nullable=False)
+    version = Column(Integer, nullable=False, server_default='1')
     
     customer = relationship("Customer", back_populates="rentals")
     car = relationship("Car", back_populates="rentals")
 
     __table_args__ = (
         UniqueConstraint('customer_id', 'car_id', name='_customer_car_uc'),
+        # Lets the overlap probe for one car seek straight to its bookings
+        Index('ix_rentals_car_dates', 'car_id', 'start_date', 'end_date'),
+        {'sqlite_autoincrement': True},
+    )
+    __mapper_args__ = {'version_id_col': version}
+
+
+class CarMonthUsage(Base):
+    # Rental activity pre-aggregated per car and calendar month. Booking and deleting
+    # rentals adjust it in place, so reports never have to scan the rentals table.
+    __tablename__ = 'car_month_usage'
+
+    car_id = Column(Integer, ForeignKey('cars.id'), primary_key=True)
+    month = Column(String, primary_key=True)
+    rental_days = Column(Integer, nullable=False, default=0)
+    bookings = Column(Integer, nullable=False, default=0)
+
+
+class Invoice(Base):
+    # One customer's charges for one billing month, as priced by models.billing. Billing a
+    # month again replaces its invoices.
+    __tablename__ = 'invoices'
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    customer_id = Column(Integer, ForeignKey('customers.id'), nullable=False)
+    month = Column(String, nullable=False)
+    rentals = Column(Integer, nullable=False)
+    rental_days = Column(Integer, nullable=False)
+    weekend_days = Column(Integer, nullable=False)
+    amount = Column(Float, nullable=False)
+    issued_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('customer_id', 'month', name='_customer_month_uc'),
+        Index('ix_invoices_month', 'month'),
+    )
+
+
+class ChangeJournal(Base):
+    # Every insert, update and delete on cars, customers and rentals, recorded by the
+    # triggers in models.journal with the row as it was before and after (JSON)
+    __tablename__ = 'change_journal'
+
+    seq = Column(Integer, primary_key=True, nullable=False)
+    table_name = Column(String, nullable=False)
+    operation = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=False)
+    before = Column(Text)
+    after = Column(Text)
+    changed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Serves compaction, which keeps the newest entry per row
+        Index('ix_change_journal_row', 'table_name', 'row_id', 'seq'),
+        # AUTOINCREMENT so sequence numbers are never reused, even after compaction
+        {'sqlite_autoincrement': True},
     )
     
 
+def _parse_date(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.strptime(value, '%d/%m/%Y')
+
+
+def _overlapping_rentals(car_id, start_date, end_date):
+    # Two bookings overlap when each one starts on or before the other one ends
+    return exists().where(
+        Rental.car_id == car_id,
+        Rental.start_date <= end_date,
+        Rental.end_date >= start_date,
+    )
+
+
+def _month_spans(start_date, end_date):
+    # Splits an inclusive date range into ('YYYY-MM', days) pieces, one per calendar month
+    day, last = start_date.date(), end_date.date()
+    while day <= last:
+        next_month = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+        month_end = min(last, next_month - timedelta(days=1))
+        yield day.strftime('%Y-%m'), (month_end - day).days + 1
+        day = next_month
+
+
+def _record_usage(session, car_id, start_date, end_date, sign=1):
+    # Adds (sign=1) or removes (sign=-1) one rental from car_month_usage; the
+    # booking itself is counted in the month the rental starts.
+    _record_usage_many(session, [(car_id, start_date, end_date)], sign)
+
+
+def _record_usage_many(session, rentals, sign=1):
+    rows = [
+        {'car_id': car_id, 'month': month, 'rental_days': sign * days, 'bookings': sign if n == 0 else 0}
+        for car_id, start_date, end_date in rentals
+        for n, (month, days) in enumerate(_month_spans(start_date, end_date))
+    ]
+    if not rows:
+        return
+    statement = sqlite_insert(CarMonthUsage)
+    session.execute(statement.on_conflict_do_update(
+        index_elements=['car_id', 'month'],
+        set_={
+            'rental_days': CarMonthUsage.rental_days + statement.excluded.rental_days,
+            'bookings': CarMonthUsage.bookings + statement.excluded.bookings,
+        },
+    ), rows)
+
+
+# Recomputes car_month_usage from the rentals table, splitting each rental across the months it covers
+REBUILD_USAGE_SQL = [
+    "DELETE FROM car_month_usage",
+    """INSERT INTO car_month_usage (car_id, month, rental_days, bookings)
+    WITH RECURSIVE spans(car_id, month_start, first_day, last_day) AS (
+        SELECT car_id, date(start_date, 'start of month'), date(start_date), date(end_date) FROM rentals
+        UNION ALL
+        SELECT car_id, date(month_start, '+1 month'), first_day, last_day FROM spans
+        WHERE date(month_start, '+1 month') <= last_day
+    )
+    SELECT car_id, strftime('%Y-%m', month_start),
+        SUM(julianday(min(last_day, date(month_start, '+1 month', '-1 day'))) - julianday(max(first_day, month_start)) + 1),
+        SUM(month_start = date(first_day, 'start of month'))
+    FROM spans
+    GROUP BY car_id, month_start""",
+]
+
+
+def rebuild_usage_summary(engine):
+    with engine.begin() as conn:
+        for statement in REBUILD_USAGE_SQL:
+            conn.exec_driver_sql(statement)
+
+
+# Fields that bulk filters may test and bulk updates may set
+CAR_FIELDS = ('id', 'make', 'model', 'year')
+CUSTOMER_FIELDS = ('id', 'first_name', 'last_name', 'phone_no')
+
+
+# Helpers for streaming bulk imports:
+def _read_records(path):
+    # Yield (line number, record) pairs one at a time so large files never sit in memory
+    if path.endswith(('.jsonl', '.ndjson')):
+        with open(path, encoding='utf-8') as file:
+            for line_no, line in enumerate(file, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError:
+                    yield line_no, None
+    else:
+        with open(path, newline='', encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            for record in reader:
+                yield reader.line_num, record
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _clean_car(record):
+    if not isinstance(record, dict):
+        return None, "Malformed row"
+    make, model, year = record.get('make'), record.get('model'), record.get('year')
+    if not make or not model or not year:
+        return None, "Make, Model and year are required"
+    try:
+        year = int(year)
+    except (TypeError, ValueError):
+        return None, f"Invalid year '{year}'"
+    return {'make': str(make).strip(), 'model': str(model).strip(), 'year': year}, None
+
+
+def _clean_customer(record):
+    if not isinstance(record, dict):
+        return None, "Malformed row"
+    first_name, last_name, phone_no = record.get('first_name'), record.get('last_name'), record.get('phone_no')
+    if not first_name or not last_name or not phone_no:
+        return None, "First Name, Last Name and phone are required"
+    # phone_no is an INTEGER column, so compare and store it the way SQLite will
+    try:
+        phone_no = int(phone_no)
+    except (TypeError, ValueError):
+        return None, f"Invalid phone number '{phone_no}'"
+    return {'first_name': str(first_name).strip(), 'last_name': str(last_name).strip(), 'phone_no': phone_no}, None
+
+
+# Indexes older databases may still carry that no query uses any more. Lookups by model go
+# through the unique index on cars.model, which makes a (make, model, year) index redundant.
+RETIRED_INDEXES = ('ix_cars_make_model_year',)
+
+
+def upgrade_indexes(engine):
+    # create_all only builds indexes together with new tables, so databases created
+    # before an index was declared need it added here. checkfirst makes this idempotent.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    # Every write pays to maintain an index, so ones that were retired are dropped
+    with engine.begin() as conn:
+        for name in RETIRED_INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+
+def upgrade_columns(engine):
+    # create_all does not alter tables that already exist, so columns declared after a
+    # database was created are added here. Each needs a server default for the rows already there.
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            present = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+            for column in table.columns:
+                if column.name not in present:
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=engine.dialect)}")
+
+
+# Bump whenever a table, column or index is added to the models above, or retired
+SCHEMA_VERSION = 7
+
+
+def ensure_schema(engine):
+    # The schema version lives in SQLite's user_version pragma, so a current database
+    # costs one pragma read at startup instead of create_all inspecting every table.
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA user_version").scalar() == SCHEMA_VERSION:
+            return
+    from models.journal import install_journal
+    Base.metadata.create_all(engine)
+    upgrade_columns(engine)
+    upgrade_indexes(engine)
+    install_search_index(engine)
+    install_journal(engine)
+    rebuild_usage_summary(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+_engines = {}
+
+# How long a connection waits for another one's write lock before SQLite reports it locked
+BUSY_TIMEOUT_MS = 5000
+
+
+def _configure_file_engine(engine, busy_timeout_ms):
+    # WAL lets readers carry on while a write commits, and other terminals' writes queue
+    # behind the busy timeout instead of failing straight away. WAL is a property of the
+    # file, so it is set once; the busy timeout is per connection.
+    @event.listens_for(engine, 'connect')
+    def configure(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+
+    ensure_schema(engine)
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode = WAL")
+    return engine
+
+
+def get_engine(db_name):
+    # One engine per database file for the whole process, created on first use.
+    # In-memory databases are private to each CarRentalSystem, so they are not shared.
+    if db_name == ':memory:':
+        engine = create_engine('sqlite://')
+        ensure_schema(engine)
+        return engine
+    if db_name not in _engines:
+        _engines[db_name] = _configure_file_engine(create_engine(f'sqlite:///{db_name}'), BUSY_TIMEOUT_MS)
+    return _engines[db_name]
+
+
+def create_pooled_engine(db_name, pool_size=8, busy_timeout_ms=BUSY_TIMEOUT_MS):
+    # An engine for many threads at once
+    return _configure_file_engine(
+        create_engine(f'sqlite:///{db_name}', pool_size=pool_size, max_overflow=0), busy_timeout_ms)
+
+
+# Writes that find the database locked for longer than the busy timeout are run again,
+# up to LOCK_RETRIES more times, after a random pause of up to LOCK_BACKOFF seconds that
+# doubles each time up to LOCK_BACKOFF_MAX, so writers that collided do not retry together
+LOCK_RETRIES = 5
+LOCK_BACKOFF = 0.05
+LOCK_BACKOFF_MAX = 1.0
+
+
+def _is_locked(error):
+    return isinstance(error, OperationalError) and any(
+        message in str(error) for message in ('database is locked', 'database table is locked', 'database is busy'))
+
+
+def _retry_when_locked(method):
+    # The method's error handler passes the error to _rollback(), which raises it back out
+    # to here while retries are left. Inside transaction() the caller owns the transaction,
+    # so the write fails as usual for the caller to handle.
+    @functools.wraps(method)
+    def retrying(self, *args, **kwargs):
+        if self._grouped or self._retrying:
+            return method(self, *args, **kwargs)
+        delay = LOCK_BACKOFF
+        for _ in range(LOCK_RETRIES):
+            self._retrying = True
+            try:
+                return method(self, *args, **kwargs)
+            except OperationalError as e:
+                if not _is_locked(e):
+                    raise
+            finally:
+                self._retrying = False
+            self.lock_retries += 1
+            time.sleep(random.uniform(0, delay))
+            delay = min(delay * 2, LOCK_BACKOFF_MAX)
+        return method(self, *args, **kwargs)
+    return retrying
+
+
 # Set up the database connection:    
 class CarRentalSystem:
     
-    def __init__(self, db_name):
-        self.engine = create_engine(f'sqlite:///{db_name}')
-        Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+    def __init__(self, db_name, cache_size=0, cache_ttl=None, profiler=None, replica_max_age=None, replica_max_writes=None,
+                 engine=None):
+        # The engine and session are only created when the database is first used. An engine
+        # passed in (e.g. from create_pooled_engine) is used instead of the shared one.
+        self.db_name = db_name
+        self._engine = engine
+        self._session = None
+        # Optional models.profiler.Profiler timing every public method and its SQL
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.instrument(self)
+            if engine is not None:
+                profiler.attach(engine)
+        # Optional read-through cache for find_*_by_id, filled from the primary database even
+        # when there is a replica; disabled when cache_size is 0
+        self.cache = SnapshotCache(cache_size, cache_ttl) if cache_size else None
+        # Optional in-memory read replica for the get_all_*/find_* methods; enabled when a
+        # refresh bound is given, in seconds and/or committed writes
+        self.replica_max_age = replica_max_age
+        self.replica_max_writes = replica_max_writes
+        self._replica = None
+        self._grouped = False
+        self._savepoint = None
+        self._retrying = False
+        # Set by group_commit: (kind, id) of every car and customer written, for the queue
+        # to evict from the submitting system's cache
+        self._written = None
+        # Writes run again because the database was locked (see _retry_when_locked)
+        self.lock_retries = 0
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = get_engine(self.db_name)
+            if self.profiler is not None:
+                self.profiler.attach(self._engine)
+        return self._engine
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = sessionmaker(bind=self.engine)()
+            if self.replica_max_age is not None or self.replica_max_writes is not None:
+                event.listen(self._session, 'after_commit', lambda session: self.replica.note_write())
+        return self._session
+
+    @property
+    def replica(self):
+        if self._replica is None and (self.replica_max_age is not None or self.replica_max_writes is not None):
+            from models.replica import ReadReplica
+            self._replica = ReadReplica(self.engine, self.replica_max_age, self.replica_max_writes)
+            if self.profiler is not None:
+                self.profiler.attach(self._replica.engine)
+        return self._replica
+
+    @property
+    def _reader(self):
+        # Session for read-only lookups: the replica's when there is one, refreshed first if stale
+        return self.replica.session if self.replica is not None else self.session
+
+    def replica_stats(self):
+        return self.replica.stats() if self.replica is not None else None
+
+    # Transaction grouping: inside transaction() the CRUD methods flush instead of
+    # committing, and each operation wrapped in savepoint() can fail on its own.
+    @contextmanager
+    def transaction(self):
+        self._grouped = True
+        try:
+            # pysqlite only opens a transaction before DML. Without an explicit BEGIN the first
+            # SAVEPOINT would open one instead, and its RELEASE would commit every operation.
+            connection = self.session.connection()
+            if not connection.connection.dbapi_connection.in_transaction:
+                connection.exec_driver_sql("BEGIN")
+            yield
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        finally:
+            self._grouped = False
+
+    @contextmanager
+    def savepoint(self):
+        savepoint = self._savepoint = self.session.begin_nested()
+        try:
+            yield
+        except Exception:
+            if self._savepoint is savepoint:
+                savepoint.rollback()
+            raise
+        else:
+            # _rollback() clears self._savepoint once it has undone the operation
+            if self._savepoint is savepoint:
+                savepoint.commit()
+        finally:
+            self._savepoint = None
+
+    def group_commit(self, max_delay=0.005, max_group=100):
+        # Returns a models.write_queue.WriteQueue applying writes in groups on a thread of
+        # its own, through a separate CarRentalSystem on the same database. Commits it makes
+        # count towards this system's replica, and evict the cars and customers they wrote
+        # from this system's cache once their group has committed.
+        from models.write_queue import WriteQueue
+        writer = CarRentalSystem(self.db_name, profiler=self.profiler)
+        written = writer._written = []
+
+        def on_commit(count):
+            if self.replica is not None:
+                self.replica.note_write()
+            while written:
+                self._invalidate(*written.pop())
+
+        return WriteQueue(writer, max_delay, max_group, on_commit)
+
+    def _commit(self):
+        if self._grouped:
+            self.session.flush()
+        else:
+            self.session.commit()
+
+    def _rollback(self, error=None):
+        if self._savepoint is not None:
+            savepoint, self._savepoint = self._savepoint, None
+            savepoint.rollback()
+        else:
+            self.session.rollback()
+        if self._retrying and _is_locked(error):
+            raise error
+
+    def _version_matches(self, kind, entity, expected_version):
+        if expected_version is None or entity.version == int(expected_version):
+            return True
+        # The caller's version may have come from the cache, so the entry is dropped for the retry
+        self._invalidate(kind.lower(), entity.id)
+        print(f"Error: {kind} with ID '{entity.id}' was changed by another session since it was read "
+              f"(version {expected_version}, now {entity.version}). Nothing was saved; reload it and try again.")
+        return False
+
+    def _invalidate(self, kind, entity_id):
+        if self._written is not None:
+            self._written.append((kind, entity_id))
+        if self.cache is not None:
+            try:
+                self.cache.invalidate((kind, int(entity_id)))
+            except (TypeError, ValueError):
+                pass
+
+    def _cached_lookup(self, kind, model, record, entity_id):
+        try:
+            key = (kind, int(entity_id))
+        except (TypeError, ValueError):
+            return None
+        found = self.cache.get(key)
+        if found is None:
+            # Filled from the primary, never the replica: entries have no TTL by default, so a
+            # stale row cached from a replica would outlive the replica's own refresh
+            found = self._first_record(model, record, model.id == key[1], session=self.session)
+            if found is None:
+                return None
+            self.cache.put(key, found)
+        return found
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
         
         
     # Method to register a customer to a car
+    @_retry_when_locked
     def register_customer_to_car(self, customer_id, car_id, start_date=None, end_date=None):
         try:
-            if start_date:
-                start_date = datetime.strptime(start_date, '%d/%m/%Y')
-            if end_date:
-                end_date = datetime.strptime(end_date, '%d/%m/%Y')
+            start_date = _parse_date(start_date or None)
+            end_date = _parse_date(end_date or None)
         except ValueError:
             print("Error: Invalid date format. Please use the format DD/MM/YYYY.")
             return False
 
+        if not start_date or not end_date:
+            print("Error: Start date and end date are required")
+            return False
+
+        if end_date < start_date:
+            print("Error: End date cannot be before the start date")
+            return False
+
         existing_rental = self.session.query(Rental).filter_by(customer_id=customer_id).first()
 
         if existing_rental:
@@ -84,72 +598,251 @@ class CarRentalSystem:
             return False
 
         try:
-            rental = Rental(
-                start_date=start_date,
-                end_date=end_date,
-                customer_id=customer_id,
-                car_id=car_id
+            # Insert only if the car is free for the whole period; the overlap check and
+            # the insert are one statement, so a concurrent booking cannot slip in between.
+            booking = select(
+                literal(start_date, DateTime),
+                literal(end_date, DateTime),
+                literal(customer.id),
+                literal(car.id),
+            ).where(~_overlapping_rentals(car.id, start_date, end_date))
+            result = self.session.execute(
+                insert(Rental).from_select(['start_date', 'end_date', 'customer_id', 'car_id'], booking)
             )
-            self.session.add(rental)
-            self.session.commit()
+            if result.rowcount == 0:
+                self._rollback()
+                print(f"Error: Car '{car.make} {car.model}' (ID: {car_id}) is already booked between "
+                      f"{start_date:%d/%m/%Y} and {end_date:%d/%m/%Y}")
+                return False
+            _record_usage(self.session, car.id, start_date, end_date)
+            self._commit()
+            self._invalidate('customer', customer.id)
+            self._invalidate('car', car.id)
 
             print(f"Customer '{customer.first_name} {customer.last_name}' (ID: {customer_id}) successfully added to car '{car.make} {car.model}' (ID: {car_id})")
             return True
 
         except IntegrityError:
-            self.session.rollback()
+            self._rollback()
             print("Error: Integrity constraint violation - Customer is already registered to a car")
             return False
 
         except Exception as e:
-            self.session.rollback()
+            self._rollback(e)
             print(f'Error: {e}')
             return False
 
-# CRUD methods for car:
-    def add_car(self, make, model, year):
-        if not make or not model or not year:
-            print("Error: Make, Model and year are required")
-            
-        # Check if a car with the given make and model already exists
-        existing_car = self.session.query(Car).filter_by(make=make, model=model, year=year).first()
-        if existing_car:
-            print(f"A car with make '{make}', model '{model}', and year '{year}' already exists!")
-            return
-        
-        car = Car(make=make, model=model, year=year)
-        
+    @_retry_when_locked
+    def allocate_cars(self, requests):
+        # Books a batch of requests onto whichever matching cars are free (see
+        # models.allocation) in one transaction. BEGIN IMMEDIATE takes the write lock before
+        # the bookings are read, so no other booking can land between planning and insert.
+        from models.allocation import allocate
+        started = time.perf_counter()
+        requests = list(requests)
         try:
-            self.session.add(car)
-            self.session.commit()
-            return True
-            # print(f"{make} {model} Added Successfully")
-            
+            connection = self.session.connection()
+            if not connection.connection.dbapi_connection.in_transaction:
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+            car_ids, rentals, errors = allocate(self.session, requests)
+            if rentals:
+                self.session.execute(insert(Rental), [
+                    {'customer_id': customer_id, 'car_id': car_id, 'start_date': start_date, 'end_date': end_date}
+                    for customer_id, car_id, start_date, end_date in rentals
+                ])
+                _record_usage_many(self.session, [rental[1:] for rental in rentals])
+            self._commit()
         except Exception as e:
-            self.session.rollback()
+            self._rollback(e)
             print(f'Error: {e}')
+            return None
+
+        for customer_id, car_id, start_date, end_date in rentals:
+            self._invalidate('customer', customer_id)
+            self._invalidate('car', car_id)
+        return {
+            'assigned': len(rentals),
+            'rejected': len(requests) - len(rentals),
+            'car_ids': car_ids,
+            'errors': errors,
+            'elapsed': time.perf_counter() - started,
+        }
+
+    @_retry_when_locked
+    def delete_rental(self, rental_id):
+        rental = self.session.query(Rental).filter_by(id=rental_id).first()
+        if not rental:
+            print(f"Rental with ID '{rental_id}' not found. Unable to delete.")
+            return None
+
+        rental_info = f"{rental.customer.first_name} {rental.customer.last_name} in {rental.car.make} {rental.car.model}"
+        car_id, customer_id = rental.car_id, rental.customer_id
+        try:
+            _record_usage(self.session, car_id, rental.start_date, rental.end_date, sign=-1)
+            self.session.delete(rental)
+            self._commit()
+            self._invalidate('customer', customer_id)
+            self._invalidate('car', car_id)
+            return rental_info, rental_id
+        except Exception as e:
+            self._rollback(e)
+            print(f"Error deleting rental: {e}")
+            return None
+
+    def rebuild_usage_summary(self):
+        rebuild_usage_summary(self.engine)
+
+    def utilization_report(self, group_by=('make',), start_month=None, end_month=None):
+        from models.reports import utilization_report
+        return utilization_report(self.session, group_by, start_month, end_month)
+
+    def export(self, name, path, format='csv', compress=False, since=None, chunk_size=5000):
+        # Reads through its own connection so a long export never holds the session open
+        from models.export import export_table
+        with self.engine.connect() as conn:
+            return export_table(conn, name, path, format, compress, since, chunk_size)
+
+    # Billing (see models.billing); rates default to models.billing.DEFAULT_RATES
+    def price_customer(self, customer_id, rates=None, method=None):
+        from models.billing import check_rates, price_rentals
+        customer = self.session.query(Customer).filter_by(id=customer_id).first()
+        if not customer:
+            print(f"Error: Customer with ID '{customer_id}' not found")
+            return None
+        rates = check_rates(rates or {})
+        with self.engine.connect() as conn:
+            lines = price_rentals(conn, rates, customer_id=customer.id, method=method)
+        return {
+            'customer_id': customer.id,
+            'lines': lines,
+            'rental_days': sum(line['days'] for line in lines),
+            'weekend_days': sum(line['weekend_days'] for line in lines),
+            'amount': round(sum(line['amount'] for line in lines), 2),
+        }
+
+    @_retry_when_locked
+    def bill_month(self, month, rates=None, method=None, chunk_size=50000):
+        # Prices every rental day in the month ('YYYY-MM') and writes one invoice per
+        # customer in a single transaction, replacing any invoices the month already had
+        from models.billing import check_rates, invoice_totals, month_bounds
+        first_day, last_day = month_bounds(month)
+        rates = check_rates(rates or {})
+        started = time.perf_counter()
+        with self.engine.connect() as conn:
+            totals = invoice_totals(conn, rates, first_day, last_day, method, chunk_size)
+        issued_at = datetime.now()
+        invoices = [
+            {'customer_id': customer_id, 'month': month, 'rentals': int(rentals), 'rental_days': int(days),
+             'weekend_days': int(weekend_days), 'amount': round(amount, 2), 'issued_at': issued_at}
+            for customer_id, (rentals, days, weekend_days, amount) in sorted(totals.items())
+        ]
+        try:
+            self.session.execute(delete(Invoice).where(Invoice.month == month))
+            for chunk in _chunked(invoices, 10000):
+                self.session.execute(insert(Invoice), chunk)
+            self._commit()
+        except Exception as e:
+            self._rollback(e)
+            print(f"Error writing invoices: {e}")
+            return None
+        return {
+            'month': month,
+            'invoices': len(invoices),
+            'rentals': sum(invoice['rentals'] for invoice in invoices),
+            'amount': round(sum(invoice['amount'] for invoice in invoices), 2),
+            'elapsed': time.perf_counter() - started,
+        }
+
+    def get_invoices(self, month):
+        return self._reader.query(Invoice).filter_by(month=month).order_by(Invoice.customer_id).all()
+
+    # Change journal (see models.journal). Consumers keep the last seq they applied and
+    # ask for the changes after it; it always reads the database itself, never the replica.
+    def changes_since(self, seq=0, tables=None, batch_size=1000):
+        from models.journal import changes_since
+        return changes_since(self.engine, seq, tables, batch_size)
+
+    def journal_seq(self):
+        from models.journal import last_seq
+        with self.engine.connect() as conn:
+            return last_seq(conn)
+
+    @_retry_when_locked
+    def compact_journal(self, through=None):
+        from models.journal import compact_journal
+        with self.engine.begin() as conn:
+            return compact_journal(conn, through)
+
+# CRUD methods for car:
+    def add_car(self, make, model, year):
+        # A single INSERT ... ON CONFLICT DO NOTHING, so two terminals adding the same
+        # car cannot both pass a duplicate check and then collide on the unique model
+        result = self.upsert_cars([{'make': make, 'model': model, 'year': year}])
+        if result is None:
+            return False
+        if result['statuses'][0] == 'rejected':
+            print(f"Error: {result['errors'][0]}")
             return False
+        if result['statuses'][0] == 'unchanged':
+            print(f"A car with model '{model}' already exists!")
+            return
+        return True
     
     def get_all_cars(self):
-        return self.session.query(Car).all()
+        return self._reader.query(Car).all()
+
+    def get_cars_page(self, page_size=20, after_id=None, before_id=None):
+        return self._get_page(Car, page_size, after_id, before_id)
+
+    def iter_cars(self, page_size=20, after_id=None):
+        return self._iter_pages(Car, page_size, after_id)
+
+    def stream_cars(self, batch_size=1000):
+        return self._stream(Car, batch_size)
+    
+    def find_available_cars(self, start_date, end_date, make=None):
+        # Raises ValueError for a missing or malformed date, and for a period ending before it
+        # starts, which no booking could overlap and so would list every car
+        if not start_date or not end_date:
+            raise ValueError("A start and an end date are required")
+        try:
+            start_date = _parse_date(start_date)
+            end_date = _parse_date(end_date)
+        except ValueError:
+            raise ValueError("Invalid date format. Please use the format DD/MM/YYYY.")
+        if end_date < start_date:
+            raise ValueError("The end date is before the start date")
+        # A car is free when none of its bookings overlaps the period. The NOT EXISTS probe
+        # seeks on ix_rentals_car_dates per car, and stays correct even for databases holding
+        # overlapping bookings made before register_customer_to_car checked for them.
+        query = self._reader.query(Car).filter(~_overlapping_rentals(Car.id, start_date, end_date))
+        if make:
+            query = query.filter(Car.make == make)
+        return query.order_by(Car.id).all()
     
     def find_car_by_id(self, car_id):
-        return self.session.query(Car).filter_by(id=car_id).first()
+        if self.cache is not None:
+            return self._cached_lookup('car', Car, CarSnapshot, car_id)
+        return self._reader.query(Car).filter_by(id=car_id).first()
     
     def find_car_by_name(self, make, model):
-        car = self.session.query(Car).filter_by(make=make, model=model).first()
+        car = self._reader.query(Car).filter_by(make=make, model=model).first()
         if car:
             return car
         else:
             print(f"Car with make '{make}' and model '{model}' not found.")
             return None
     
-    def update_car(self, car_id, new_make=None, new_model=None, new_year=None):
-        # Find the car by its ID
+    @_retry_when_locked
+    def update_car(self, car_id, new_make=None, new_model=None, new_year=None, expected_version=None):
+        # With expected_version (the version the caller read and showed), the update is
+        # refused if anyone has changed the car since, instead of overwriting their change
         car = self.session.query(Car).filter_by(id=car_id).first()
         if not car:
             print(f"Car with ID '{car_id}' not found. Unable to update.")
             return
+        if not self._version_matches('Car', car, expected_version):
+            return False
         
         if new_make is not None:
             car.make = new_make
@@ -159,14 +852,24 @@ class CarRentalSystem:
             car.year = new_year
             
         try:
-            self.session.commit()
+            self._commit()
+            self._invalidate('car', car_id)
             print(f"Car with ID '{car_id}' updated successfully.")
+            return True
+
+        except StaleDataError:
+            self._rollback()
+            self._invalidate('car', car_id)
+            print(f"Error: Car with ID '{car_id}' was changed by another session while updating it. Nothing was saved.")
+            return False
         
         except Exception as e:
-            self.session.rollback()
+            self._rollback(e)
             print(f"Error updating car:{e}")
+            return False
     
     
+    @_retry_when_locked
     def delete_car(self, car_id):
     # Find the car by its ID
         car = self.session.query(Car).filter_by(id=car_id).first()
@@ -179,58 +882,66 @@ class CarRentalSystem:
     
         try:
             self.session.delete(car)
-            self.session.commit()
+            self._commit()
+            self._invalidate('car', car_id)
             return car_info, car_id
         
         except Exception as e:
-            self.session.rollback()
+            self._rollback(e)
             print(f"Error deleting car: {e}")
             return None
 
     
 # CRUD methods for customer
     def add_customer(self, first_name, last_name, phone_no):
-        if not first_name or not last_name or not phone_no:
-            print("Error: First Name, Last Name and phone are required!")
-            
-            # Check if a customer with the given phone number already exists
-        existing_customer = self.session.query(Customer).filter_by(phone_no=phone_no).first()
-        
-        if existing_customer:
+        result = self.upsert_customers([{'first_name': first_name, 'last_name': last_name, 'phone_no': phone_no}])
+        if result is None:
+            return False
+        if result['statuses'][0] == 'rejected':
+            print(f"Error: {result['errors'][0]}")
+            return False
+        if result['statuses'][0] == 'unchanged':
             print(f"Customer with phone number {phone_no} already exists!")
             return
-        
-        customer = Customer(first_name=first_name, last_name=last_name, phone_no=phone_no)
-    
-        try:
-            self.session.add(customer)
-            self.session.commit()
-            print(f"{first_name} {last_name} Added Successfully")
-        except Exception as e:
-            self.session.rollback()
-            print(f'Error: {e}')
+        print(f"{first_name} {last_name} Added Successfully")
+        return True
                         
     
     def get_all_customers(self):
-        return self.session.query(Customer).all()
+        return self._reader.query(Customer).all()
+
+    def get_customers_page(self, page_size=20, after_id=None, before_id=None):
+        return self._get_page(Customer, page_size, after_id, before_id)
+
+    def iter_customers(self, page_size=20, after_id=None):
+        return self._iter_pages(Customer, page_size, after_id)
+
+    def stream_customers(self, batch_size=1000):
+        return self._stream(Customer, batch_size)
     
     def find_customer_by_id(self, customer_id):
-        return self.session.query(Customer).filter_by(id=customer_id).first()
+        if self.cache is not None:
+            return self._cached_lookup('customer', Customer, CustomerSnapshot, customer_id)
+        return self._reader.query(Customer).filter_by(id=customer_id).first()
     
     def find_customer_by_name(self, first_name, last_name):
-        customer = self.session.query(Customer).filter_by(first_name=first_name, last_name=last_name).first()
+        customer = self._reader.query(Customer).filter_by(first_name=first_name, last_name=last_name).first()
         if customer:
             return customer
         else:
             print(f"Customer with first name '{first_name}' and last '{last_name}' not found.")
             return None
         
-    def update_customer(self, customer_id, new_first_name=None, new_last_name=None, new_phone_no=None):
+    @_retry_when_locked
+    def update_customer(self, customer_id, new_first_name=None, new_last_name=None, new_phone_no=None,
+                        expected_version=None):
         # Find the customer by its ID
         customer = self.session.query(Customer).filter_by(id=customer_id).first()
         if not customer:
             print(f"Customer with ID '{customer_id}' not found. Unable to update")
             return
+        if not self._version_matches('Customer', customer, expected_version):
+            return False
 
         # Update customer attributes if new values are provided
         if new_first_name is not None:
@@ -241,13 +952,23 @@ class CarRentalSystem:
             customer.phone_no = new_phone_no
 
         try:
-            self.session.commit()
+            self._commit()
+            self._invalidate('customer', customer_id)
             print(f"Customer with ID '{customer_id}' updated successfully.")
+            return True
+        except StaleDataError:
+            self._rollback()
+            self._invalidate('customer', customer_id)
+            print(f"Error: Customer with ID '{customer_id}' was changed by another session while updating it. "
+                  f"Nothing was saved.")
+            return False
         except Exception as e:
-            self.session.rollback()
+            self._rollback(e)
             print(f"Error updating customer: {e}")
+            return False
         
     
+    @_retry_when_locked
     def delete_customer(self, customer_id,):
         # Find the customer by its ID
         customer = self.session.query(Customer).filter_by(id=customer_id).first()
@@ -259,21 +980,360 @@ class CarRentalSystem:
         try:
             # Delete the customer
             self.session.delete(customer)
-            self.session.commit()
-            print(f"Customer '{customer_name}' with ID '{customer_id}' deleted successfully.")
+            self._commit()
+            self._invalidate('customer', customer_id)
+            return customer_name, customer_id
         except Exception as e:
-            self.session.rollback()
+            self._rollback(e)
             print(f"Error deleting customer: {e}")
+            return None
 
     
+    # Set-based bulk updates and deletes. Each runs as single UPDATE/DELETE statements
+    # with RETURNING inside one transaction, instead of one load and commit per row.
+    def bulk_update_cars(self, filter, values):
+        return self._bulk_update(Car, 'car', CAR_FIELDS, filter, values)
+
+    def bulk_update_customers(self, filter, values):
+        return self._bulk_update(Customer, 'customer', CUSTOMER_FIELDS, filter, values)
+
+    def bulk_delete_cars(self, filter):
+        return self._bulk_delete(Car, 'car', CAR_FIELDS, Rental.car_id, filter)
+
+    def bulk_delete_customers(self, filter):
+        return self._bulk_delete(Customer, 'customer', CUSTOMER_FIELDS, Rental.customer_id, filter)
+
+    @_retry_when_locked
+    def _bulk_update(self, model, kind, fields, filter, values):
+        conditions = parse_filter(model, filter, fields)
+        values = parse_values(model, values, fields[1:])
+        try:
+            ids = self.session.scalars(
+                update(model).where(*conditions).values(**values, version=model.version + 1).returning(model.id),
+                execution_options={'synchronize_session': False},
+            ).all()
+            self._commit()
+        except Exception as e:
+            self._rollback(e)
+            print(f"Error updating {kind}s: {e}")
+            return None
+        self._after_bulk_change(kind, ids)
+        return {'updated': len(ids), 'ids': ids}
+
+    @_retry_when_locked
+    def _bulk_delete(self, model, kind, fields, rental_column, filter):
+        conditions = parse_filter(model, filter, fields)
+        matching = select(model.id).where(*conditions).scalar_subquery()
+        try:
+            # Rentals cannot outlive their car or customer, so they go first, and the
+            # usage summary is reduced by exactly the rentals that were removed
+            rentals = self.session.execute(
+                delete(Rental).where(rental_column.in_(matching))
+                .returning(Rental.car_id, Rental.customer_id, Rental.start_date, Rental.end_date),
+                execution_options={'synchronize_session': False},
+            ).all()
+            if model is Car:
+                self.session.execute(delete(CarMonthUsage).where(CarMonthUsage.car_id.in_(matching)))
+            else:
+                _record_usage_many(
+                    self.session, [(rental.car_id, rental.start_date, rental.end_date) for rental in rentals], sign=-1
+                )
+            ids = self.session.scalars(
+                delete(model).where(*conditions).returning(model.id),
+                execution_options={'synchronize_session': False},
+            ).all()
+            self._commit()
+        except Exception as e:
+            self._rollback(e)
+            print(f"Error deleting {kind}s: {e}")
+            return None
+        self._after_bulk_change(kind, ids)
+        for rental in rentals:
+            self._invalidate('car', rental.car_id)
+            self._invalidate('customer', rental.customer_id)
+        return {'deleted': len(ids), 'rentals_deleted': len(rentals), 'ids': ids}
+
+    def _after_bulk_change(self, kind, ids):
+        # The statements bypassed the identity map, so drop any loaded copies
+        self.session.expire_all()
+        for entity_id in ids:
+            self._invalidate(kind, entity_id)
+
+    # Full-text search, ranked best match first:
+    def search_cars(self, query, limit=10):
+        return self._search(Car, 'cars', query, limit)
+
+    def search_customers(self, query, limit=10):
+        return self._search(Customer, 'customers', query, limit)
+
+    def _search(self, model, table, query, limit):
+        match = match_query(query)
+        if not match:
+            return []
+        statement = text(
+            f"SELECT {table}.* FROM {table}_fts JOIN {table} ON {table}.id = {table}_fts.rowid "
+            f"WHERE {table}_fts MATCH :match ORDER BY {table}_fts.rank LIMIT :limit"
+        )
+        try:
+            return self.session.scalars(
+                select(model).from_statement(statement), {'match': match, 'limit': limit}
+            ).all()
+        except OperationalError as e:
+            if f"no such table: {table}_fts" not in str(e):
+                raise
+            print("Error: Search needs an SQLite build with FTS5")
+            return []
+
+    # Listing methods shared by cars and customers:
+    def _get_page(self, model, page_size, after_id=None, before_id=None):
+        # Keyset pagination: seek past the last id seen instead of using OFFSET,
+        # so every page costs the same no matter how deep into the table it is.
+        query = self._reader.query(model)
+        if before_id is not None:
+            page = query.filter(model.id < before_id).order_by(model.id.desc()).limit(page_size).all()
+            return page[::-1]
+        if after_id is not None:
+            query = query.filter(model.id > after_id)
+        return query.order_by(model.id).limit(page_size).all()
+
+    def _iter_pages(self, model, page_size, after_id=None):
+        while True:
+            page = self._get_page(model, page_size, after_id)
+            if not page:
+                return
+            yield page
+            after_id = page[-1].id
+
+    def _stream(self, model, batch_size):
+        # yield_per fetches and hydrates rows in batches instead of building the whole list
+        return self.session.query(model).order_by(model.id).yield_per(batch_size)
+
+    # Lightweight read path: CarSnapshot/CustomerSnapshot tuples made straight from Core
+    # select() rows, skipping the identity map, change tracking and relationship state that
+    # ORM objects carry. Use these wherever the rows are only displayed.
+    def get_car_records(self, page_size=20, after_id=None, before_id=None):
+        return self._get_record_page(Car, CarSnapshot, page_size, after_id, before_id)
+
+    def get_all_car_records(self):
+        return self._select_records(Car, CarSnapshot, order_by=Car.id)
+
+    def find_car_record_by_id(self, car_id, fresh=False):
+        # fresh skips the cache and the replica, e.g. to read the version an update will check
+        if fresh:
+            return self._first_record(Car, CarSnapshot, Car.id == car_id, session=self.session)
+        if self.cache is not None:
+            return self._cached_lookup('car', Car, CarSnapshot, car_id)
+        return self._first_record(Car, CarSnapshot, Car.id == car_id)
+
+    def find_car_record_by_name(self, make, model):
+        return self._first_record(Car, CarSnapshot, Car.make == make, Car.model == model)
+
+    def get_customer_records(self, page_size=20, after_id=None, before_id=None):
+        return self._get_record_page(Customer, CustomerSnapshot, page_size, after_id, before_id)
+
+    def get_all_customer_records(self):
+        return self._select_records(Customer, CustomerSnapshot, order_by=Customer.id)
+
+    def find_customer_record_by_id(self, customer_id, fresh=False):
+        if fresh:
+            return self._first_record(Customer, CustomerSnapshot, Customer.id == customer_id, session=self.session)
+        if self.cache is not None:
+            return self._cached_lookup('customer', Customer, CustomerSnapshot, customer_id)
+        return self._first_record(Customer, CustomerSnapshot, Customer.id == customer_id)
+
+    def find_customer_record_by_name(self, first_name, last_name):
+        return self._first_record(Customer, CustomerSnapshot,
+                                  Customer.first_name == first_name, Customer.last_name == last_name)
+
+    def _select_records(self, model, record, *conditions, order_by=None, limit=None, session=None):
+        statement = select(*(getattr(model, field) for field in record._fields)).where(*conditions)
+        if order_by is not None:
+            statement = statement.order_by(order_by)
+        if limit is not None:
+            statement = statement.limit(limit)
+        return list(map(record._make, (self._reader if session is None else session).execute(statement)))
+
+    def _first_record(self, model, record, *conditions, session=None):
+        records = self._select_records(model, record, *conditions, limit=1, session=session)
+        return records[0] if records else None
+
+    def _get_record_page(self, model, record, page_size, after_id=None, before_id=None):
+        if before_id is not None:
+            return self._select_records(model, record, model.id < before_id,
+                                        order_by=model.id.desc(), limit=page_size)[::-1]
+        conditions = [model.id > after_id] if after_id is not None else []
+        return self._select_records(model, record, *conditions, order_by=model.id, limit=page_size)
+
+    # Upserts keyed on the unique columns (Car.model, Customer.phone_no). New rows cost one
+    # INSERT ... ON CONFLICT DO NOTHING; with update=True, rows that already exist are
+    # rewritten by a second ON CONFLICT DO UPDATE statement only where a value differs.
+    # Every row is reported as created, updated, unchanged or rejected.
+    def upsert_car(self, make, model, year, update=True):
+        result = self.upsert_cars([{'make': make, 'model': model, 'year': year}], update)
+        return result and result['statuses'][0]
+
+    def upsert_cars(self, records, update=False):
+        return self._upsert(Car, 'car', Car.model, _clean_car, records, update)
+
+    def upsert_customer(self, first_name, last_name, phone_no, update=True):
+        result = self.upsert_customers([{'first_name': first_name, 'last_name': last_name, 'phone_no': phone_no}], update)
+        return result and result['statuses'][0]
+
+    def upsert_customers(self, records, update=False):
+        return self._upsert(Customer, 'customer', Customer.phone_no, _clean_customer, records, update)
+
+    @_retry_when_locked
+    def _upsert(self, model, kind, key_column, clean, records, update, chunk_size=200):
+        key = key_column.key
+        statuses, errors, valid = [], {}, []
+        for index, record in enumerate(records):
+            row, error = clean(record)
+            statuses.append('rejected' if error else None)
+            if error:
+                errors[index] = error
+            else:
+                valid.append((index, row))
+
+        try:
+            for chunk in _chunked(valid, chunk_size):
+                statement = sqlite_insert(model).values([row for _, row in chunk])
+                created = dict(self.session.execute(
+                    statement.on_conflict_do_nothing(index_elements=[key]).returning(key_column, model.id)
+                ).all())
+                existing = []
+                for index, row in chunk:
+                    # Only the first row with a new key created it; any repeat updates it
+                    if created.pop(row[key], None) is not None:
+                        statuses[index] = 'created'
+                    else:
+                        existing.append((index, row))
+
+                updated = {}
+                if update and existing:
+                    statement = sqlite_insert(model).values([row for _, row in existing])
+                    columns = [name for name in existing[0][1] if name != key]
+                    updated = dict(self.session.execute(
+                        statement.on_conflict_do_update(
+                            index_elements=[key],
+                            set_={**{name: statement.excluded[name] for name in columns}, 'version': model.version + 1},
+                            where=or_(*(getattr(model, name).is_not(statement.excluded[name]) for name in columns)),
+                        ).returning(key_column, model.id)
+                    ).all())
+                for index, row in existing:
+                    statuses[index] = 'updated' if row[key] in updated else 'unchanged'
+                for entity_id in updated.values():
+                    self._invalidate(kind, entity_id)
+            self._commit()
+        except Exception as e:
+            self._rollback(e)
+            print(f'Error: {e}')
+            return None
+
+        if 'updated' in statuses:
+            self.session.expire_all()
+        return {
+            'created': statuses.count('created'),
+            'updated': statuses.count('updated'),
+            'unchanged': statuses.count('unchanged'),
+            'rejected': statuses.count('rejected'),
+            'statuses': statuses,
+            'errors': errors,
+        }
+
+    # Bulk import methods:
+    def bulk_import_cars(self, path, batch_size=500):
+        return self._bulk_import(Car, Car.model, _clean_car, path, batch_size)
+
+    def bulk_import_customers(self, path, batch_size=500):
+        return self._bulk_import(Customer, Customer.phone_no, _clean_customer, path, batch_size)
+
+    def _bulk_import(self, model, key_column, clean, path, batch_size):
+        # Stream the file in chunks; each chunk is checked for duplicates with a single
+        # IN query and inserted with one executemany inside its own transaction.
+        key = key_column.key
+        report = {'inserted': 0, 'rejected': [], 'elapsed': 0.0, 'rows_per_sec': 0.0}
+        started = time.perf_counter()
+
+        for chunk in _chunked(_read_records(path), batch_size):
+            candidates = {}
+            for line_no, record in chunk:
+                row, error = clean(record)
+                if error:
+                    report['rejected'].append((line_no, error))
+                elif row[key] in candidates:
+                    report['rejected'].append((line_no, f"Duplicate {key} '{row[key]}' in file"))
+                else:
+                    candidates[row[key]] = (line_no, row)
+
+            if not candidates:
+                continue
+
+            existing = set(self.session.scalars(select(key_column).where(key_column.in_(list(candidates)))))
+            rows = []
+            for value, (line_no, row) in candidates.items():
+                if value in existing:
+                    report['rejected'].append((line_no, f"{key} '{value}' already exists"))
+                else:
+                    rows.append(row)
+
+            if not rows:
+                continue
+
+            error = self._insert_chunk(model, rows)
+            if error is None:
+                report['inserted'] += len(rows)
+            else:
+                for value, (line_no, row) in candidates.items():
+                    if value not in existing:
+                        report['rejected'].append((line_no, f"Error: {error}"))
+
+        report['rejected'].sort()
+        report['elapsed'] = time.perf_counter() - started
+        if report['elapsed'] > 0:
+            report['rows_per_sec'] = report['inserted'] / report['elapsed']
+        return report
+
+    @_retry_when_locked
+    def _insert_chunk(self, model, rows):
+        # Commits one import chunk on its own, so a retry never repeats an earlier chunk
+        try:
+            self.session.execute(insert(model), rows)
+            self.session.commit()
+        except Exception as e:
+            self._rollback(e)
+            return e
+        return None
+
+
     def get_customers_in_a_car(self, car_id):
         car = self.session.query(Car).filter_by(id=car_id).first()
 
         if car:
-            return car.customers
+            return (self.session.query(Customer).join(Rental, Rental.customer_id == Customer.id)
+                    .filter(Rental.car_id == car.id).order_by(Rental.start_date).all())
         else: 
             print("Car not found")
             return []
+
+    # Relationship views. Each loads its related rows in the same query (joinedload or
+    # an outer join), so the number of statements does not grow with the number of rentals.
+    def get_rental_history_for_car(self, car_id):
+        return (self.session.query(Rental).options(joinedload(Rental.customer))
+                .filter(Rental.car_id == car_id).order_by(Rental.start_date).all())
+
+    def get_rental_history_for_customer(self, customer_id):
+        return (self.session.query(Rental).options(joinedload(Rental.car))
+                .filter(Rental.customer_id == customer_id).order_by(Rental.start_date).all())
+
+    def get_cars_with_current_renter(self, on=None):
+        # Every car paired with the customer renting it on the given day (today by
+        # default), or None when it is free. Dates are stored at midnight and end dates are
+        # inclusive, so the day is compared from its start, as in find_available_cars.
+        on = (_parse_date(on) or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+        return (self.session.query(Car, Customer)
+                .outerjoin(Rental, (Rental.car_id == Car.id) & (Rental.start_date <= on) & (Rental.end_date >= on))
+                .outerjoin(Customer, Customer.id == Rental.customer_id)
+                .order_by(Car.id).all())
         
     
         # Method to register a customer to a car
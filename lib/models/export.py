@@ -0,0 +1,159 @@
+from models.car_rental_system_cli import Car, Customer, Invoice, Rental
+from datetime import datetime
+from sqlalchemy import select
+import csv
+import gzip
+import json
+import os
+import time
+
+
+# What can be exported: the three tables and the billing invoices as they are, and every
+# rental joined to its car and customer. The first column is always the row's id, which is
+# what incremental exports (since) compare against.
+EXPORTS = {
+    'cars': select(Car.id, Car.make, Car.model, Car.year),
+    'customers': select(Customer.id, Customer.first_name, Customer.last_name, Customer.phone_no),
+    'rentals': select(Rental.id, Rental.customer_id, Rental.car_id, Rental.start_date, Rental.end_date),
+    'rental_details': (
+        select(Rental.id, Rental.start_date, Rental.end_date,
+               Car.id.label('car_id'), Car.make, Car.model, Car.year,
+               Customer.id.label('customer_id'), Customer.first_name, Customer.last_name, Customer.phone_no)
+        .join(Car, Car.id == Rental.car_id)
+        .join(Customer, Customer.id == Rental.customer_id)
+    ),
+    'invoices': select(Invoice.id, Invoice.customer_id, Invoice.month, Invoice.rentals, Invoice.rental_days,
+                       Invoice.weekend_days, Invoice.amount, Invoice.issued_at),
+}
+FORMATS = ('csv', 'jsonl', 'parquet')
+MANIFEST = 'manifest.json'
+
+
+def _id_column(name):
+    return {'cars': Car.id, 'customers': Customer.id, 'invoices': Invoice.id}.get(name, Rental.id)
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class CsvWriter:
+
+    def __init__(self, file, columns):
+        self.writer = csv.writer(file)
+        self.writer.writerow(columns)
+
+    def write(self, columns, rows):
+        self.writer.writerows([_plain(value) for value in row] for row in rows)
+
+    def close(self):
+        pass
+
+
+class JsonLinesWriter:
+
+    def __init__(self, file, columns):
+        self.file = file
+
+    def write(self, columns, rows):
+        self.file.write(''.join(json.dumps(dict(zip(columns, map(_plain, row)))) + '\n' for row in rows))
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    # Each chunk becomes one row group, so only a chunk is ever held in memory
+
+    def __init__(self, path, columns, compression):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+        self.pyarrow = pyarrow
+        self.parquet = pyarrow.parquet
+        self.path = path
+        self.compression = compression
+        self.writer = None
+
+    def write(self, columns, rows):
+        table = self.pyarrow.Table.from_pylist([dict(zip(columns, row)) for row in rows])
+        if self.writer is None:
+            self.writer = self.parquet.ParquetWriter(self.path, table.schema, compression=self.compression)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def export_path(directory, name, format, compress=False):
+    return os.path.join(directory, f"{name}.{format}" + ('.gz' if compress and format != 'parquet' else ''))
+
+
+def export_table(conn, name, path, format='csv', compress=False, since=None, chunk_size=5000):
+    # Streams one export to a file a chunk at a time straight from the cursor, so memory
+    # use depends on chunk_size and not on the size of the table. Returns the number of
+    # rows written and the highest id seen, which the next incremental export starts from.
+    if name not in EXPORTS:
+        raise ValueError(f"Unknown export '{name}'; choose from {', '.join(EXPORTS)}")
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format '{format}'; choose from {', '.join(FORMATS)}")
+
+    id_column = _id_column(name)
+    statement = EXPORTS[name].order_by(id_column)
+    if since is not None:
+        statement = statement.where(id_column > since)
+
+    started = time.perf_counter()
+    result = conn.execution_options(yield_per=chunk_size).execute(statement)
+    columns = list(result.keys())
+    rows_written, last_id = 0, since
+
+    if format == 'parquet':
+        file = None
+        writer = ParquetWriter(path, columns, 'gzip' if compress else 'snappy')
+    else:
+        opener = gzip.open if compress else open
+        file = opener(path, 'wt', newline='', encoding='utf-8')
+        writer = (CsvWriter if format == 'csv' else JsonLinesWriter)(file, columns)
+    try:
+        for chunk in result.partitions():
+            writer.write(columns, chunk)
+            rows_written += len(chunk)
+            last_id = chunk[-1][0]
+        writer.close()
+    finally:
+        result.close()
+        if file is not None:
+            file.close()
+
+    return {
+        'export': name,
+        'path': path,
+        'rows': rows_written,
+        'last_id': last_id,
+        'elapsed': time.perf_counter() - started,
+    }
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def write_manifest(directory, results, journal_seq=None):
+    # Records the highest id exported per table so --since can pick up where this run stopped,
+    # and the change journal's seq when the export began, from which a copy built from these
+    # files can follow changes_since() instead of exporting again
+    manifest = read_manifest(directory)
+    for result in results:
+        manifest[result['export']] = {'last_id': result['last_id'], 'path': os.path.basename(result['path'])}
+    if journal_seq is not None:
+        manifest['journal_seq'] = journal_seq
+    with open(os.path.join(directory, MANIFEST), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
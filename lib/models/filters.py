@@ -0,0 +1,74 @@
+import re
+
+
+# A clause is "<field> <operator> <value>"; clauses are joined with "and".
+# "~" means "starts with", e.g. "make ~ Toy and year < 2015".
+CLAUSE = re.compile(r'^\s*(\w+)\s*(<=|>=|!=|=|<|>|~)\s*(.+?)\s*$')
+ASSIGNMENT = re.compile(r'^\s*(\w+)\s*=\s*(.+?)\s*$')
+
+
+def _column(model, fields, name):
+    if name not in fields:
+        raise ValueError(f"Unknown field '{name}'; choose from {', '.join(fields)}")
+    return getattr(model, name)
+
+
+def _value(column, raw):
+    if isinstance(raw, str):
+        raw = raw.strip().strip('\'"')
+        if column.type.python_type is int:
+            try:
+                return int(raw)
+            except ValueError:
+                raise ValueError(f"'{raw}' is not a whole number for {column.key}")
+    return raw
+
+
+def parse_filter(model, expression, fields):
+    # Accepts either a filter expression string or a {field: value} dict of equality tests,
+    # and returns a list of SQLAlchemy conditions. An empty filter is refused so that a
+    # typo cannot turn into an update or delete of the whole table.
+    if isinstance(expression, dict):
+        conditions = [_column(model, fields, name) == _value(_column(model, fields, name), value)
+                      for name, value in expression.items()]
+    else:
+        conditions = []
+        for clause in re.split(r'\s+and\s+', expression or '', flags=re.IGNORECASE):
+            if not clause.strip():
+                continue
+            match = CLAUSE.match(clause)
+            if not match:
+                raise ValueError(f"Cannot understand '{clause.strip()}'; use e.g. year < 2015")
+            name, operator, raw = match.groups()
+            column = _column(model, fields, name)
+            value = _value(column, raw)
+            conditions.append({
+                '=': lambda: column == value,
+                '!=': lambda: column != value,
+                '<': lambda: column < value,
+                '<=': lambda: column <= value,
+                '>': lambda: column > value,
+                '>=': lambda: column >= value,
+                '~': lambda: column.startswith(str(value), autoescape=True),
+            }[operator]())
+    if not conditions:
+        raise ValueError("A filter is required")
+    return conditions
+
+
+def parse_values(model, assignments, fields):
+    # Accepts "field=value, field=value" or a dict, returning {field: value}
+    if isinstance(assignments, str):
+        pairs = {}
+        for part in assignments.split(','):
+            if not part.strip():
+                continue
+            match = ASSIGNMENT.match(part)
+            if not match:
+                raise ValueError(f"Cannot understand '{part.strip()}'; use e.g. year=2020")
+            pairs[match.group(1)] = match.group(2)
+        assignments = pairs
+    values = {name: _value(_column(model, fields, name), value) for name, value in assignments.items()}
+    if not values:
+        raise ValueError("Nothing to update")
+    return values
@@ -0,0 +1,66 @@
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+
+# Immutable copies of rows, detached from any session. The cache hands these out, and so
+# does the lightweight read path (CarRentalSystem.get_car_records and friends). version
+# is what update_car/update_customer take as expected_version.
+CarSnapshot = namedtuple('CarSnapshot', ['id', 'make', 'model', 'year', 'version'])
+CustomerSnapshot = namedtuple('CustomerSnapshot', ['id', 'first_name', 'last_name', 'phone_no', 'version'])
+
+
+class SnapshotCache:
+    # Bounded LRU cache with an optional time-to-live, keyed by (kind, id). A lock guards
+    # the entries, as a group_commit writer thread invalidates them while lookups run.
+
+    def __init__(self, max_size=1024, ttl=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if self.ttl is None or self.clock() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, self.clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
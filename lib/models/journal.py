@@ -0,0 +1,101 @@
+from models.car_rental_system_cli import ChangeJournal
+from sqlalchemy import func, select, text
+import json
+
+
+# Tables whose changes are journaled, with the columns recorded before and after each change
+JOURNALED_COLUMNS = {
+    'cars': ('id', 'make', 'model', 'year'),
+    'customers': ('id', 'first_name', 'last_name', 'phone_no'),
+    'rentals': ('id', 'start_date', 'end_date', 'customer_id', 'car_id'),
+}
+# Same layout as the timestamps SQLAlchemy writes, so changed_at reads back as a datetime
+NOW = "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
+def _image(row, columns):
+    return "json_object(" + ", ".join(f"'{column}', {row}.{column}" for column in columns) + ")"
+
+
+def _journal_ddl():
+    # Like the search index, the journal is kept by triggers, so every insert, update and
+    # delete is recorded in the transaction that makes it, whichever code path makes it:
+    # ORM flushes, upserts, bulk statements and imports alike. Updates that change
+    # nothing are not recorded.
+    statements = []
+    for table, columns in JOURNALED_COLUMNS.items():
+        insert = "INSERT INTO change_journal (table_name, operation, row_id, before, after, changed_at)"
+        changed = " OR ".join(f"old.{column} IS NOT new.{column}" for column in columns)
+        statements += [
+            f"""CREATE TRIGGER IF NOT EXISTS {table}_journal_insert AFTER INSERT ON {table} BEGIN
+                {insert} VALUES ('{table}', 'insert', new.id, NULL, {_image('new', columns)}, {NOW});
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS {table}_journal_update AFTER UPDATE ON {table} WHEN {changed} BEGIN
+                {insert} VALUES ('{table}', 'update', new.id, {_image('old', columns)}, {_image('new', columns)}, {NOW});
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS {table}_journal_delete AFTER DELETE ON {table} BEGIN
+                {insert} VALUES ('{table}', 'delete', old.id, {_image('old', columns)}, NULL, {NOW});
+            END""",
+        ]
+    return statements
+
+
+JOURNAL_DDL = _journal_ddl()
+
+# Log compaction: of the entries up to a sequence number, only the newest for each row
+# is kept. Replaying the journal from the start still ends with every row as it is now.
+COMPACT_SQL = """DELETE FROM change_journal WHERE seq <= :through AND seq NOT IN (
+    SELECT MAX(seq) FROM change_journal WHERE seq <= :through GROUP BY table_name, row_id
+)"""
+
+
+def install_journal(engine):
+    with engine.begin() as conn:
+        for statement in JOURNAL_DDL:
+            conn.exec_driver_sql(statement)
+
+
+def last_seq(conn):
+    return conn.execute(select(func.max(ChangeJournal.seq))).scalar() or 0
+
+
+def _entry(row):
+    return {
+        'seq': row.seq,
+        'table': row.table_name,
+        'operation': row.operation,
+        'row_id': row.row_id,
+        'before': json.loads(row.before) if row.before is not None else None,
+        'after': json.loads(row.after) if row.after is not None else None,
+        'changed_at': row.changed_at,
+    }
+
+
+def changes_since(engine, seq=0, tables=None, batch_size=1000):
+    # Yields the entries after seq in order, reading them batch_size at a time by seeking
+    # past the last sequence number seen. Each batch is its own short read, so a slow
+    # consumer never holds the database open.
+    unknown = set(tables or ()) - set(JOURNALED_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown table {', '.join(sorted(unknown))}; choose from {', '.join(JOURNALED_COLUMNS)}")
+    while True:
+        statement = select(ChangeJournal).where(ChangeJournal.seq > seq)
+        if tables:
+            statement = statement.where(ChangeJournal.table_name.in_(tables))
+        with engine.connect() as conn:
+            rows = conn.execute(statement.order_by(ChangeJournal.seq).limit(batch_size)).all()
+        if not rows:
+            return
+        for row in rows:
+            yield _entry(row)
+        seq = rows[-1].seq
+
+
+def compact_journal(conn, through=None):
+    # Compacts the entries up to `through` (everything by default). Sequence numbers are
+    # never reused, so consumers carry on from the last one they saw.
+    last = last_seq(conn)
+    through = last if through is None else min(int(through), last)
+    removed = conn.execute(text(COMPACT_SQL), {'through': through}).rowcount
+    return {'through': through, 'removed': removed,
+            'kept': conn.execute(select(func.count(ChangeJournal.seq))).scalar()}
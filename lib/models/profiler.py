@@ -0,0 +1,161 @@
+from bisect import bisect_left
+from functools import wraps
+from sqlalchemy import event
+import json
+import threading
+import time
+
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+
+class MethodStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.statements = 0
+        self.max_statements = 0
+        self.histogram = [0] * (len(BUCKETS_MS) + 1)
+
+    def record(self, elapsed_ms, statements, failed):
+        self.calls += 1
+        self.errors += failed
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.statements += statements
+        self.max_statements = max(self.max_statements, statements)
+        self.histogram[bisect_left(BUCKETS_MS, elapsed_ms)] += 1
+
+    def percentile(self, percent):
+        # Upper bound of the bucket holding the requested rank
+        rank = self.calls * percent / 100
+        seen = 0
+        for bound, count in zip(BUCKETS_MS + [self.max_ms], self.histogram):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.calls, 3) if self.calls else 0,
+            'max_ms': round(self.max_ms, 3),
+            'p50_ms': round(self.percentile(50), 3),
+            'p99_ms': round(self.percentile(99), 3),
+            'statements': self.statements,
+            'statements_per_call': round(self.statements / self.calls, 2) if self.calls else 0,
+            'max_statements_per_call': self.max_statements,
+            'histogram': dict(zip([f"<={bound}ms" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"], self.histogram)),
+        }
+
+
+class Profiler:
+    # Times public CarRentalSystem methods and counts the SQL each one issues,
+    # so N+1 patterns show up as a high statements-per-call figure.
+
+    def __init__(self, slow_query_ms=50, slow_query_log=None, keep_slow_queries=100):
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self.keep_slow_queries = keep_slow_queries
+        self.methods = {}
+        self.slow_queries = []
+        self.statement_count = 0
+        self._engines = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def instrument(self, car_rental_system):
+        # Shadow every public method on the instance with a timed wrapper
+        for name in dir(type(car_rental_system)):
+            attribute = getattr(type(car_rental_system), name)
+            if name.startswith('_') or not callable(attribute) or isinstance(attribute, property):
+                continue
+            setattr(car_rental_system, name, self._timed(name, getattr(car_rental_system, name)))
+
+    def attach(self, engine):
+        with self._lock:
+            if id(engine) in self._engines:
+                return
+            self._engines.add(id(engine))
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _timed(self, name, method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            stack = self._stack()
+            stack.append(0)
+            failed = False
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                statements = stack.pop()
+                if stack:
+                    # Nested public calls also count towards the method that called them
+                    stack[-1] += statements
+                with self._lock:
+                    self.methods.setdefault(name, MethodStats()).record(elapsed_ms, statements, failed)
+        return wrapper
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info['profiler_started'].pop()) * 1000
+        stack = self._stack()
+        if stack:
+            stack[-1] += 1
+        with self._lock:
+            self.statement_count += 1
+            if elapsed_ms < self.slow_query_ms:
+                return
+            entry = {
+                'at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'ms': round(elapsed_ms, 3),
+                'statement': ' '.join(statement.split()),
+                'parameters': repr(parameters)[:200],
+            }
+            self.slow_queries.append(entry)
+            del self.slow_queries[:-self.keep_slow_queries]
+            if self.slow_query_log:
+                with open(self.slow_query_log, 'a', encoding='utf-8') as log:
+                    log.write(json.dumps(entry) + '\n')
+
+    def report(self):
+        with self._lock:
+            return {
+                'statements': self.statement_count,
+                'slow_query_ms': self.slow_query_ms,
+                'methods': {name: stats.as_dict() for name, stats in sorted(self.methods.items())},
+                'slow_queries': list(self.slow_queries),
+            }
+
+    def dump_json(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def summary(self):
+        report = self.report()
+        lines = [f"{'method':<28}{'calls':>7}{'avg ms':>10}{'p99 ms':>10}{'max ms':>10}{'stmts/call':>12}{'max stmts':>11}"]
+        for name, stats in report['methods'].items():
+            lines.append(f"{name:<28}{stats['calls']:>7}{stats['avg_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+                         f"{stats['max_ms']:>10.2f}{stats['statements_per_call']:>12}{stats['max_statements_per_call']:>11}")
+        lines.append(f"{report['statements']} SQL statements, {len(report['slow_queries'])} slower than {self.slow_query_ms} ms")
+        return '\n'.join(lines)
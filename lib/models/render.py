@@ -0,0 +1,210 @@
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import chain, islice
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+
+# How listings are written: an aligned table for people, or TSV / JSON Lines for programs.
+# By default a terminal gets the table (through a pager) and a pipe or file gets TSV.
+FORMATS = ('table', 'tsv', 'json')
+# Column widths start from the header and the first SAMPLE_ROWS rows, so the first lines can
+# be written before the rest of the rows have even been read. A longer value later on widens
+# its column from that chunk of rows on: numbers and IDs as far as they need, text up to
+# MAX_WIDTH, past which it is shortened and ends in ELLIPSIS.
+SAMPLE_ROWS = 1000
+MAX_WIDTH = 40
+ELLIPSIS = '\u2026'
+# Rows formatted into one string per write
+CHUNK_ROWS = 2000
+PAGER = 'less -FRSX'
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%d/%m/%Y')
+    return str(value)
+
+
+def _fit(text, width):
+    return text if len(text) <= width else text[:width - 1] + ELLIPSIS
+
+
+def _longest(column, numeric):
+    # Length of the longest value's text, measured in C: numbers by their extremes, text by
+    # len(). None when the column holds anything else (a None, say), which is converted first.
+    try:
+        if numeric:
+            high, low = max(column), min(column)
+            return None if high is None else max(len(str(high)), len(str(low)))
+        return max(map(len, column))
+    except TypeError:
+        return None
+
+
+class TableWriter:
+    # Left-aligned text, right-aligned numbers, two spaces between columns. Rows are laid out
+    # by one %-format per row, which converts and pads every value in C. Values str() would
+    # show badly (None, dates) are converted in Python first, for every chunk when the sample
+    # holds any, and for a chunk holding one otherwise. Each chunk is measured column by
+    # column before it is written, so no value is ever cut to a width taken from the sample.
+
+    def __init__(self, file, columns, sample):
+        cells = [[_text(value) for value in row] for row in sample]
+        self.numeric = [bool(sample) and all(isinstance(row[n], (int, float)) or row[n] is None for row in sample)
+                        for n in range(len(columns))]
+        self.widths = [max([len(name)] + [len(row[n]) for row in cells]) for n, name in enumerate(columns)]
+        self.widths = [width if numeric else min(width, MAX_WIDTH) for width, numeric in zip(self.widths, self.numeric)]
+        self.plain = all(type(value) in (str, int) for row in sample for value in row)
+        self._layout()
+        self.file = file
+        # Written with the first chunk, so it lines up with any column that chunk widens
+        self.header = [name.replace('_', ' ').upper() for name in columns]
+        if not sample:
+            self._write_header()
+
+    def _layout(self):
+        specs = [f"%{'' if right else '-'}{width}s" for width, right in zip(self.widths, self.numeric)]
+        if specs and not self.numeric[-1]:
+            specs[-1] = '%s'
+        self.template = '  '.join(specs) + '\n'
+
+    def write(self, rows):
+        widths, numeric = self.widths, self.numeric
+        values = list(zip(*rows))
+        longest = [_longest(column, right) for column, right in zip(values, numeric)] if self.plain else [None]
+        if None in longest:
+            values = [list(map(_text, column)) for column in values]
+            rows = list(zip(*values))
+            longest = [max(map(len, column)) for column in values]
+        if any(length > width for length, width in zip(longest, widths)):
+            for n, length in enumerate(longest):
+                if length <= widths[n]:
+                    continue
+                if numeric[n]:
+                    widths[n] = length
+                else:
+                    widths[n] = min(length, MAX_WIDTH)
+                    if length > MAX_WIDTH:
+                        values[n] = [_fit(str(value), MAX_WIDTH) for value in values[n]]
+                        rows = None
+            if rows is None:
+                rows = list(zip(*values))
+            self._layout()
+        template = self.template
+        if self.header is not None:
+            self._write_header()
+        self.file.write(''.join([template % tuple(row) for row in rows]))
+
+    def _write_header(self):
+        self.file.write(self.template % tuple(_fit(name, width) for name, width in zip(self.header, self.widths)))
+        self.header = None
+
+
+def _tsv_text(value):
+    # Tabs, newlines and backslashes are escaped, so every row stays on one line
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    text = str(value)
+    if '\\' in text or '\t' in text or '\n' in text or '\r' in text:
+        text = text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return text
+
+
+class TsvWriter:
+    # Each chunk is first written with one %s per value, which already gives dates as ISO
+    # 8601; it is only redone value by value when the result shows a None or a character
+    # that needs escaping
+
+    def __init__(self, file, columns, sample):
+        self.file = file
+        self.columns = len(columns)
+        self.template = '\t'.join(['%s'] * len(columns)) + '\n'
+        self.file.write('\t'.join(columns) + '\n')
+
+    def write(self, rows):
+        template = self.template
+        text = ''.join([template % tuple(row) for row in rows])
+        if (text.count('\t') != len(rows) * (self.columns - 1) or text.count('\n') != len(rows)
+                or '\\' in text or '\r' in text or 'None' in text):
+            text = ''.join(['\t'.join([_tsv_text(value) for value in row]) + '\n' for row in rows])
+        self.file.write(text)
+
+
+class JsonWriter:
+    # JSON Lines: one object per row, keyed by column name
+
+    def __init__(self, file, columns, sample):
+        self.file = file
+        self.columns = columns
+        # One encoder for every row; json.dumps(default=...) would build a new one per call
+        self.encode = json.JSONEncoder(default=str).encode
+
+    def write(self, rows):
+        columns, encode = self.columns, self.encode
+        self.file.write(''.join([encode(dict(zip(columns, row))) + '\n' for row in rows]))
+
+
+WRITERS = {'table': TableWriter, 'tsv': TsvWriter, 'json': JsonWriter}
+
+
+def choose_format(format=None, out=None):
+    format = format or ('table' if (out or sys.stdout).isatty() else 'tsv')
+    if format not in FORMATS:
+        raise ValueError(f"Unknown output format '{format}'; choose from {', '.join(FORMATS)}")
+    return format
+
+
+@contextmanager
+def output(out=None, page=None):
+    # Yields the file to render into. On a terminal that is a pager's stdin ($PAGER, else
+    # less, which exits straight away when everything fits on one screen); anywhere else,
+    # or when no pager can be started, it is out itself.
+    out = out or sys.stdout
+    page = out.isatty() if page is None else page
+    command = os.environ.get('PAGER', PAGER) if page else ''
+    pager = None
+    if command and command != 'cat' and shutil.which(command.split()[0]):
+        out.flush()
+        pager = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, text=True, encoding='utf-8')
+    try:
+        yield pager.stdin if pager is not None else out
+    except BrokenPipeError:
+        # The reader (the pager, or e.g. head at the end of a pipe) stopped early. Anything
+        # still buffered for a closed stdout goes to devnull instead of failing again at exit.
+        if pager is None and out is sys.stdout:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if pager is not None:
+            try:
+                pager.stdin.close()
+            except BrokenPipeError:
+                pass
+            pager.wait()
+
+
+def render(rows, columns, out=None, format=None, page=None, sample_size=SAMPLE_ROWS):
+    # Writes rows (any iterable of tuples, read lazily) under the given column names and
+    # returns how many there were. Only the sample and one chunk are held at a time.
+    format = choose_format(format, out)
+    rows = iter(rows)
+    sample = list(islice(rows, sample_size))
+    count = 0
+    with output(out, page if format == 'table' else False) as file:
+        writer = WRITERS[format](file, columns, sample)
+        rows = chain(sample, rows)
+        while True:
+            chunk = list(islice(rows, CHUNK_ROWS))
+            if not chunk:
+                break
+            writer.write(chunk)
+            count += len(chunk)
+        file.flush()
+    return count
@@ -0,0 +1,66 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import time
+
+
+class ReadReplica:
+    # A private in-memory copy of the database, taken with SQLite's online backup API.
+    # Reads served from it never wait on the database file's lock. The copy is refreshed
+    # before a read once it is max_age seconds old or max_writes commits behind, so no
+    # answer is staler than that. Commits made by other processes are only bounded by max_age.
+
+    def __init__(self, source, max_age=None, max_writes=None, clock=time.monotonic):
+        self.source = source
+        self.max_age = max_age
+        self.max_writes = max_writes
+        self.clock = clock
+        # One shared connection, since every connection to sqlite:// is a separate database
+        self.engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+        self._session = sessionmaker(bind=self.engine)()
+        self.refreshed_at = None
+        self.writes_behind = 0
+        self.refreshes = 0
+        self.last_refresh_ms = 0.0
+
+    def note_write(self):
+        self.writes_behind += 1
+
+    def is_stale(self):
+        if self.refreshed_at is None:
+            return True
+        if self.max_age is not None and self.clock() - self.refreshed_at >= self.max_age:
+            return True
+        return self.max_writes is not None and self.writes_behind >= self.max_writes
+
+    def refresh(self):
+        started = time.perf_counter()
+        # Objects loaded from the old copy must not be served after it is replaced
+        self._session.close()
+        source = self.source.raw_connection()
+        target = self.engine.raw_connection()
+        try:
+            source.driver_connection.backup(target.driver_connection)
+        finally:
+            target.close()
+            source.close()
+        self.refreshed_at = self.clock()
+        self.writes_behind = 0
+        self.refreshes += 1
+        self.last_refresh_ms = (time.perf_counter() - started) * 1000
+
+    @property
+    def session(self):
+        if self.is_stale():
+            self.refresh()
+        return self._session
+
+    def stats(self):
+        return {
+            'age_seconds': None if self.refreshed_at is None else round(self.clock() - self.refreshed_at, 3),
+            'writes_behind': self.writes_behind,
+            'max_age': self.max_age,
+            'max_writes': self.max_writes,
+            'refreshes': self.refreshes,
+            'last_refresh_ms': round(self.last_refresh_ms, 3),
+        }
@@ -0,0 +1,79 @@
+from models.car_rental_system_cli import Car, CarMonthUsage
+from calendar import monthrange
+from sqlalchemy import func, select
+
+
+# Columns a utilization report can be grouped by
+GROUPINGS = {
+    'car': [Car.id, Car.make, Car.model],
+    'make': [Car.make],
+    'year': [Car.year],
+    'month': [CarMonthUsage.month],
+}
+
+
+def _month_days(month):
+    year, month = map(int, month.split('-'))
+    return monthrange(year, month)[1]
+
+
+def _months_between(start_month, end_month):
+    year, month = map(int, start_month.split('-'))
+    while f"{year:04d}-{month:02d}" <= end_month:
+        yield f"{year:04d}-{month:02d}"
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def utilization_report(session, group_by=('make',), start_month=None, end_month=None):
+    # Reads only the pre-aggregated car_month_usage rows and the cars table, never rentals.
+    # Utilization is rented car-days divided by the car-days available in the period.
+    unknown = set(group_by) - set(GROUPINGS)
+    if unknown:
+        raise ValueError(f"Cannot group by {', '.join(sorted(unknown))}; choose from {', '.join(GROUPINGS)}")
+
+    if start_month is None or end_month is None:
+        first, last = session.execute(select(func.min(CarMonthUsage.month), func.max(CarMonthUsage.month))).one()
+        start_month = start_month or first
+        end_month = end_month or last
+    if start_month is None:
+        return []
+
+    key_columns = [column for key in group_by for column in GROUPINGS[key]]
+    car_columns = [column for key in group_by if key != 'month' for column in GROUPINGS[key]]
+
+    usage = session.execute(
+        select(*key_columns, func.sum(CarMonthUsage.bookings), func.sum(CarMonthUsage.rental_days))
+        .join(Car, Car.id == CarMonthUsage.car_id)
+        .where(CarMonthUsage.month.between(start_month, end_month))
+        .group_by(*key_columns)
+    ).all()
+
+    # Every car in a group counts towards its capacity, rented or not
+    fleet = {tuple(row[:-1]): row[-1] for row in session.execute(
+        select(*car_columns, func.count(Car.id)).group_by(*car_columns)
+    )}
+    period_days = sum(_month_days(month) for month in _months_between(start_month, end_month))
+
+    report = []
+    seen = set()
+    for row in usage:
+        keys = dict(zip([column.key for column in key_columns], row[:len(key_columns)]))
+        bookings, rental_days = row[len(key_columns):]
+        group = tuple(keys[column.key] for column in car_columns)
+        seen.add(group)
+        cars = fleet.get(group, 0)
+        days = _month_days(keys['month']) if 'month' in group_by else period_days
+        report.append({
+            **keys,
+            'cars': cars,
+            'bookings': bookings,
+            'rental_days': rental_days,
+            'utilization': rental_days / (cars * days) if cars else 0.0,
+        })
+    if 'month' not in group_by:
+        # Groups with no rentals in the period still belong in the report
+        for group, cars in fleet.items():
+            if group not in seen:
+                keys = dict(zip([column.key for column in car_columns], group))
+                report.append({**keys, 'cars': cars, 'bookings': 0, 'rental_days': 0, 'utilization': 0.0})
+    return report
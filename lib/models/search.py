@@ -0,0 +1,64 @@
+from sqlalchemy.exc import OperationalError
+import re
+
+
+# FTS5 indexes over the cars and customers tables. They are external-content tables,
+# so they hold only the index, and the triggers keep them in step with every insert,
+# update and delete, whichever code path makes it.
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS cars_fts USING fts5(
+        make, model, year, content='cars', content_rowid='id', prefix='1 2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS cars_fts_insert AFTER INSERT ON cars BEGIN
+        INSERT INTO cars_fts(rowid, make, model, year) VALUES (new.id, new.make, new.model, new.year);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cars_fts_delete AFTER DELETE ON cars BEGIN
+        INSERT INTO cars_fts(cars_fts, rowid, make, model, year) VALUES ('delete', old.id, old.make, old.model, old.year);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cars_fts_update AFTER UPDATE ON cars BEGIN
+        INSERT INTO cars_fts(cars_fts, rowid, make, model, year) VALUES ('delete', old.id, old.make, old.model, old.year);
+        INSERT INTO cars_fts(rowid, make, model, year) VALUES (new.id, new.make, new.model, new.year);
+    END""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts USING fts5(
+        first_name, last_name, phone_no, content='customers', content_rowid='id', prefix='1 2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS customers_fts_insert AFTER INSERT ON customers BEGIN
+        INSERT INTO customers_fts(rowid, first_name, last_name, phone_no)
+        VALUES (new.id, new.first_name, new.last_name, new.phone_no);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS customers_fts_delete AFTER DELETE ON customers BEGIN
+        INSERT INTO customers_fts(customers_fts, rowid, first_name, last_name, phone_no)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.phone_no);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS customers_fts_update AFTER UPDATE ON customers BEGIN
+        INSERT INTO customers_fts(customers_fts, rowid, first_name, last_name, phone_no)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.phone_no);
+        INSERT INTO customers_fts(rowid, first_name, last_name, phone_no)
+        VALUES (new.id, new.first_name, new.last_name, new.phone_no);
+    END""",
+    # Index whatever rows were already there when the index was created
+    "INSERT INTO cars_fts(cars_fts) VALUES ('rebuild')",
+    "INSERT INTO customers_fts(customers_fts) VALUES ('rebuild')",
+]
+
+
+def install_search_index(engine):
+    # Returns False when this SQLite build has no FTS5 module
+    try:
+        with engine.begin() as conn:
+            for statement in SEARCH_INDEX_DDL:
+                conn.exec_driver_sql(statement)
+        return True
+    except OperationalError as e:
+        if 'fts5' in str(e):
+            return False
+        raise
+
+
+def match_query(text):
+    # Turns free text into an FTS5 query where every word must match as a prefix.
+    # Phone numbers are stored as integers, so leading zeros are dropped from digit runs.
+    terms = []
+    for word in re.findall(r'\w+', text):
+        if word.isdigit():
+            word = word.lstrip('0') or '0'
+        terms.append(f'"{word}"*')
+    return ' AND '.join(terms)
@@ -0,0 +1,378 @@
+from models.car_rental_system_cli import CarRentalSystem, Car, Customer, CarMonthUsage, _clean_car, _clean_customer
+from models.reports import GROUPINGS, _month_days, _months_between
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, zip_longest
+from operator import attrgetter
+from sqlalchemy import func, select
+import os
+import time
+import zlib
+
+
+# Every shard hands out ids from its own block, so an id names its shard: id // SHARD_ID_STRIDE
+SHARD_ID_STRIDE = 10 ** 9
+SHARDED_TABLES = ('cars', 'customers', 'rentals')
+REPORT_MEASURES = ('cars', 'bookings', 'rental_days', 'utilization')
+
+
+def prepare_shard(engine, index):
+    # Starts each table's AUTOINCREMENT sequence at the shard's block. Shard 0 starts at
+    # zero, so an existing single-file database can become the first shard as it is.
+    offset = index * SHARD_ID_STRIDE
+    with engine.begin() as conn:
+        for table in SHARDED_TABLES:
+            ddl = conn.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).scalar()
+            if 'AUTOINCREMENT' not in ddl.upper():
+                if index:
+                    raise ValueError(f"{engine.url.database} was created without AUTOINCREMENT ids and "
+                                     f"can only be the first shard")
+                continue
+            seq = conn.exec_driver_sql("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).scalar()
+            if seq is None:
+                conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, offset))
+            elif not offset <= seq < offset + SHARD_ID_STRIDE:
+                raise ValueError(f"{engine.url.database} holds {table} ids of shard {seq // SHARD_ID_STRIDE}, "
+                                 f"not shard {index}; keep the shard files in the same order")
+
+
+def _interleave(results, limit):
+    # Ranks are only comparable within a shard, so ranked lists are merged round-robin
+    merged = [row for group in zip_longest(*results) for row in group if row is not None]
+    return merged[:limit]
+
+
+class ShardedCarRentalSystem:
+    # Spreads cars, customers and their rentals over one SQLite file per branch, each served
+    # by its own CarRentalSystem. Operations on one car, customer or rental go to the shard
+    # its id belongs to; listings and searches run on every shard at once on a thread pool
+    # and their results are merged. A rental's car and customer must share a branch.
+
+    def __init__(self, db_names, default_branch=None, cache_size=0, cache_ttl=None, profiler=None,
+                 replica_max_age=None, replica_max_writes=None, max_workers=None):
+        self.branches = [os.path.splitext(os.path.basename(name))[0] for name in db_names]
+        self.db_names = list(db_names)
+        # New cars and customers go to this branch; without one they are spread by a hash
+        # of their unique key, which also keeps that key unique across shards
+        self.default_branch = default_branch
+        self._branch_index(default_branch)
+        self._shards = [CarRentalSystem(name, cache_size, cache_ttl, profiler, replica_max_age, replica_max_writes)
+                        for name in db_names]
+        self._prepared = False
+        self._pool = ThreadPoolExecutor(max_workers or len(self._shards))
+
+    @property
+    def shards(self):
+        if not self._prepared:
+            for index, shard in enumerate(self._shards):
+                prepare_shard(shard.engine, index)
+            self._prepared = True
+        return self._shards
+
+    def close(self):
+        self._pool.shutdown()
+        for shard in self._shards:
+            if shard._session is not None:
+                shard.session.close()
+
+    def _branch_index(self, branch):
+        if branch is None:
+            return None
+        if str(branch) in self.branches:
+            return self.branches.index(str(branch))
+        raise ValueError(f"Unknown branch '{branch}'; choose from {', '.join(self.branches)}")
+
+    def shard_index(self, entity_id):
+        try:
+            index = int(entity_id) // SHARD_ID_STRIDE
+        except (TypeError, ValueError):
+            return None
+        return index if 0 <= index < len(self._shards) else None
+
+    def _owner(self, entity_id):
+        # An id outside every shard's block is looked up in the first shard, which reports
+        # it as not found in the usual way
+        return self.shards[self.shard_index(entity_id) or 0]
+
+    def _route_new(self, key, branch=None):
+        index = self._branch_index(branch if branch is not None else self.default_branch)
+        if index is None:
+            index = zlib.crc32(str(key).encode()) % len(self._shards)
+        return self.shards[index]
+
+    def _fan_out(self, call):
+        return list(self._pool.map(call, self.shards))
+
+    def _merged(self, call):
+        return sorted(chain.from_iterable(self._fan_out(call)), key=attrgetter('id'))
+
+    def _page(self, get_page, page_size, after_id=None, before_id=None):
+        rows = self._merged(lambda shard: get_page(shard)(page_size, after_id, before_id))
+        return rows[-page_size:] if before_id is not None else rows[:page_size]
+
+    def _first(self, call):
+        return next((row for row in self._fan_out(call) if row is not None), None)
+
+    def _upsert(self, name, clean, key, records, update):
+        # Each shard upserts its own share of the records in parallel; statuses and errors
+        # are put back in the order the records were given
+        records = list(records)
+        parts = {}
+        for index, record in enumerate(records):
+            row, _ = clean(record)
+            shard = self._route_new(row[key] if row else None)
+            parts.setdefault(shard, []).append(index)
+
+        shards = list(parts)
+        results = list(self._pool.map(
+            lambda shard: getattr(shard, name)([records[index] for index in parts[shard]], update), shards
+        ))
+        if all(result is None for result in results):
+            return None
+        statuses, errors = [None] * len(records), {}
+        for shard, result in zip(shards, results):
+            for position, index in enumerate(parts[shard]):
+                statuses[index] = result['statuses'][position] if result else 'failed'
+                if result and position in result['errors']:
+                    errors[index] = result['errors'][position]
+        return {
+            'created': statuses.count('created'),
+            'updated': statuses.count('updated'),
+            'unchanged': statuses.count('unchanged'),
+            'rejected': statuses.count('rejected'),
+            'failed': statuses.count('failed'),
+            'statuses': statuses,
+            'errors': errors,
+        }
+
+    def _bulk(self, call, counts):
+        results = [result for result in self._fan_out(call) if result is not None]
+        if not results:
+            return None
+        combined = {count: sum(result[count] for result in results) for count in counts}
+        combined['ids'] = sorted(chain.from_iterable(result['ids'] for result in results))
+        return combined
+
+    # Cars:
+    def add_car(self, make, model, year, branch=None):
+        return self._route_new(str(model).strip(), branch).add_car(make, model, year)
+
+    def upsert_cars(self, records, update=False):
+        return self._upsert('upsert_cars', _clean_car, 'model', records, update)
+
+    def get_all_cars(self):
+        return self._merged(lambda shard: shard.get_all_cars())
+
+    def get_cars_page(self, page_size=20, after_id=None, before_id=None):
+        return self._page(attrgetter('get_cars_page'), page_size, after_id, before_id)
+
+    def find_car_by_id(self, car_id):
+        return self._owner(car_id).find_car_by_id(car_id)
+
+    def find_car_by_name(self, make, model):
+        car = self._first(lambda shard: shard.session.query(Car).filter_by(make=make, model=model).first())
+        if car is None:
+            print(f"Car with make '{make}' and model '{model}' not found.")
+        return car
+
+    def get_car_records(self, page_size=20, after_id=None, before_id=None):
+        return self._page(attrgetter('get_car_records'), page_size, after_id, before_id)
+
+    def get_all_car_records(self):
+        return self._merged(lambda shard: shard.get_all_car_records())
+
+    def find_car_record_by_id(self, car_id, fresh=False):
+        return self._owner(car_id).find_car_record_by_id(car_id, fresh)
+
+    def find_car_record_by_name(self, make, model):
+        return self._first(lambda shard: shard.find_car_record_by_name(make, model))
+
+    def find_available_cars(self, start_date, end_date, make=None):
+        return self._merged(lambda shard: shard.find_available_cars(start_date, end_date, make))
+
+    def update_car(self, car_id, new_make=None, new_model=None, new_year=None, expected_version=None):
+        return self._owner(car_id).update_car(car_id, new_make, new_model, new_year, expected_version)
+
+    def delete_car(self, car_id):
+        return self._owner(car_id).delete_car(car_id)
+
+    def bulk_update_cars(self, filter, values):
+        return self._bulk(lambda shard: shard.bulk_update_cars(filter, values), ('updated',))
+
+    def bulk_delete_cars(self, filter):
+        return self._bulk(lambda shard: shard.bulk_delete_cars(filter), ('deleted', 'rentals_deleted'))
+
+    def search_cars(self, query, limit=10):
+        return _interleave(self._fan_out(lambda shard: shard.search_cars(query, limit)), limit)
+
+    # Customers:
+    def add_customer(self, first_name, last_name, phone_no, branch=None):
+        row, _ = _clean_customer({'first_name': first_name, 'last_name': last_name, 'phone_no': phone_no})
+        return self._route_new(row and row['phone_no'], branch).add_customer(first_name, last_name, phone_no)
+
+    def upsert_customers(self, records, update=False):
+        return self._upsert('upsert_customers', _clean_customer, 'phone_no', records, update)
+
+    def get_all_customers(self):
+        return self._merged(lambda shard: shard.get_all_customers())
+
+    def get_customers_page(self, page_size=20, after_id=None, before_id=None):
+        return self._page(attrgetter('get_customers_page'), page_size, after_id, before_id)
+
+    def find_customer_by_id(self, customer_id):
+        return self._owner(customer_id).find_customer_by_id(customer_id)
+
+    def find_customer_by_name(self, first_name, last_name):
+        customer = self._first(
+            lambda shard: shard.session.query(Customer).filter_by(first_name=first_name, last_name=last_name).first()
+        )
+        if customer is None:
+            print(f"Customer with first name '{first_name}' and last '{last_name}' not found.")
+        return customer
+
+    def get_customer_records(self, page_size=20, after_id=None, before_id=None):
+        return self._page(attrgetter('get_customer_records'), page_size, after_id, before_id)
+
+    def get_all_customer_records(self):
+        return self._merged(lambda shard: shard.get_all_customer_records())
+
+    def find_customer_record_by_id(self, customer_id, fresh=False):
+        return self._owner(customer_id).find_customer_record_by_id(customer_id, fresh)
+
+    def find_customer_record_by_name(self, first_name, last_name):
+        return self._first(lambda shard: shard.find_customer_record_by_name(first_name, last_name))
+
+    def update_customer(self, customer_id, new_first_name=None, new_last_name=None, new_phone_no=None,
+                        expected_version=None):
+        return self._owner(customer_id).update_customer(customer_id, new_first_name, new_last_name, new_phone_no,
+                                                        expected_version)
+
+    def delete_customer(self, customer_id):
+        return self._owner(customer_id).delete_customer(customer_id)
+
+    def bulk_update_customers(self, filter, values):
+        return self._bulk(lambda shard: shard.bulk_update_customers(filter, values), ('updated',))
+
+    def bulk_delete_customers(self, filter):
+        return self._bulk(lambda shard: shard.bulk_delete_customers(filter), ('deleted', 'rentals_deleted'))
+
+    def search_customers(self, query, limit=10):
+        return _interleave(self._fan_out(lambda shard: shard.search_customers(query, limit)), limit)
+
+    # Rentals:
+    def register_customer_to_car(self, customer_id, car_id, start_date=None, end_date=None):
+        customer_shard, car_shard = self.shard_index(customer_id), self.shard_index(car_id)
+        if customer_shard is not None and car_shard is not None and customer_shard != car_shard:
+            print(f"Error: Customer {customer_id} belongs to branch '{self.branches[customer_shard]}' and car "
+                  f"{car_id} to branch '{self.branches[car_shard]}'; a rental must stay within one branch")
+            return False
+        return self._owner(car_id).register_customer_to_car(customer_id, car_id, start_date, end_date)
+
+    def allocate_cars(self, requests):
+        # Each request is allocated within its customer's branch; the shards run in parallel
+        requests = list(requests)
+        parts = {}
+        for index, request in enumerate(requests):
+            customer_id = request.get('customer_id') if isinstance(request, dict) else None
+            parts.setdefault(self.shard_index(customer_id) or 0, []).append(index)
+
+        started = time.perf_counter()
+        indexes = list(parts)
+        results = list(self._pool.map(
+            lambda index: self.shards[index].allocate_cars([requests[n] for n in parts[index]]), indexes
+        ))
+        if all(result is None for result in results):
+            return None
+        car_ids, errors = [None] * len(requests), {}
+        for shard_index, result in zip(indexes, results):
+            for position, index in enumerate(parts[shard_index]):
+                if result is None:
+                    errors[index] = "Error: the branch's allocation failed"
+                    continue
+                car_ids[index] = result['car_ids'][position]
+                if position in result['errors']:
+                    errors[index] = result['errors'][position]
+        assigned = sum(car_id is not None for car_id in car_ids)
+        return {
+            'assigned': assigned,
+            'rejected': len(requests) - assigned,
+            'car_ids': car_ids,
+            'errors': errors,
+            'elapsed': time.perf_counter() - started,
+        }
+
+    def delete_rental(self, rental_id):
+        return self._owner(rental_id).delete_rental(rental_id)
+
+    def get_customers_in_a_car(self, car_id):
+        return self._owner(car_id).get_customers_in_a_car(car_id)
+
+    def get_rental_history_for_car(self, car_id):
+        return self._owner(car_id).get_rental_history_for_car(car_id)
+
+    def get_rental_history_for_customer(self, customer_id):
+        return self._owner(customer_id).get_rental_history_for_customer(customer_id)
+
+    def get_cars_with_current_renter(self, on=None):
+        rows = chain.from_iterable(self._fan_out(lambda shard: shard.get_cars_with_current_renter(on)))
+        return sorted(rows, key=lambda row: row[0].id)
+
+    # Billing: a customer's rentals are all in its branch, so each branch bills its own
+    def price_customer(self, customer_id, rates=None, method=None):
+        return self._owner(customer_id).price_customer(customer_id, rates, method)
+
+    def bill_month(self, month, rates=None, method=None, chunk_size=50000):
+        started = time.perf_counter()
+        results = self._fan_out(lambda shard: shard.bill_month(month, rates, method, chunk_size))
+        if any(result is None for result in results):
+            return None
+        return {
+            'month': month,
+            'invoices': sum(result['invoices'] for result in results),
+            'rentals': sum(result['rentals'] for result in results),
+            'amount': round(sum(result['amount'] for result in results), 2),
+            'elapsed': time.perf_counter() - started,
+        }
+
+    def get_invoices(self, month):
+        return sorted(chain.from_iterable(self._fan_out(lambda shard: shard.get_invoices(month))),
+                      key=attrgetter('customer_id'))
+
+    def utilization_report(self, group_by=('make',), start_month=None, end_month=None):
+        # Every shard reports over the same months, so rows for the same group can be
+        # added together and their utilization recomputed from the totals
+        if start_month is None or end_month is None:
+            bounds = self._fan_out(lambda shard: shard.session.execute(
+                select(func.min(CarMonthUsage.month), func.max(CarMonthUsage.month))
+            ).one())
+            start_month = start_month or min((first for first, _ in bounds if first), default=None)
+            end_month = end_month or max((last for _, last in bounds if last), default=None)
+        if start_month is None or end_month is None:
+            return []
+
+        reports = self._fan_out(lambda shard: shard.utilization_report(group_by, start_month, end_month))
+        merged = {}
+        for row in chain.from_iterable(reports):
+            group = tuple((name, value) for name, value in row.items() if name not in REPORT_MEASURES)
+            total = merged.setdefault(group, {**dict(group), 'bookings': 0, 'rental_days': 0})
+            total['bookings'] += row['bookings']
+            total['rental_days'] += row['rental_days']
+
+        # A shard with no rentals in a month has no row for it, but its cars still count
+        # towards that month's capacity, so cars are counted across all shards separately
+        car_columns = [column for key in group_by if key != 'month' for column in GROUPINGS[key]]
+        fleet = Counter()
+        for rows in self._fan_out(lambda shard: shard.session.execute(
+            select(*car_columns, func.count(Car.id)).group_by(*car_columns)
+        ).all()):
+            for row in rows:
+                fleet[tuple(row[:-1])] += row[-1]
+
+        period_days = sum(_month_days(month) for month in _months_between(start_month, end_month))
+        for total in merged.values():
+            total['cars'] = fleet[tuple(total[column.key] for column in car_columns)]
+            days = _month_days(total['month']) if 'month' in total else period_days
+            total['utilization'] = total['rental_days'] / (total['cars'] * days) if total['cars'] else 0.0
+        return list(merged.values())
@@ -0,0 +1,126 @@
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+
+# CarRentalSystem methods that may be queued; they are the ones that write
+QUEUED_OPERATIONS = {
+    'add_car', 'update_car', 'delete_car',
+    'add_customer', 'update_customer', 'delete_customer',
+    'register_customer_to_car', 'delete_rental',
+    'upsert_car', 'upsert_cars', 'upsert_customer', 'upsert_customers',
+    'bulk_update_cars', 'bulk_update_customers', 'bulk_delete_cars', 'bulk_delete_customers',
+}
+_STOP = object()
+
+
+class WriteQueue:
+    # Group commit: callers submit writes from any thread and get a Future back, while one
+    # writer thread applies them in a single transaction per group. A group closes after
+    # max_group operations or max_delay seconds, whichever comes first, so many writes share
+    # one fsync. Every operation runs in its own savepoint, so one that fails (a broken
+    # constraint, a double booking) is undone alone and the rest of its group still commits.
+    # Futures resolve only after their group has committed.
+
+    def __init__(self, car_rental_system, max_delay=0.005, max_group=100, on_commit=None):
+        # car_rental_system is used only by the writer thread from here on
+        self.car_rental_system = car_rental_system
+        self.max_delay = max_delay
+        self.max_group = max_group
+        self.on_commit = on_commit
+        self.groups = 0
+        self.operations = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+        self._thread.start()
+
+    def submit(self, operation, *args, **kwargs):
+        if operation not in QUEUED_OPERATIONS:
+            raise ValueError(f"Unknown operation '{operation}'; choose from {', '.join(sorted(QUEUED_OPERATIONS))}")
+        if self._closed:
+            raise RuntimeError("The write queue is closed")
+        future = Future()
+        self._queue.put((future, operation, args, kwargs))
+        return future
+
+    def close(self):
+        # Applies everything already submitted, then stops the writer thread
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self):
+        return {
+            'groups': self.groups,
+            'operations': self.operations,
+            'operations_per_group': round(self.operations / self.groups, 2) if self.groups else 0,
+            'queued': self._queue.qsize(),
+        }
+
+    def _next_group(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        group = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(group) < self.max_group:
+            try:
+                entry = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                # Finish this group, then stop
+                self._queue.put(_STOP)
+                break
+            group.append(entry)
+        return group
+
+    def _run(self):
+        while True:
+            group = self._next_group()
+            if group is None:
+                return
+            self._apply(group)
+
+    def _apply(self, group):
+        car_rental_system = self.car_rental_system
+        outcomes = []
+        try:
+            with car_rental_system.transaction():
+                for future, operation, args, kwargs in group:
+                    if not future.set_running_or_notify_cancel():
+                        outcomes.append(None)
+                        continue
+                    try:
+                        with car_rental_system.savepoint():
+                            outcomes.append((getattr(car_rental_system, operation)(*args, **kwargs), None))
+                    except Exception as exc:
+                        outcomes.append((None, exc))
+        except Exception as exc:
+            # The commit itself failed, so nothing in the group took effect
+            for future, *_ in group:
+                if future.running():
+                    future.set_exception(exc)
+            return
+
+        self.groups += 1
+        self.operations += len(group)
+        if self.on_commit is not None:
+            self.on_commit(len(group))
+        for (future, *_), outcome in zip(group, outcomes):
+            if outcome is None:
+                continue
+            result, exc = outcome
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
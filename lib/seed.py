@@ -0,0 +1,94 @@
+from models.car_rental_system_cli import CarRentalSystem, Car, Customer, Rental
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+import argparse
+import random
+
+
+MAKES = {
+    "Toyota": ["Camry", "Corolla", "RAV4", "Land Cruiser"],
+    "BMW": ["X6", "X5", "320i", "M4"],
+    "Audi": ["A4 Avant", "Q5", "A6", "TT"],
+    "Honda": ["Elegance", "Civic", "CR-V", "Fit"],
+    "Ford": ["Mustang", "Ranger", "Focus", "Explorer"],
+    "Chevrolet": ["Corvette", "Camaro", "Tahoe", "Spark"],
+    "Subaru": ["Forester", "Outback", "Impreza", "Legacy"],
+    "Aston Martin": ["DBX", "Vantage", "DB11", "Rapide"],
+}
+FIRST_NAMES = ["John", "Maru", "Dennis", "Doris", "Allen", "Mulei", "Mutua", "Jane", "Achieng", "Wanjiru"]
+LAST_NAMES = ["Doe", "Junior", "Kioko", "Kerubo", "Shamrock", "Archy", "James", "Ruto", "Otieno", "Kamau"]
+HISTORY_START = datetime(2020, 1, 1)
+
+
+def generate_cars(count, rng):
+    makes = sorted(MAKES)
+    for n in range(count):
+        make = rng.choice(makes)
+        # model is unique, so every generated car gets its own model name
+        yield {'make': make, 'model': f"{rng.choice(MAKES[make])} {n + 1}", 'year': rng.randint(2005, 2024)}
+
+
+def generate_customers(count, rng):
+    for n in range(count):
+        yield {
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES),
+            'phone_no': 700000000 + n,
+        }
+
+
+def generate_rentals(count, cars, customers, rng):
+    # Each car's bookings follow one another without overlapping, and every
+    # (customer, car) pair is used once to satisfy _customer_car_uc.
+    next_free = [HISTORY_START] * cars
+    pairs = set()
+    produced = 0
+    while produced < count:
+        car = rng.randrange(cars)
+        customer = rng.randrange(customers)
+        if (customer, car) in pairs:
+            continue
+        pairs.add((customer, car))
+        start_date = next_free[car] + timedelta(days=rng.randint(0, 3))
+        end_date = start_date + timedelta(days=rng.randint(1, 10))
+        next_free[car] = end_date + timedelta(days=1)
+        produced += 1
+        yield {'customer_id': customer + 1, 'car_id': car + 1, 'start_date': start_date, 'end_date': end_date}
+
+
+def _insert_in_batches(session, model, rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            session.execute(insert(model), batch)
+            batch = []
+    if batch:
+        session.execute(insert(model), batch)
+
+
+def populate(car_rental_system, cars, customers, rentals, seed=0, batch_size=10000):
+    # Fills an empty database; the same seed always produces the same rows
+    if rentals and (not cars or not customers or rentals > cars * customers):
+        raise ValueError("Not enough cars and customers for the requested number of rentals")
+    rng = random.Random(seed)
+    session = car_rental_system.session
+    _insert_in_batches(session, Car, generate_cars(cars, rng), batch_size)
+    _insert_in_batches(session, Customer, generate_customers(customers, rng), batch_size)
+    _insert_in_batches(session, Rental, generate_rentals(rentals, cars, customers, rng), batch_size)
+    session.commit()
+    # Rentals were inserted directly, so the usage summary is computed once at the end
+    car_rental_system.rebuild_usage_summary()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill a database with reproducible synthetic data")
+    parser.add_argument("db_name")
+    parser.add_argument("--cars", type=int, default=10000)
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--rentals", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    populate(CarRentalSystem(args.db_name), args.cars, args.customers, args.rentals, args.seed)
+    print(f"Added {args.cars} cars, {args.customers} customers and {args.rentals} rentals to {args.db_name}")
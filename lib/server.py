@@ -0,0 +1,336 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from itertools import islice
+from urllib.parse import parse_qs, urlparse
+from models.car_rental_system_cli import CarRentalSystem, _clean_car, _clean_customer, create_pooled_engine
+import argparse
+import io
+import json
+import re
+import sys
+import threading
+
+
+class ThreadStdout:
+    # The CarRentalSystem methods report by printing. While a request is handled its
+    # thread's prints are collected here and returned as the response's message, without
+    # catching what other threads print.
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (buffer if buffer is not None else self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def capture(self):
+        self.local.buffer = io.StringIO()
+
+    def release(self):
+        buffer, self.local.buffer = self.local.buffer, None
+        return buffer.getvalue().strip()
+
+
+def _row(record):
+    if record is None:
+        return None
+    if hasattr(record, '_asdict'):
+        return record._asdict()
+    return {column.key: getattr(record, column.key) for column in record.__table__.columns}
+
+
+def _created(result, payload=None):
+    # add_* return True when created, None when the record already exists and False when invalid
+    if result:
+        return 201, payload if payload is not None else {}
+    return (409, {}) if result is None else (400, {})
+
+
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a whole number")
+
+
+# Handlers take (car_rental_system, path parameters, query parameters, JSON body) and
+# return (status, payload). A payload of None means the record was not found.
+def list_cars(system, params, query, body):
+    after_id = query.get('after_id')
+    cars = system.get_car_records(_int(query.get('limit', 20), 'limit'), after_id and _int(after_id, 'after_id'))
+    return 200, [_row(car) for car in cars]
+
+
+def get_car(system, params, query, body):
+    return 200, _row(system.find_car_record_by_id(params['id']))
+
+
+def add_car(system, params, query, body):
+    result = system.add_car(body.get('make'), body.get('model'), body.get('year'))
+    return _created(result, result and _row(system.find_car_record_by_name(body.get('make'), body.get('model'))))
+
+
+def _updated(result, record, body):
+    # A body with "version" is only applied to that version of the record; 409 when it has moved on
+    if result is None:
+        return 404, None
+    if result:
+        return 200, _row(record())
+    current = body.get('version') is not None and record()
+    return (409, {'version': current.version}) if current and current.version != body['version'] else (400, {})
+
+
+def _changes(record, body, fields, clean):
+    # A PATCH body is checked the way POST checks a new record, with the fields it leaves
+    # out taken from the stored one. Fields left out come back as None, i.e. unchanged.
+    if record is None:
+        return dict.fromkeys(fields)
+    cleaned, error = clean({field: body[field] if body.get(field) is not None else getattr(record, field)
+                            for field in fields})
+    if error:
+        raise ValueError(error)
+    return {field: cleaned[field] if body.get(field) is not None else None for field in fields}
+
+
+def update_car(system, params, query, body):
+    changes = _changes(system.find_car_record_by_id(params['id'], fresh=True), body, ('make', 'model', 'year'),
+                       _clean_car)
+    result = system.update_car(params['id'], changes['make'], changes['model'], changes['year'], body.get('version'))
+    return _updated(result, lambda: system.find_car_record_by_id(params['id']), body)
+
+
+def delete_car(system, params, query, body):
+    deleted = system.delete_car(params['id'])
+    return (200, {'deleted': deleted[0]}) if deleted else (404, None)
+
+
+def available_cars(system, params, query, body):
+    if not query.get('start') or not query.get('end'):
+        raise ValueError("start and end are required, as DD/MM/YYYY")
+    try:
+        start, end = (datetime.strptime(query[name], '%d/%m/%Y') for name in ('start', 'end'))
+    except ValueError:
+        raise ValueError("start and end must be dates as DD/MM/YYYY")
+    return 200, [_row(car) for car in system.find_available_cars(start, end, query.get('make'))]
+
+
+def search_cars(system, params, query, body):
+    return 200, [_row(car) for car in system.search_cars(query.get('q', ''), _int(query.get('limit', 10), 'limit'))]
+
+
+def car_rentals(system, params, query, body):
+    return 200, [{**_row(rental), 'customer': _row(rental.customer)}
+                 for rental in system.get_rental_history_for_car(params['id'])]
+
+
+def list_customers(system, params, query, body):
+    after_id = query.get('after_id')
+    customers = system.get_customer_records(_int(query.get('limit', 20), 'limit'), after_id and _int(after_id, 'after_id'))
+    return 200, [_row(customer) for customer in customers]
+
+
+def get_customer(system, params, query, body):
+    return 200, _row(system.find_customer_record_by_id(params['id']))
+
+
+def add_customer(system, params, query, body):
+    return _created(system.add_customer(body.get('first_name'), body.get('last_name'), body.get('phone_no')))
+
+
+def update_customer(system, params, query, body):
+    changes = _changes(system.find_customer_record_by_id(params['id'], fresh=True), body,
+                       ('first_name', 'last_name', 'phone_no'), _clean_customer)
+    result = system.update_customer(params['id'], changes['first_name'], changes['last_name'], changes['phone_no'],
+                                    body.get('version'))
+    return _updated(result, lambda: system.find_customer_record_by_id(params['id']), body)
+
+
+def delete_customer(system, params, query, body):
+    deleted = system.delete_customer(params['id'])
+    return (200, {'deleted': deleted[0]}) if deleted else (404, None)
+
+
+def search_customers(system, params, query, body):
+    return 200, [_row(customer) for customer in system.search_customers(query.get('q', ''),
+                                                                       _int(query.get('limit', 10), 'limit'))]
+
+
+def customer_rentals(system, params, query, body):
+    return 200, [{**_row(rental), 'car': _row(rental.car)}
+                 for rental in system.get_rental_history_for_customer(params['id'])]
+
+
+def add_rental(system, params, query, body):
+    result = system.register_customer_to_car(body.get('customer_id'), body.get('car_id'),
+                                             body.get('start_date'), body.get('end_date'))
+    return (201, {}) if result else (409, {})
+
+
+def allocate_rentals(system, params, query, body):
+    requests = body.get('requests')
+    if not isinstance(requests, list):
+        raise ValueError("requests must be a list of {customer_id, start_date, end_date, filter}")
+    report = system.allocate_cars(requests)
+    if report is None:
+        return 500, {}
+    report['errors'] = {str(index): reason for index, reason in report['errors'].items()}
+    return 200, report
+
+
+def delete_rental(system, params, query, body):
+    deleted = system.delete_rental(params['id'])
+    return (200, {'deleted': deleted[0]}) if deleted else (404, None)
+
+
+def changes(system, params, query, body):
+    # At most limit entries after since; ask again with since=last_seq for the next page
+    since, limit = _int(query.get('since', 0), 'since'), _int(query.get('limit', 1000), 'limit')
+    tables = [table for table in query.get('tables', '').split(',') if table] or None
+    entries = list(islice(system.changes_since(since, tables, max(limit, 1)), limit))
+    return 200, {'changes': entries, 'last_seq': entries[-1]['seq'] if entries else since}
+
+
+def utilization(system, params, query, body):
+    group_by = [key for key in query.get('group_by', 'make').split(',') if key]
+    return 200, system.utilization_report(group_by, query.get('start'), query.get('end'))
+
+
+ROUTES = [
+    ('GET', r'/cars', list_cars),
+    ('POST', r'/cars', add_car),
+    ('GET', r'/cars/available', available_cars),
+    ('GET', r'/cars/search', search_cars),
+    ('GET', r'/cars/(?P<id>\d+)', get_car),
+    ('PATCH', r'/cars/(?P<id>\d+)', update_car),
+    ('DELETE', r'/cars/(?P<id>\d+)', delete_car),
+    ('GET', r'/cars/(?P<id>\d+)/rentals', car_rentals),
+    ('GET', r'/customers', list_customers),
+    ('POST', r'/customers', add_customer),
+    ('GET', r'/customers/search', search_customers),
+    ('GET', r'/customers/(?P<id>\d+)', get_customer),
+    ('PATCH', r'/customers/(?P<id>\d+)', update_customer),
+    ('DELETE', r'/customers/(?P<id>\d+)', delete_customer),
+    ('GET', r'/customers/(?P<id>\d+)/rentals', customer_rentals),
+    ('POST', r'/rentals', add_rental),
+    ('POST', r'/rentals/allocate', allocate_rentals),
+    ('DELETE', r'/rentals/(?P<id>\d+)', delete_rental),
+    ('GET', r'/reports/utilization', utilization),
+    ('GET', r'/changes', changes),
+]
+ROUTES = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in ROUTES]
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    def _handle(self):
+        url = urlparse(self.path)
+        found, handler, params = False, None, {}
+        for method, pattern, route_handler in ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                found = True
+                if method == self.command:
+                    handler, params = route_handler, match.groupdict()
+                    break
+        if handler is None:
+            if found:
+                return self._send(405, {'error': f"{self.command} is not allowed on {url.path}"})
+            return self._send(404, {'error': f"No such resource {url.path}"})
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+        except ValueError:
+            return self._send(400, {'error': "The body must be a JSON object"})
+
+        # Every request gets its own CarRentalSystem and session on the shared pooled engine
+        system = CarRentalSystem(self.server.db_name, engine=self.server.engine)
+        self.server.stdout.capture()
+        try:
+            status, payload = handler(system, params, query, body if isinstance(body, dict) else {})
+        except ValueError as exc:
+            status, payload = 400, {'error': str(exc)}
+        except Exception as exc:
+            status, payload = 500, {'error': str(exc)}
+        finally:
+            message = self.server.stdout.release()
+            if system._session is not None:
+                system.session.close()
+        if payload is None:
+            status, payload = 404, {'error': message or "Not found"}
+        elif isinstance(payload, dict) and message and status >= 400:
+            payload.setdefault('error', message)
+        self._send(status, payload, message)
+
+    def _send(self, status, payload, message=None):
+        body = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if message:
+            self.send_header('X-Message', ' '.join(message.split())[:200].encode('ascii', 'replace').decode())
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class ServiceHTTPServer(HTTPServer):
+    # Requests are handled on a fixed pool of worker threads, each needing at most one
+    # connection from the engine's pool at a time
+    request_queue_size = 128
+
+    def __init__(self, address, db_name, workers=8, busy_timeout_ms=5000, quiet=False):
+        super().__init__(address, RequestHandler)
+        self.db_name = db_name
+        self.engine = create_pooled_engine(db_name, workers, busy_timeout_ms)
+        self.quiet = quiet
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='request')
+        if not isinstance(sys.stdout, ThreadStdout):
+            sys.stdout = ThreadStdout(sys.stdout)
+        self.stdout = sys.stdout
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+        self.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Car Rental System JSON API")
+    parser.add_argument("--db", default="car_rental_database.db")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=8, help="request threads, and database connections")
+    parser.add_argument("--busy-timeout-ms", type=int, default=5000, help="how long a write waits for the database lock")
+    parser.add_argument("--quiet", action="store_true", help="do not log every request")
+    args = parser.parse_args()
+
+    server = ServiceHTTPServer((args.host, args.port), args.db, args.workers, args.busy_timeout_ms, args.quiet)
+    print(f"Serving {args.db} on http://{args.host}:{server.server_port} with {args.workers} workers", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()